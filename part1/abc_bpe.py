@@ -0,0 +1,237 @@
+# abc_bpe.py
+# ABC-aware byte-pair encoding.
+# Texts are first cut into pre-tokens with the tokenize_abc.py scanner (notes,
+# durations, bar lines, chords, headers, ...), each keeping one leading space,
+# plus the remaining whitespace chars, so merges never cross a musical token
+# boundary and decoding is lossless. Merges are learned from pre-token counts with a pair-count heap:
+# each merge only touches the words that contain the merged pair.
+# Output: ../data/abc_bpe.json (alphabet + ordered merges), read by
+# AbcBPE.load() and by data/abc_bpe/prepare_abc_bpe.py.
+
+import re
+import json
+import heapq
+import random
+import argparse
+import multiprocessing as mp
+from collections import Counter, defaultdict
+
+from tqdm import tqdm
+
+from corpus_manifest import CorpusManifest, MANIFEST_DIR
+from tokenize_abc import SCAN_PATTERN
+
+BPE_PATH = "../data/abc_bpe.json"
+VOCAB_SIZE = 4096        # fits the uint16 .bin files
+MAX_FILES = 200_000      # random manifest sample used for training
+NUM_WORKERS = 16
+
+# a scanner token with at most one leading space (like GPT-2's " word"), or
+# any other whitespace char on its own
+PRETOKEN_PATTERN = re.compile(
+    r"[ ]?(?:" + SCAN_PATTERN.pattern + r""")
+    | \s
+""",
+    re.VERBOSE,
+)
+
+
+def pretokenize(text: str):
+    return PRETOKEN_PATTERN.findall(text)
+
+
+def count_pretokens(paths):
+    """Pre-token counts of a chunk of files (worker)."""
+    counts = Counter()
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                counts.update(pretokenize(f.read()))
+        except OSError:
+            continue
+    return counts
+
+
+def train_bpe(word_counts: Counter, vocab_size: int):
+    """
+    Learn merges from {pre-token: count}.
+    Returns (alphabet, merges): sorted base chars and the ordered (left id, right id)
+    merges; merge r creates token id len(alphabet) + r.
+    """
+    alphabet = sorted({ch for w in word_counts for ch in w})
+    sym = {ch: i for i, ch in enumerate(alphabet)}
+    names = list(alphabet)
+
+    words = [[sym[ch] for ch in w] for w in word_counts]
+    freqs = list(word_counts.values())
+
+    pair_counts = defaultdict(int)
+    where = defaultdict(set)
+    for wi, w in enumerate(words):
+        for pair in zip(w, w[1:]):
+            pair_counts[pair] += freqs[wi]
+            where[pair].add(wi)
+
+    # max-heap with lazy invalidation: stale entries are skipped on pop
+    heap = [(-c, pair) for pair, c in pair_counts.items()]
+    heapq.heapify(heap)
+
+    merges = []
+    pbar = tqdm(total=max(vocab_size - len(alphabet), 0), desc="BPE merges")
+    while len(names) < vocab_size and heap:
+        neg, pair = heapq.heappop(heap)
+        if pair_counts.get(pair, 0) != -neg:
+            continue
+        if -neg < 2:
+            break
+
+        new_id = len(names)
+        names.append(names[pair[0]] + names[pair[1]])
+        merges.append(pair)
+
+        changed = set()
+        for wi in where.pop(pair):
+            w, f = words[wi], freqs[wi]
+            for p in zip(w, w[1:]):
+                pair_counts[p] -= f
+                changed.add(p)
+            merged, i = [], 0
+            while i < len(w):
+                if i + 1 < len(w) and (w[i], w[i + 1]) == pair:
+                    merged.append(new_id)
+                    i += 2
+                else:
+                    merged.append(w[i])
+                    i += 1
+            words[wi] = merged
+            for p in zip(merged, merged[1:]):
+                pair_counts[p] += f
+                where[p].add(wi)
+                changed.add(p)
+
+        for p in changed:
+            c = pair_counts[p]
+            if c > 0:
+                heapq.heappush(heap, (-c, p))
+            else:
+                del pair_counts[p]
+                where.pop(p, None)
+        pbar.update(1)
+    pbar.close()
+    return alphabet, merges
+
+
+class AbcBPE:
+    """
+    Encoder/decoder for a trained merge list.
+    Token ids: 0..len(alphabet)-1 are the single chars (sorted), then one id per merge.
+    Two merges can spell the same string; `stoi` keeps the first id, which is
+    all that char-by-char prompt encoding (sample.py) needs.
+    """
+
+    def __init__(self, alphabet, merges):
+        self.alphabet = list(alphabet)
+        self.merges = [tuple(m) for m in merges]
+        self.itos = {i: ch for i, ch in enumerate(self.alphabet)}
+        self.merged = {}
+        for a, b in self.merges:
+            self.merged[(a, b)] = len(self.itos)
+            self.itos[len(self.itos)] = self.itos[a] + self.itos[b]
+        self.stoi = {}
+        for i, s in self.itos.items():
+            self.stoi.setdefault(s, i)
+        self._cache = {}
+
+    @property
+    def vocab_size(self):
+        return len(self.itos)
+
+    @classmethod
+    def load(cls, path: str = BPE_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["alphabet"], d["merges"])
+
+    def save(self, path: str = BPE_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"alphabet": self.alphabet, "merges": self.merges}, f, ensure_ascii=False)
+
+    def _encode_piece(self, piece: str):
+        # merge ids grow with their rank, so the lowest new id is the earliest merge
+        merged_id, never = self.merged, len(self.itos)
+        ids = [self.stoi[ch] for ch in piece if ch in self.stoi]
+        while len(ids) > 1:
+            best = min(zip(ids, ids[1:]), key=lambda p: merged_id.get(p, never))
+            new_id = merged_id.get(best)
+            if new_id is None:
+                break
+            merged, i = [], 0
+            while i < len(ids):
+                if i + 1 < len(ids) and (ids[i], ids[i + 1]) == best:
+                    merged.append(new_id)
+                    i += 2
+                else:
+                    merged.append(ids[i])
+                    i += 1
+            ids = merged
+        return ids
+
+    def encode(self, text: str):
+        """Token ids of `text`; chars outside the alphabet are dropped (as in abc_char)."""
+        out = []
+        cache = self._cache
+        for piece in pretokenize(text):
+            ids = cache.get(piece)
+            if ids is None:
+                ids = cache[piece] = self._encode_piece(piece)
+            out.extend(ids)
+        return out
+
+    def decode(self, ids):
+        return "".join(self.itos[int(i)] for i in ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default=None,
+                        help="file list to train on (default: sample of the corpus manifest)")
+    parser.add_argument("--out", type=str, default=BPE_PATH)
+    parser.add_argument("--vocab_size", type=int, default=VOCAB_SIZE)
+    parser.add_argument("--max_files", type=int, default=MAX_FILES)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    if args.index:
+        with open(args.index, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip()]
+    else:
+        manifest = CorpusManifest(MANIFEST_DIR)
+        paths = [p for p, size in zip(manifest.paths, manifest.byte_size.tolist()) if size > 0]
+    if len(paths) > args.max_files:
+        paths = random.Random(0).sample(paths, args.max_files)
+    print(f"[INFO] Training on {len(paths):,} files")
+
+    chunks = [paths[i:i + 256] for i in range(0, len(paths), 256)]
+    word_counts = Counter()
+    with mp.Pool(args.workers) as pool:
+        for c in tqdm(pool.imap_unordered(count_pretokens, chunks), total=len(chunks), desc="Pre-tokens"):
+            word_counts.update(c)
+    print(f"[INFO] Distinct pre-tokens: {len(word_counts):,}")
+
+    alphabet, merges = train_bpe(word_counts, args.vocab_size)
+    bpe = AbcBPE(alphabet, merges)
+    bpe.save(args.out)
+
+    n_chars = sum(len(w) * c for w, c in word_counts.items())
+    n_tokens = sum(len(bpe._encode_piece(w)) * c for w, c in word_counts.items())
+
+    print("\n===== BPE DONE =====")
+    print(f"Alphabet      : {len(alphabet)}")
+    print(f"Merges        : {len(merges):,}")
+    print(f"Vocab size    : {bpe.vocab_size:,}")
+    print(f"Chars/token   : {n_chars / max(n_tokens, 1):.2f}")
+    print(f"Saved to      : {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+/*
+ * abc_scan.c: the scanner behind AbcTokenizer (tokenize_abc.py).
+ * One left-to-right pass over a chunk of texts joined by "\n", given as UTF-32
+ * code points. It yields the tokens of tokenize_abc_text() (same alternatives,
+ * same order, each token decided by the char it starts with, no backtracking)
+ * and gives them chunk-local ids in order of first appearance.
+ * tokenize_abc.py builds it with the system C compiler and loads it via ctypes.
+ */
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define SPACE 1  /* str.isspace() */
+#define BREAK 2  /* str.splitlines() boundary */
+#define NOTE 4   /* A-G a-g */
+#define NUM 8    /* 0-9 / */
+#define DIGIT 16 /* 0-9 */
+#define ALPHA 32 /* A-Z a-z */
+#define OCT 64   /* , ' */
+
+static uint8_t cls[128];
+
+static void init_classes(void)
+{
+    int c;
+    if (cls[' '])
+        return;
+    for (c = 9; c <= 13; c++)
+        cls[c] = SPACE | BREAK;
+    cls['\t'] = SPACE;
+    for (c = 0x1c; c <= 0x1e; c++)
+        cls[c] = SPACE | BREAK;
+    cls[0x1f] = SPACE;
+    cls[' '] = SPACE;
+    for (c = 'A'; c <= 'Z'; c++)
+        cls[c] = ALPHA;
+    for (c = 'a'; c <= 'z'; c++)
+        cls[c] = ALPHA;
+    for (c = 'A'; c <= 'G'; c++)
+        cls[c] |= NOTE;
+    for (c = 'a'; c <= 'g'; c++)
+        cls[c] |= NOTE;
+    for (c = '0'; c <= '9'; c++)
+        cls[c] = NUM | DIGIT;
+    cls['/'] = NUM;
+    cls[','] = OCT;
+    cls['\''] = OCT;
+}
+
+static int has(uint32_t c, int flag)
+{
+    return c < 128 && (cls[c] & flag);
+}
+
+static int is_space(uint32_t c)
+{
+    if (c < 128)
+        return cls[c] & SPACE;
+    return c == 0x85 || c == 0xa0 || c == 0x1680 || (c >= 0x2000 && c <= 0x200a) || c == 0x2028 ||
+           c == 0x2029 || c == 0x202f || c == 0x205f || c == 0x3000;
+}
+
+static int is_break(uint32_t c)
+{
+    if (c < 128)
+        return cls[c] & BREAK;
+    return c == 0x85 || c == 0x2028 || c == 0x2029;
+}
+
+/* end of the token starting at t[i] (not a space), scanning at most up to n */
+static int64_t token_end(const uint32_t *t, int64_t i, int64_t n)
+{
+    uint32_t c = t[i];
+    int64_t k = i + 1, m;
+
+    if (c >= 128)
+        return k;
+    switch (c) {
+    case '[': /* \[[^\]\n]+\] */
+        while (k < n && t[k] != ']' && !is_break(t[k]))
+            k++;
+        return (k < n && t[k] == ']' && k > i + 1) ? k + 1 : i + 1;
+    case '(': /* \([0-9]+[A-Za-z]+ */
+        while (k < n && has(t[k], DIGIT))
+            k++;
+        if (k > i + 1) {
+            m = k;
+            while (m < n && has(t[m], ALPHA))
+                m++;
+            if (m > k)
+                return m;
+        }
+        return i + 1;
+    case 'z': /* z[0-9/]* */
+        while (k < n && has(t[k], NUM))
+            k++;
+        return k;
+    case '|': /* \|+ */
+        while (k < n && t[k] == '|')
+            k++;
+        return k;
+    }
+    if (cls[c] & NOTE) { /* [A-Ga-g][,']* */
+        while (k < n && has(t[k], OCT))
+            k++;
+    } else if (cls[c] & NUM) { /* [0-9/]+ */
+        while (k < n && has(t[k], NUM))
+            k++;
+    } else if (cls[c] & ALPHA) { /* [A-Za-z]+:\S+ or \S+ both run to the next space */
+        while (k < n && !is_space(t[k]))
+            k++;
+    }
+    return k;
+}
+
+typedef struct {
+    uint64_t hash;
+    int64_t start;
+    int32_t len;
+    int32_t id; /* -1: empty slot */
+} slot_t;
+
+static int grow(slot_t **table, uint64_t *mask)
+{
+    uint64_t size = (*mask + 1) * 2, i, j;
+    slot_t *old = *table, *t = malloc(size * sizeof(slot_t));
+    if (!t)
+        return -1;
+    for (i = 0; i < size; i++)
+        t[i].id = -1;
+    for (i = 0; i <= *mask; i++) {
+        if (old[i].id < 0)
+            continue;
+        for (j = old[i].hash & (size - 1); t[j].id >= 0; j = (j + 1) & (size - 1))
+            ;
+        t[j] = old[i];
+    }
+    free(old);
+    *table = t;
+    *mask = size - 1;
+    return 0;
+}
+
+/*
+ * Tokenize text[0:n] (texts joined by "\n", ends[d] is the exclusive end of
+ * text d). Writes the id of every token to ids, the token count of every text
+ * to counts (zeroed by the caller) and the first occurrence (start, length) of
+ * every distinct token to vocab_start/vocab_len; ids and the vocab arrays must
+ * hold n entries. Returns the number of distinct tokens, or -1 if out of memory.
+ */
+int64_t abc_encode(const uint32_t *text, int64_t n, const int64_t *ends, int64_t n_docs, int64_t *counts,
+                   int32_t *ids, int64_t *vocab_start, int32_t *vocab_len)
+{
+    uint64_t mask = 4095, h, j;
+    slot_t *table = malloc((mask + 1) * sizeof(slot_t));
+    int64_t i = 0, end, k, n_tok = 0, n_vocab = 0, d = 0;
+    int line_start = 1;
+
+    if (!table)
+        return -1;
+    init_classes();
+    for (j = 0; j <= mask; j++)
+        table[j].id = -1;
+
+    while (i < n) {
+        uint32_t c = text[i];
+        if (is_break(c)) {
+            line_start = 1;
+            i++;
+            continue;
+        }
+        if (line_start && c == '%') { /* comment line */
+            while (i < n && !is_break(text[i]))
+                i++;
+            continue;
+        }
+        line_start = 0;
+        if (is_space(c)) {
+            i++;
+            continue;
+        }
+        end = token_end(text, i, n);
+
+        h = 0xcbf29ce484222325ULL;
+        for (k = i; k < end; k++)
+            h = (h ^ text[k]) * 0x100000001b3ULL;
+        for (j = h & mask; table[j].id >= 0; j = (j + 1) & mask) {
+            if (table[j].hash == h && table[j].len == end - i &&
+                memcmp(text + table[j].start, text + i, (size_t)(end - i) * sizeof(uint32_t)) == 0)
+                break;
+        }
+        if (table[j].id < 0) {
+            table[j].hash = h;
+            table[j].start = i;
+            table[j].len = (int32_t)(end - i);
+            table[j].id = (int32_t)n_vocab;
+            vocab_start[n_vocab] = i;
+            vocab_len[n_vocab] = (int32_t)(end - i);
+            n_vocab++;
+            ids[n_tok++] = table[j].id;
+            if ((uint64_t)n_vocab * 2 > mask && grow(&table, &mask) < 0) {
+                free(table);
+                return -1;
+            }
+        } else {
+            ids[n_tok++] = table[j].id;
+        }
+
+        while (d < n_docs - 1 && i >= ends[d])
+            d++;
+        counts[d]++;
+        i = end;
+    }
+    free(table);
+    return n_vocab;
+}
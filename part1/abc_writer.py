@@ -0,0 +1,222 @@
+# abc_writer.py
+# In-process MIDI -> ABC conversion with symusic (no midi2abc subprocess).
+# Output follows the layout of midi2abc (X/T/M/L/Q/K header, one V: per track)
+# so the downstream char-level vocab stays the same.
+
+from functools import lru_cache
+
+import numpy as np
+import symusic
+
+UNIT_LEN = "1/8"       # L: field
+GRID_PER_QUARTER = 4   # quantize to 16th notes; one L:1/8 unit = 2 grid steps
+BARS_PER_LINE = 4
+
+SHARP_SPELLING = [("C", 0), ("C", 1), ("D", 0), ("D", 1), ("E", 0), ("F", 0),
+                  ("F", 1), ("G", 0), ("G", 1), ("A", 0), ("A", 1), ("B", 0)]
+FLAT_SPELLING  = [("C", 0), ("D", -1), ("D", 0), ("E", -1), ("E", 0), ("F", 0),
+                  ("G", -1), ("G", 0), ("A", -1), ("A", 0), ("B", -1), ("B", 0)]
+
+SHARP_ORDER = "FCGDAEB"
+FLAT_ORDER  = "BEADGCF"
+
+MAJOR_KEYS = {-7: "Cb", -6: "Gb", -5: "Db", -4: "Ab", -3: "Eb", -2: "Bb", -1: "F", 0: "C",
+              1: "G", 2: "D", 3: "A", 4: "E", 5: "B", 6: "F#", 7: "C#"}
+MINOR_KEYS = {-7: "Abm", -6: "Ebm", -5: "Bbm", -4: "Fm", -3: "Cm", -2: "Gm", -1: "Dm", 0: "Am",
+              1: "Em", 2: "Bm", 3: "F#m", 4: "C#m", 5: "G#m", 6: "D#m", 7: "A#m"}
+
+ACCIDENTAL = {-1: "_", 0: "=", 1: "^"}
+
+
+class ConversionError(Exception):
+    """Conversion failure with a short machine-readable reason."""
+
+    def __init__(self, reason, detail=""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def key_alterations(sharps: int) -> dict:
+    """Letter -> alteration implied by a key signature with `sharps` (<0 for flats)."""
+    alter = {letter: 0 for letter in "ABCDEFG"}
+    if sharps > 0:
+        for letter in SHARP_ORDER[:sharps]:
+            alter[letter] = 1
+    elif sharps < 0:
+        for letter in FLAT_ORDER[:-sharps]:
+            alter[letter] = -1
+    return alter
+
+
+def pitch_name(letter: str, octave: int) -> str:
+    """ABC spelling of a letter in a MIDI octave (middle C = octave 4 = 'C')."""
+    if octave >= 5:
+        return letter.lower() + "'" * (octave - 5)
+    return letter + "," * (4 - octave)
+
+
+def duration_token(steps: int) -> str:
+    """Length in 16th-note grid steps relative to L:1/8."""
+    if steps == 2:
+        return ""
+    if steps % 2 == 0:
+        return str(steps // 2)
+    if steps == 1:
+        return "/"
+    return f"{steps}/2"
+
+
+@lru_cache(maxsize=None)
+def spelling_table(sharps: int):
+    """Per MIDI pitch: (letter, octave, alteration, ABC name without accidental)."""
+    spelling = FLAT_SPELLING if sharps < 0 else SHARP_SPELLING
+    table = []
+    for pitch in range(128):
+        letter, alter = spelling[pitch % 12]
+        octave = pitch // 12 - 1
+        table.append((letter, octave, alter, pitch_name(letter, octave)))
+    return table
+
+
+class VoiceWriter:
+    """Accumulates one voice, splitting events at bar lines and tracking bar accidentals."""
+
+    def __init__(self, bar_steps: int, sharps: int):
+        self.bar_steps = bar_steps
+        self.key_alter = key_alterations(sharps)
+        self.table = spelling_table(sharps)
+        self.bar_alter = {}
+        self.pos = 0
+        self.bars = 0
+        self.out = []
+
+    def note(self, pitch: int) -> str:
+        letter, octave, alter, name = self.table[pitch]
+        current = self.bar_alter.get((letter, octave), self.key_alter[letter])
+        if current == alter:
+            return name
+        self.bar_alter[(letter, octave)] = alter
+        return ACCIDENTAL[alter] + name
+
+    def emit(self, pitches, steps: int):
+        """Write a rest (empty pitches), note or chord of `steps` grid steps."""
+        while steps > 0:
+            take = min(steps, self.bar_steps - self.pos)
+            if not pitches:
+                tok = "z" + duration_token(take)
+            elif len(pitches) == 1:
+                tok = self.note(pitches[0]) + duration_token(take)
+            else:
+                tok = "[" + "".join([self.note(p) for p in pitches]) + "]" + duration_token(take)
+            steps -= take
+            if pitches and steps > 0:
+                tok += "-"  # tie into the next bar
+            self.out.append(tok)
+            self.pos += take
+            if self.pos == self.bar_steps:
+                self.bars += 1
+                self.pos = 0
+                self.bar_alter = {}
+                self.out.append("|\n" if self.bars % BARS_PER_LINE == 0 else "|")
+
+    def text(self) -> str:
+        body = " ".join(self.out).replace(" |", "|").replace("\n ", "\n")
+        if self.pos:
+            body += "|"
+        return body.rstrip() + "\n"
+
+
+def track_to_voice(notes: dict, grid: float, bar_steps: int, sharps: int) -> str:
+    """Quantize one track's notes and serialize them; simultaneous onsets become chords."""
+    onsets = np.rint(notes["time"] / grid).astype(np.int64)
+    lengths = np.maximum(1, np.rint(notes["duration"] / grid).astype(np.int64))
+    order = np.lexsort((notes["pitch"], onsets))
+    onsets = onsets[order].tolist()
+    lengths = lengths[order].tolist()
+    pitches = notes["pitch"][order].astype(np.int64).tolist()
+
+    # group notes sharing an onset: (onset, longest length, sorted unique pitches)
+    events = []
+    for t, length, pitch in zip(onsets, lengths, pitches):
+        if events and events[-1][0] == t:
+            ev = events[-1]
+            ev[1] = max(ev[1], length)
+            if ev[2][-1] != pitch:
+                ev[2].append(pitch)
+        else:
+            events.append([t, length, [pitch]])
+
+    writer = VoiceWriter(bar_steps, sharps)
+    cursor = 0
+    for k, (t, length, chord) in enumerate(events):
+        if t < cursor:
+            continue  # still covered by the previous (overlapping) event
+        if t > cursor:
+            writer.emit((), t - cursor)
+        if k + 1 < len(events):
+            length = min(length, events[k + 1][0] - t)
+        writer.emit(chord, length)
+        cursor = t + length
+    return writer.text()
+
+
+def score_to_abc(score, title: str = "") -> str:
+    """
+    Serialize a symusic Score (tick time) as ABC text.
+    Only the first time signature, key signature and tempo are used, like a single-header tune.
+    """
+    tpq = score.ticks_per_quarter
+    grid = tpq / GRID_PER_QUARTER
+
+    num, den = 4, 4
+    if len(score.time_signatures):
+        ts = score.time_signatures[0]
+        if ts.denominator in (1, 2, 4, 8, 16) and ts.numerator > 0:
+            num, den = ts.numerator, ts.denominator
+    bar_steps = num * 16 // den
+
+    sharps, minor = 0, False
+    if len(score.key_signatures):
+        ks = score.key_signatures[0]
+        if -7 <= ks.key <= 7:
+            sharps, minor = ks.key, bool(ks.tonality)
+
+    qpm = round(score.tempos[0].qpm) if len(score.tempos) else 120
+
+    lines = [
+        "X: 1",
+        f"T: {title}" if title else "T: untitled",
+        f"M: {num}/{den}",
+        f"L: {UNIT_LEN}",
+        f"Q:1/4={qpm}",
+        f"K:{(MINOR_KEYS if minor else MAJOR_KEYS)[sharps]}",
+    ]
+
+    voice = 0
+    for track in score.tracks:
+        if len(track.notes) == 0:
+            continue
+        voice += 1
+        lines.append(f"V:{voice}")
+        lines.append("%%MIDI channel 10" if track.is_drum else f"%%MIDI program {track.program}")
+        lines.append(track_to_voice(track.notes.numpy(), grid, bar_steps, sharps).rstrip("\n"))
+
+    if voice == 0:
+        raise ConversionError("no_notes")
+    return "\n".join(lines) + "\n"
+
+
+def midi_to_abc(midi_path: str) -> str:
+    """Parse a MIDI file and return its ABC text, raising ConversionError on failure."""
+    try:
+        with open(midi_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise ConversionError("io_error", str(e))
+    try:
+        score = symusic.Score.from_midi(data)
+    except Exception as e:
+        raise ConversionError("parse_error", str(e))
+    if score.ticks_per_quarter <= 0:
+        raise ConversionError("parse_error", "non-positive ticks per quarter")
+    return score_to_abc(score, title=f"from {midi_path}")
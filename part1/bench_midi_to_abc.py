@@ -0,0 +1,74 @@
+# bench_midi_to_abc.py
+# Compare files/s of the midi2abc binary and the in-process symusic writer
+# on a synthetic MIDI set, through the same timeout-guarded pool.
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from functools import partial
+
+import symusic
+
+import midi_to_abc_mp
+
+
+def make_synthetic_midi(path: str, seed: int, n_tracks: int = 3, n_notes: int = 200):
+    """Write a small multi-track MIDI file with random notes and chords."""
+    rng = random.Random(seed)
+    score = symusic.Score(480)
+    score.time_signatures.append(symusic.TimeSignature(0, rng.choice([3, 4]), 4))
+    score.key_signatures.append(symusic.KeySignature(0, rng.randint(-5, 5), rng.randint(0, 1)))
+    score.tempos.append(symusic.Tempo(0, rng.choice([90, 120, 140])))
+    for tr in range(n_tracks):
+        track = symusic.Track(f"track{tr}", rng.randrange(128), False)
+        t = 0
+        for _ in range(n_notes):
+            dur = rng.choice([120, 240, 480, 960])
+            for pitch in rng.sample(range(36, 96), rng.choice([1, 1, 1, 3])):
+                track.notes.append(symusic.Note(t, dur, pitch, 80))
+            t += dur
+        score.tracks.append(track)
+    score.dump_midi(path)
+
+
+def run_backend(jobs, backend: str, workers: int):
+    convert = partial(midi_to_abc_mp.convert_single, backend=backend)
+    t0 = time.time()
+    results = list(midi_to_abc_mp.run_with_timeouts(convert, jobs, workers, midi_to_abc_mp.TIMEOUT_SEC))
+    dt = time.time() - t0
+    ok = sum(1 for r in results if r[1] == "ok")
+    return dt, ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_files", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--midi2abc_bin", type=str, default=midi_to_abc_mp.MIDI2ABC_BIN)
+    args = parser.parse_args()
+
+    midi_to_abc_mp.MIDI2ABC_BIN = args.midi2abc_bin
+
+    with tempfile.TemporaryDirectory() as tmp:
+        midi_dir = os.path.join(tmp, "midi")
+        os.makedirs(midi_dir)
+        jobs = []
+        for i in range(args.num_files):
+            path = os.path.join(midi_dir, f"{i:06d}.mid")
+            make_synthetic_midi(path, seed=i)
+            jobs.append((f"{i:032x}", path))
+        print(f"[INFO] Synthetic MIDI files: {len(jobs)} ({args.workers} workers)")
+
+        for backend in midi_to_abc_mp.BACKENDS:
+            if backend == "midi2abc" and not os.path.exists(args.midi2abc_bin):
+                print(f"[SKIP] {backend}: binary not found at {args.midi2abc_bin}")
+                continue
+            midi_to_abc_mp.ABC_DIR = os.path.join(tmp, f"abc_{backend}")
+            dt, ok = run_backend(jobs, backend, args.workers)
+            print(f"{backend:9s}: {len(jobs) / dt:10.1f} files/s | ok {ok}/{len(jobs)} | {dt:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
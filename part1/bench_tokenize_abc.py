@@ -0,0 +1,73 @@
+# bench_tokenize_abc.py
+# tokens/s of the reference tokenize_abc_text() vs AbcTokenizer.encode_batch()
+# (single process and multi-process), with an output identity check.
+# The compiled scanner (abc_scan.c) is built before timing starts.
+
+import glob
+import time
+import argparse
+
+from tokenize_abc import AbcTokenizer, load_scanner, tokenize_abc_text
+
+REFERENCE_GLOB = "../part234/nanoGPT-master/part4_results/*_abc/*.abc"
+
+
+def load_texts(index, limit):
+    if index:
+        with open(index, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip()][:limit]
+    else:
+        paths = sorted(glob.glob(REFERENCE_GLOB))
+    texts = []
+    for p in paths:
+        with open(p, "r", encoding="utf-8", errors="ignore") as f:
+            texts.append(f.read())
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default=None,
+                        help="file list to benchmark on (default: part4 ABC samples)")
+    parser.add_argument("--limit", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="replicate the corpus to get stable timings")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    texts = load_texts(args.index, args.limit) * args.repeat
+    print(f"[INFO] Texts: {len(texts):,} ({sum(map(len, texts)) / 1e6:.1f}M chars)")
+    engine = "abc_scan.c" if load_scanner() else "SCAN_PATTERN (regex fallback)"
+    print(f"[INFO] AbcTokenizer scanner: {engine}")
+
+    t0 = time.time()
+    reference = [tokenize_abc_text(t) for t in texts]
+    t_ref = time.time() - t0
+    n_tok = sum(map(len, reference))
+
+    results = [("tokenize_abc_text", t_ref)]
+    for workers in (1, args.workers):
+        tok = AbcTokenizer()
+        t0 = time.time()
+        ids, offsets = tok.encode_batch(texts, workers=workers)
+        dt = time.time() - t0
+
+        itos = tok.itos
+        for i in (0, len(texts) // 2, len(texts) - 1):
+            got = [itos[int(x)] for x in ids[offsets[i]:offsets[i + 1]]]
+            assert got == reference[i], f"output mismatch on text {i}"
+        assert offsets[-1] == n_tok, "token count mismatch"
+        results.append((f"AbcTokenizer x{workers}", dt))
+
+    # full identity check (single process vs reference)
+    tok = AbcTokenizer()
+    ids, offsets = tok.encode_batch(texts[:len(texts) // args.repeat])
+    assert tok.decode(ids) == [t for ref in reference[:len(offsets) - 1] for t in ref]
+    print("[OK] AbcTokenizer output identical to tokenize_abc_text")
+
+    for name, dt in results:
+        print(f"{name:22s}: {n_tok / dt / 1e6:8.2f}M tokens/s | {t_ref / dt:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,15 @@
 
 import os
 
+from corpus_manifest import CorpusManifest, MANIFEST_DIR
+from epoch_index import VirtualEpochIndex
+
 CLEAN_INDEX = "../data/abc_clean_index.txt"
-OUT_INDEX   = "../data/abc_1b_index.txt"
+OUT_INDEX   = "../data/abc_1b_index.npz"   # + abc_1b_index.npz.paths.txt
 
 TARGET_TOKENS = 1_000_000_000   # 1B tokens
 
 
-def count_tokens(path):
-    """Character-level token count."""
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        return len(text)  # character-level tokens
-    except:
-        return 0
-
-
 def main():
     if not os.path.exists(CLEAN_INDEX):
         print(f"[FATAL] Clean index not found: {CLEAN_INDEX}")
@@ -30,43 +23,29 @@ def main():
 
     print(f"[INFO] Total valid files listed: {len(files):,}")
 
-    token_table = []
-    total_clean_tokens = 0
-
-    print("[INFO] Counting tokens for each file...")
-    for path in files:
-        tok = count_tokens(path)
-        token_table.append((path, tok))
-        total_clean_tokens += tok
+    print("[INFO] Looking up token counts in corpus manifest...")
+    manifest = CorpusManifest(MANIFEST_DIR)
+    ids = manifest.path_ids(files)
+    # character-level tokens; files missing from the manifest count as 0
+    tokens = [int(manifest.char_count[i]) if i >= 0 else 0 for i in ids]
+    total_clean_tokens = sum(tokens)
 
     print(f"[INFO] Total tokens in clean corpus ≈ {total_clean_tokens:,}")
+    if total_clean_tokens == 0:
+        print("[FATAL] Clean corpus has no tokens")
+        return
 
-    # Build repeated 1B index
-    repeated_index = []
-    running = 0
-
-    print("\n[INFO] Building repeated index until >= 1B tokens...")
-
-    while running < TARGET_TOKENS:
-        for path, tok in token_table:
-            repeated_index.append(path)
-            running += tok
-
-            if running >= TARGET_TOKENS:
-                break
-
-        print(f"Progress: {running:,} tokens")
-
-    # Save
-    with open(OUT_INDEX, "w", encoding="utf-8") as f:
-        for path in repeated_index:
-            f.write(path + "\n")
+    # The repeated corpus is kept virtual: one epoch of file ids with a token
+    # prefix sum, plus how many full epochs and extra rows reach the target.
+    index = VirtualEpochIndex.for_budget(files, tokens, TARGET_TOKENS)
+    index.save(OUT_INDEX)
 
     print("\n===== DONE =====")
     print(f"Target tokens: {TARGET_TOKENS:,}")
-    print(f"Actual tokens: {running:,}")
+    print(f"Actual tokens: {index.total_tokens:,}")
+    print(f"Full epochs  : {index.full_epochs} (+ {index.tail_rows:,} rows)")
     print(f"Index file saved: {OUT_INDEX}")
-    print(f"Total index rows: {len(repeated_index):,}")
+    print(f"Total index rows: {len(index):,}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+# corpus_manifest.py
+# Scan abc_raw ONCE (in parallel) and write a columnar manifest:
+#   paths.txt    : one path per line, line number = path id
+#   columns.npz  : byte_size, char_count, content hash and per-file char
+#                  frequencies (CSR: freq_offsets / freq_chars / freq_counts)
+# build_vocab.py, clean_abc_raw_index_by_token.py, build_1b_index.py and
+# split_abc_by_token_count.py query this instead of re-reading the corpus.
+
+import io
+import os
+import hashlib
+import argparse
+import multiprocessing as mp
+from collections import Counter
+
+import numpy as np
+from tqdm import tqdm
+
+ABC_DIR = "../data/abc_raw"
+MANIFEST_DIR = "../data/corpus_manifest"
+NUM_WORKERS = 16
+
+PATHS_FILE = "paths.txt"
+COLUMNS_FILE = "columns.npz"
+
+
+def collect_abc_files(root_dir):
+    files = []
+    for root, _, fs in os.walk(root_dir):
+        for f in fs:
+            if f.endswith(".abc"):
+                files.append(os.path.join(root, f))
+    return sorted(files)
+
+
+def scan_file(path: str):
+    """
+    Read one file and summarize it.
+    Returns (byte_size, char_count, digest, codepoints, counts); byte_size is -1 if unreadable.
+    Chars are counted the way the part1 scripts read files (text mode, utf-8 with
+    errors="ignore"), so CRLF and lone CR line ends count as one newline.
+    The digest is of the raw bytes.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return -1, 0, bytes(16), np.zeros(0, np.uint32), np.zeros(0, np.uint32)
+
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", errors="ignore").read()
+    freq = Counter(text)
+    codepoints = np.fromiter((ord(c) for c in freq), dtype=np.uint32, count=len(freq))
+    counts = np.fromiter(freq.values(), dtype=np.uint32, count=len(freq))
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    return len(data), len(text), digest, codepoints, counts
+
+
+def build_manifest(paths, out_dir: str, workers: int):
+    n = len(paths)
+    byte_size = np.zeros(n, dtype=np.int64)
+    char_count = np.zeros(n, dtype=np.int64)
+    content_hash = np.zeros((n, 16), dtype=np.uint8)
+    freq_offsets = np.zeros(n + 1, dtype=np.int64)
+    freq_chars, freq_counts = [], []
+
+    with mp.Pool(workers) as pool:
+        results = pool.imap(scan_file, paths, chunksize=64)
+        for i, (size, chars, digest, cps, cnt) in enumerate(
+            tqdm(results, total=n, desc=f"Scanning ABC ({workers} workers)")
+        ):
+            byte_size[i] = size
+            char_count[i] = chars
+            content_hash[i] = np.frombuffer(digest, dtype=np.uint8)
+            freq_offsets[i + 1] = freq_offsets[i] + len(cps)
+            freq_chars.append(cps)
+            freq_counts.append(cnt)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, PATHS_FILE), "w", encoding="utf-8") as f:
+        for p in paths:
+            f.write(p + "\n")
+    np.savez(
+        os.path.join(out_dir, COLUMNS_FILE),
+        byte_size=byte_size,
+        char_count=char_count,
+        content_hash=content_hash,
+        freq_offsets=freq_offsets,
+        freq_chars=np.concatenate(freq_chars) if freq_chars else np.zeros(0, np.uint32),
+        freq_counts=np.concatenate(freq_counts) if freq_counts else np.zeros(0, np.uint32),
+    )
+
+
+class CorpusManifest:
+    """Read-only view of a manifest written by build_manifest()."""
+
+    def __init__(self, manifest_dir: str = MANIFEST_DIR):
+        paths_file = os.path.join(manifest_dir, PATHS_FILE)
+        if not os.path.exists(paths_file):
+            raise FileNotFoundError(
+                f"Corpus manifest not found in {manifest_dir}. Run corpus_manifest.py first."
+            )
+        with open(paths_file, "r", encoding="utf-8") as f:
+            self.paths = [line.rstrip("\n") for line in f]
+        cols = np.load(os.path.join(manifest_dir, COLUMNS_FILE))
+        self.byte_size = cols["byte_size"]
+        self.char_count = cols["char_count"]
+        self.content_hash = cols["content_hash"]
+        self.freq_offsets = cols["freq_offsets"]
+        self.freq_chars = cols["freq_chars"]
+        self.freq_counts = cols["freq_counts"]
+        self._path_to_id = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def path_ids(self, paths) -> np.ndarray:
+        """Path id for every path in `paths`, -1 for paths not in the manifest."""
+        if self._path_to_id is None:
+            self._path_to_id = {p: i for i, p in enumerate(self.paths)}
+        lookup = self._path_to_id
+        return np.fromiter((lookup.get(p, -1) for p in paths), dtype=np.int64, count=len(paths))
+
+    def _freq_rows(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.freq_offsets))
+
+    def char_totals(self) -> dict:
+        """Corpus-wide {char: count}."""
+        uniq, inverse = np.unique(self.freq_chars, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.freq_counts, minlength=len(uniq))
+        return {chr(int(c)): int(t) for c, t in zip(uniq, totals)}
+
+    def nonspace_count(self) -> np.ndarray:
+        """Per-file count of non-whitespace chars (0 <=> text.strip() is empty)."""
+        uniq, inverse = np.unique(self.freq_chars, return_inverse=True)
+        is_space = np.array([chr(int(c)).isspace() for c in uniq], dtype=bool)
+        keep = ~is_space[inverse] if len(uniq) else np.zeros(0, dtype=bool)
+        return np.bincount(
+            self._freq_rows()[keep], weights=self.freq_counts[keep], minlength=len(self)
+        ).astype(np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", type=str, default=ABC_DIR)
+    parser.add_argument("--out", type=str, default=MANIFEST_DIR)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    print("[INFO] Scanning input directory...")
+    paths = collect_abc_files(args.src)
+    print(f"[INFO] Total ABC files: {len(paths):,}")
+
+    build_manifest(paths, args.out, args.workers)
+
+    m = CorpusManifest(args.out)
+    print("\n===== MANIFEST DONE =====")
+    print(f"Files        : {len(m):,}")
+    print(f"Unreadable   : {int((m.byte_size < 0).sum()):,}")
+    print(f"Total bytes  : {int(m.byte_size[m.byte_size > 0].sum()):,}")
+    print(f"Total chars  : {int(m.char_count.sum()):,}")
+    print(f"Saved to     : {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# epoch_index.py
+# Compact "virtual epoch" index over the clean corpus.
+# A token budget is stored as (one epoch of file ids + token prefix sum,
+# number of full epochs, rows of the final partial epoch) instead of a
+# materialized list of repeated paths.
+
+import numpy as np
+
+
+class VirtualEpochIndex:
+    """
+    Rows of the virtual index are the clean-corpus files repeated epoch after epoch:
+        row r  ->  epoch r // n_files, file r % n_files
+    truncated after `full_epochs` complete epochs plus `tail_rows` extra files.
+    """
+
+    def __init__(self, paths, tokens, full_epochs: int, tail_rows: int):
+        self.paths = list(paths)
+        self.tokens = np.asarray(tokens, dtype=np.int64)
+        self.cum_tokens = np.zeros(len(self.tokens) + 1, dtype=np.int64)
+        np.cumsum(self.tokens, out=self.cum_tokens[1:])
+        self.full_epochs = int(full_epochs)
+        self.tail_rows = int(tail_rows)
+
+    @classmethod
+    def for_budget(cls, paths, tokens, target_tokens: int):
+        """Smallest prefix of the repeated corpus that reaches `target_tokens`."""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        epoch_tokens = int(tokens.sum())
+        if epoch_tokens <= 0:
+            raise ValueError("clean corpus has no tokens")
+        full_epochs, rem = divmod(target_tokens, epoch_tokens)
+        tail_rows = 0
+        if rem:
+            cum = np.cumsum(tokens)
+            tail_rows = int(np.searchsorted(cum, rem, side="left")) + 1
+        return cls(paths, tokens, full_epochs, tail_rows)
+
+    @property
+    def n_files(self) -> int:
+        return len(self.paths)
+
+    @property
+    def epoch_tokens(self) -> int:
+        return int(self.cum_tokens[-1])
+
+    @property
+    def file_ids(self) -> np.ndarray:
+        return np.arange(self.n_files, dtype=np.int64)
+
+    @property
+    def repeats(self) -> np.ndarray:
+        """How many times each file appears in the virtual index."""
+        return self.full_epochs + (self.file_ids < self.tail_rows).astype(np.int64)
+
+    def __len__(self):
+        return self.full_epochs * self.n_files + self.tail_rows
+
+    @property
+    def total_tokens(self) -> int:
+        return self.full_epochs * self.epoch_tokens + int(self.cum_tokens[self.tail_rows])
+
+    def locate(self, k: int):
+        """(row, file_id, offset inside that file) of global token offset k, in O(log n)."""
+        if not 0 <= k < self.total_tokens:
+            raise IndexError(f"token offset {k} out of range [0, {self.total_tokens})")
+        epoch, r = divmod(k, self.epoch_tokens)
+        file_id = int(np.searchsorted(self.cum_tokens, r, side="right")) - 1
+        return epoch * self.n_files + file_id, file_id, r - int(self.cum_tokens[file_id])
+
+    def path_at(self, row: int) -> str:
+        return self.paths[row % self.n_files]
+
+    def iter_paths(self):
+        """Stream the repeated path list without materializing it."""
+        for _ in range(self.full_epochs):
+            yield from self.paths
+        yield from self.paths[:self.tail_rows]
+
+    def save(self, path: str):
+        """Write `<path>` (.npz arrays) and `<path>.paths.txt` (one epoch of paths)."""
+        with open(path + ".paths.txt", "w", encoding="utf-8") as f:
+            for p in self.paths:
+                f.write(p + "\n")
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                file_ids=self.file_ids,
+                tokens=self.tokens,
+                repeats=self.repeats,
+                cum_tokens=self.cum_tokens,
+                full_epochs=np.int64(self.full_epochs),
+                tail_rows=np.int64(self.tail_rows),
+            )
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path + ".paths.txt", "r", encoding="utf-8") as f:
+            paths = [line.rstrip("\n") for line in f]
+        cols = np.load(path)
+        return cls(paths, cols["tokens"], int(cols["full_epochs"]), int(cols["tail_rows"]))
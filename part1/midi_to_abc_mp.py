@@ -1,97 +1,335 @@
 import os
-import glob
+import json
+import time
+import queue
+import hashlib
 import argparse
 import subprocess
 import multiprocessing as mp
+from collections import defaultdict, deque
 from functools import partial
 from tqdm import tqdm
 
+from abc_writer import ConversionError, midi_to_abc
+
 RAW_MIDI_DIR = "../data/midi_raw"
 ABC_DIR      = "../data/abc_raw"
 FAILED_LOG   = "../data/failed_midi.txt"
+MANIFEST     = "../data/conversion_manifest.jsonl"
 
 MIDI2ABC_BIN = "/root/miniconda3/lib/python3.12/site-packages/symusic/bin/midi2abc"
 
+BACKENDS = ("midi2abc", "symusic")
+TIMEOUT_SEC = 30.0
+GRACE_SEC = 5.0  # pool-level guard on top of --timeout (midi2abc enforces its own first)
+
+HASH_BLOCK = 1 << 20
+
 os.makedirs(ABC_DIR, exist_ok=True)
 
 
-def convert_single(midi_path: str, min_abc_len: int = 10) -> bool:
+def collect_midi_files(root_dir):
+    files = []
+    for root, _, fs in os.walk(root_dir):
+        for f in fs:
+            if f.lower().endswith(".mid"):
+                files.append(os.path.join(root, f))
+    return sorted(files)
+
+
+def hash_midi(midi_path: str):
+    """Return (path, size, mtime_ns, content digest); digest is None if unreadable."""
     try:
-        base = os.path.splitext(os.path.basename(midi_path))[0]
-        out_path = os.path.join(ABC_DIR, base + ".abc")
+        st = os.stat(midi_path)
+        h = hashlib.blake2b(digest_size=16)
+        with open(midi_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                h.update(block)
+        return midi_path, st.st_size, st.st_mtime_ns, h.hexdigest()
+    except OSError:
+        return midi_path, 0, 0, None
+
+
+def abc_path_for(digest: str) -> str:
+    """Output path keyed by content hash, sharded so no directory gets millions of files."""
+    return os.path.join(ABC_DIR, digest[:2], digest + ".abc")
+
 
-        if os.path.exists(out_path) and os.path.getsize(out_path) > min_abc_len:
-            return True
+def convert_symusic(midi_path: str, out_path: str, timeout: float):
+    """
+    In-process backend; returns the ABC byte size. Runs inside the pool worker,
+    no fork/exec. The parse runs in C++ and cannot be interrupted here, so
+    `timeout` is enforced by run_with_timeouts() killing the worker.
+    """
+    text = midi_to_abc(midi_path)
+    data = text.encode("utf-8")
+    with open(out_path, "wb") as f:
+        f.write(data)
+    return len(data)
 
-        if not os.path.exists(MIDI2ABC_BIN):
-            return False
 
+def convert_midi2abc(midi_path: str, out_path: str, timeout: float):
+    """External midi2abc binary backend; returns the ABC byte size."""
+    if not os.path.exists(MIDI2ABC_BIN):
+        raise ConversionError("missing_binary")
+    try:
         result = subprocess.run(
             [MIDI2ABC_BIN, midi_path, "-o", out_path],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
-            text=False
+            text=False,
+            timeout=timeout
         )
+    except subprocess.TimeoutExpired:
+        raise ConversionError("timeout")
+    if result.returncode != 0:
+        raise ConversionError(f"exit_{result.returncode}")
+    return os.path.getsize(out_path) if os.path.exists(out_path) else 0
+
+
+CONVERTERS = {"symusic": convert_symusic, "midi2abc": convert_midi2abc}
+
+
+def convert_single(job, min_abc_len: int = 10, backend: str = "midi2abc",
+                   timeout: float = TIMEOUT_SEC, fallback: bool = False):
+    """
+    Convert one unique MIDI payload.
+    job = (digest, midi_path); returns (digest, status, out_path, abc_bytes, reason).
+    With `fallback`, a symusic failure (other than a timeout) is retried with midi2abc.
+    """
+    digest, midi_path = job
+    out_path = abc_path_for(digest)
+    backends = [backend]
+    if fallback and backend != "midi2abc":
+        backends.append("midi2abc")
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    for name in backends:
+        try:
+            size = CONVERTERS[name](midi_path, out_path, timeout)
+            if size > min_abc_len:
+                return digest, "ok", out_path, size, ""
+            reason = "empty_output"
+        except ConversionError as e:
+            reason = e.reason
+        except Exception as e:
+            reason = f"exception:{type(e).__name__}"
+        if reason == "timeout":
+            break
+
+    # never leave partial output behind for the downstream os.walk scans
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    return digest, "failed", out_path, 0, reason
+
 
-        if result.returncode != 0:
-            return False
+def timeout_result(job):
+    """convert_single() result of a job whose worker was killed; drops its partial output."""
+    digest, _ = job
+    out_path = abc_path_for(digest)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    return digest, "failed", out_path, 0, "timeout"
 
-        if (not os.path.exists(out_path)) or (os.path.getsize(out_path) <= min_abc_len):
-            return False
 
-        return True
+def run_with_timeouts(convert, jobs, workers: int, timeout: float):
+    """
+    Yield convert(job) for every job, with at most `workers` jobs in flight so
+    each one's clock starts when a worker takes it. A job still running after
+    `timeout` s yields timeout_result(); the pool is then terminated and a new
+    one started, and the other unfinished jobs are resubmitted.
+    """
+    todo = deque(jobs)
+    while todo:
+        done = queue.Queue()
+        running = {}  # job number -> (job, deadline)
+        n = 0
+        hung = False
+        pool = mp.Pool(workers)
+        try:
+            while (todo or running) and not hung:
+                while todo and len(running) < workers:
+                    job = todo.popleft()
+                    running[n] = (job, time.monotonic() + timeout)
+                    pool.apply_async(convert, (job,),
+                                     callback=lambda r, k=n: done.put((k, r)),
+                                     error_callback=lambda e, k=n: done.put((k, e)))
+                    n += 1
+                wait = min(d for _, d in running.values()) - time.monotonic()
+                try:
+                    k, result = done.get(timeout=max(wait, 0))
+                except queue.Empty:
+                    now = time.monotonic()
+                    for k, (job, deadline) in list(running.items()):
+                        if deadline <= now:
+                            del running[k]
+                            yield timeout_result(job)
+                    hung = True
+                    continue
+                job, _ = running.pop(k)
+                if isinstance(result, Exception):
+                    result = (job[0], "failed", abc_path_for(job[0]), 0,
+                              f"exception:{type(result).__name__}")
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+        # a worker is stuck: resubmit whatever was in flight with it
+        todo.extendleft(job for job, _ in reversed(list(running.values())))
 
-    except:
-        return False
 
+def load_manifest(path):
+    """Load the conversion manifest as {midi_path: record}; later lines win."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            records[rec["path"]] = rec
+    return records
 
-def run_parallel(midi_files, workers: int, min_abc_len: int = 10):
-    convert = partial(convert_single, min_abc_len=min_abc_len)
-    success_flags = []
+
+def save_manifest(path, records):
+    """Rewrite the manifest compacted to one line per MIDI path."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for rec in records.values():
+            f.write(json.dumps(rec) + "\n")
+    os.replace(tmp_path, path)
+
+
+def find_pending(midi_files, records, retry_failed: bool):
+    """Files whose manifest entry is missing, stale (size/mtime changed) or a failure to retry."""
+    pending = []
+    for p in midi_files:
+        rec = records.get(p)
+        if rec is None:
+            pending.append(p)
+            continue
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        if st.st_size != rec["size"] or st.st_mtime_ns != rec["mtime_ns"]:
+            pending.append(p)
+        elif rec["status"] != "ok" and retry_failed:
+            pending.append(p)
+    return pending
+
+
+def run_parallel(midi_files, records, manifest_log, workers: int, min_abc_len: int = 10,
+                 retry_failed: bool = False, **convert_kwargs):
+    pending = find_pending(midi_files, records, retry_failed)
+    print(f"[INFO] Up to date in manifest: {len(midi_files) - len(pending)}")
+    print(f"[INFO] New or changed MIDI files: {len(pending)}")
+
+    # content hash -> result of an earlier conversion of the same bytes
+    known = {}
+    for rec in records.values():
+        if rec["status"] == "ok" or not retry_failed:
+            known.setdefault(rec["hash"], rec)
+
+    def record(path, size, mtime_ns, digest, status, out_path, abc_bytes, reason):
+        rec = {
+            "path": path, "size": size, "mtime_ns": mtime_ns, "hash": digest,
+            "status": status, "out_path": out_path, "abc_bytes": abc_bytes, "reason": reason,
+        }
+        records[path] = rec
+        manifest_log.write(json.dumps(rec) + "\n")
+        return rec
+
+    groups = defaultdict(list)
+    deduped = 0
 
     with mp.Pool(workers) as pool:
-        for result in tqdm(
-            pool.imap_unordered(convert, midi_files),
-            total=len(midi_files),
-            desc=f"Converting MIDI → ABC ({workers} workers)"
+        for path, size, mtime_ns, digest in tqdm(
+            pool.imap_unordered(hash_midi, pending, chunksize=64),
+            total=len(pending),
+            desc=f"Hashing MIDI ({workers} workers)"
         ):
-            success_flags.append(result)
+            if digest is None:
+                record(path, size, mtime_ns, None, "failed", None, 0, "unreadable")
+            elif digest in known:
+                prev = known[digest]
+                record(path, size, mtime_ns, digest, prev["status"],
+                       prev["out_path"], prev["abc_bytes"], prev["reason"])
+                deduped += 1
+            else:
+                groups[digest].append((path, size, mtime_ns))
 
-    return sum(success_flags), len(success_flags) - sum(success_flags)
+    deduped += sum(len(g) - 1 for g in groups.values())
+    jobs = [(digest, group[0][0]) for digest, group in groups.items()]
+
+    convert = partial(convert_single, min_abc_len=min_abc_len, **convert_kwargs)
+    timeout = convert_kwargs.get("timeout", TIMEOUT_SEC) + GRACE_SEC
+
+    for digest, status, out_path, abc_bytes, reason in tqdm(
+        run_with_timeouts(convert, jobs, workers, timeout),
+        total=len(jobs),
+        desc=f"Converting MIDI → ABC ({workers} workers)"
+    ):
+        for path, size, mtime_ns in groups[digest]:
+            record(path, size, mtime_ns, digest, status, out_path, abc_bytes, reason)
+
+    print(f"[INFO] Duplicates served from cache: {deduped}")
+    return len(jobs)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--workers", type=int, default=16)
     parser.add_argument("--min_abc_len", type=int, default=10)
+    parser.add_argument("--manifest", type=str, default=MANIFEST)
+    parser.add_argument("--retry_failed", action="store_true",
+                        help="re-convert inputs whose previous attempt failed")
+    parser.add_argument("--backend", choices=BACKENDS, default="midi2abc",
+                        help="midi2abc: external binary per file; symusic: in-process writer (different ABC text)")
+    parser.add_argument("--fallback", action="store_true",
+                        help="retry symusic failures with the midi2abc binary")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT_SEC,
+                        help="per-file conversion timeout in seconds (a hung worker is killed and replaced)")
     args = parser.parse_args()
 
-    midi_files = sorted(set(
-        glob.glob(os.path.join(RAW_MIDI_DIR, "**/*.mid"), recursive=True) +
-        glob.glob(os.path.join(RAW_MIDI_DIR, "**/*.MID"), recursive=True)
-    ))
+    midi_files = collect_midi_files(RAW_MIDI_DIR)
 
     print(f"[INFO] MIDI files: {len(midi_files)}")
     print(f"[INFO] Writing ABC to: {ABC_DIR}")
+    print(f"[INFO] Backend: {args.backend}" + (" (midi2abc fallback)" if args.fallback else ""))
 
-    success, fail = run_parallel(midi_files, args.workers, args.min_abc_len)
+    records = load_manifest(args.manifest)
+    print(f"[INFO] Manifest entries: {len(records)} ({args.manifest})")
 
-    print("\n==== DONE ====")
-    print(f"Success: {success}")
-    print(f"Failed : {fail}")
+    # append as we go so an interrupted run keeps its progress
+    with open(args.manifest, "a", encoding="utf-8") as manifest_log:
+        converted = run_parallel(midi_files, records, manifest_log, args.workers,
+                                 args.min_abc_len, args.retry_failed,
+                                 backend=args.backend, timeout=args.timeout,
+                                 fallback=args.fallback)
+
+    # drop entries for MIDI files that no longer exist, then compact
+    present = set(midi_files)
+    records = {p: rec for p, rec in records.items() if p in present}
+    save_manifest(args.manifest, records)
 
-    failed_files = []
-    for m in midi_files:
-        base = os.path.splitext(os.path.basename(m))[0]
-        out_path = os.path.join(ABC_DIR, base + ".abc")
+    success = sum(1 for rec in records.values() if rec["status"] == "ok")
+    failed_files = [p for p, rec in records.items() if rec["status"] != "ok"]
 
-        if (not os.path.exists(out_path)) or (os.path.getsize(out_path) <= args.min_abc_len):
-            failed_files.append(m)
+    print("\n==== DONE ====")
+    print(f"Converted this run: {converted}")
+    print(f"Success: {success}")
+    print(f"Failed : {len(failed_files)}")
 
     if failed_files:
         with open(FAILED_LOG, "w") as f:
             for p in failed_files:
-                f.write(p + "\n")
+                f.write(f"{p}\t{records[p]['reason']}\n")
         print(f"[INFO] Logged {len(failed_files)} failures to {FAILED_LOG}")
     else:
         print("[INFO] All ABC files valid.")
@@ -0,0 +1,222 @@
+# near_dedup.py
+# Near-duplicate tune detection over the clean index with MinHash + LSH banding.
+#   1) parallel char k-gram shingling + MinHash signatures (one pass over the files)
+#   2) LSH: files whose signatures agree on a whole band share a bucket
+#   3) union-find over bucket members that pass an estimated-Jaccard check
+# Runs in O(n log n) (sort per band), no all-pairs comparison.
+# Output (../data/near_dup/): paths.txt, cluster_ids.npy, signatures.npy and
+# cluster_keys.txt (representative path of each line's cluster, used as split key)
+# split_abc_by_token_count.py keeps every cluster inside a single split.
+# Files added later (split --add) are clustered against these with cluster_new()
+# and recorded in added_paths.txt, added_keys.txt and added_signatures.npy.
+
+import os
+import time
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+from tqdm import tqdm
+
+CLEAN_INDEX = "../data/abc_clean_index.txt"
+OUT_DIR = "../data/near_dup"
+
+SHINGLE_K = 8          # chars per shingle (packed into one uint64)
+NUM_PERM = 128
+BANDS = 32             # NUM_PERM / BANDS rows per band -> ~0.42 Jaccard threshold
+JACCARD_THRESHOLD = 0.8
+CHUNK = 1 << 14        # shingles hashed per block, bounds worker memory
+
+_rng = np.random.default_rng(20240607)
+PERM_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+PERM_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+EMPTY = np.iinfo(np.uint32).max
+
+
+def tune_body(data: bytes) -> bytes:
+    """Drop the T: line: midi2abc writes the source path there, which differs between re-uploads."""
+    return b"\n".join(line for line in data.split(b"\n") if not line.startswith(b"T:"))
+
+
+def shingles(data: bytes) -> np.ndarray:
+    """Unique char k-grams of the byte stream, each packed into a uint64."""
+    arr = np.frombuffer(data, dtype=np.uint8).astype(np.uint64)
+    n = len(arr) - SHINGLE_K + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    packed = np.zeros(n, dtype=np.uint64)
+    for j in range(SHINGLE_K):
+        packed |= arr[j:j + n] << np.uint64(8 * j)
+    return np.unique(packed)
+
+
+def minhash(path: str) -> np.ndarray:
+    """MinHash signature (uint32[NUM_PERM]) of one file; all-EMPTY if unreadable or too short."""
+    sig = np.full(NUM_PERM, EMPTY, dtype=np.uint32)
+    try:
+        with open(path, "rb") as f:
+            sh = shingles(tune_body(f.read()))
+    except OSError:
+        return sig
+    for lo in range(0, len(sh), CHUNK):
+        block = sh[lo:lo + CHUNK]
+        # multiply-shift universal hashing, wraps mod 2**64
+        h = (block[None, :] * PERM_A[:, None] + PERM_B[:, None]) >> np.uint64(32)
+        np.minimum(sig, h.min(axis=1).astype(np.uint32), out=sig)
+    return sig
+
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def lsh_clusters(sigs: np.ndarray, bands: int, threshold: float) -> np.ndarray:
+    """Cluster id (= smallest member index) per row of `sigs`."""
+    n, num_perm = sigs.shape
+    rows = num_perm // bands
+    parent = np.arange(n, dtype=np.int64)
+    valid = np.nonzero((sigs != EMPTY).any(axis=1))[0]
+
+    for b in range(bands):
+        band = np.ascontiguousarray(sigs[valid, b * rows:(b + 1) * rows])
+        keys = band.view(np.dtype((np.void, band.dtype.itemsize * rows))).ravel()
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        same = sorted_keys[1:] == sorted_keys[:-1]
+        if not same.any():
+            continue
+        # leader of each bucket = its first member in sorted order
+        starts = np.concatenate(([True], ~same))
+        leader = order[np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))]
+        members = order[~starts]
+        leaders = leader[~starts]
+        a, c = valid[members], valid[leaders]
+        agree = (sigs[a] == sigs[c]).mean(axis=1) >= threshold
+        for i, j in zip(a[agree], c[agree]):
+            ri, rj = find(parent, i), find(parent, j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+    return np.array([find(parent, i) for i in range(n)], dtype=np.int64)
+
+
+def load_clusters(out_dir: str = OUT_DIR) -> dict:
+    """{path: cluster id} written by this script."""
+    with open(os.path.join(out_dir, "paths.txt"), "r", encoding="utf-8") as f:
+        paths = [line.rstrip("\n") for line in f]
+    cluster_ids = np.load(os.path.join(out_dir, "cluster_ids.npy"))
+    return dict(zip(paths, cluster_ids.tolist()))
+
+
+def read_paths(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def known_paths(out_dir: str = OUT_DIR) -> set:
+    """Every path with a recorded cluster: the clustered corpus plus earlier cluster_new() additions."""
+    added_file = os.path.join(out_dir, "added_signatures.npy")
+    n_added = len(np.load(added_file, mmap_mode="r")) if os.path.exists(added_file) else 0
+    return set(read_paths(os.path.join(out_dir, "paths.txt"))) | set(
+        read_paths(os.path.join(out_dir, "added_paths.txt"))[:n_added])
+
+
+def cluster_new(new_paths, out_dir: str = OUT_DIR, workers: int = 16,
+                bands: int = BANDS, threshold: float = JACCARD_THRESHOLD) -> dict:
+    """
+    Split keys {path: cluster representative} for files added after this script ran.
+    Their signatures are clustered together with every saved one (the corpus and
+    earlier additions); a new file in a cluster with a known file takes that file's
+    key, so it lands in the same split. The new files are then recorded as added;
+    files that are already known keep their recorded key.
+    """
+    paths = read_paths(os.path.join(out_dir, "paths.txt"))
+    keys = read_paths(os.path.join(out_dir, "cluster_keys.txt"))
+    base = np.load(os.path.join(out_dir, "signatures.npy")) if paths else np.zeros((0, NUM_PERM), np.uint32)
+    added_file = os.path.join(out_dir, "added_signatures.npy")
+    added = np.load(added_file) if os.path.exists(added_file) else np.zeros((0, NUM_PERM), np.uint32)
+    # the signatures are saved last: lines past them are from an interrupted run
+    paths += read_paths(os.path.join(out_dir, "added_paths.txt"))[:len(added)]
+    keys += read_paths(os.path.join(out_dir, "added_keys.txt"))[:len(added)]
+    n_old = len(paths)
+    known = dict(zip(paths, keys))
+    result = {p: known[p] for p in new_paths if p in known}
+    new_paths = [p for p in new_paths if p not in known]
+
+    new_sigs = np.empty((len(new_paths), NUM_PERM), dtype=np.uint32)
+    with mp.Pool(workers) as pool:
+        for i, sig in enumerate(tqdm(pool.imap(minhash, new_paths, chunksize=64),
+                                     total=len(new_paths), desc="MinHash (new files)")):
+            new_sigs[i] = sig
+
+    # cluster id = smallest member index, so a cluster with a known file is led by one
+    cluster_ids = lsh_clusters(np.concatenate((base, added, new_sigs)), bands, threshold)[n_old:]
+    new_keys = [keys[c] if c < n_old else new_paths[c - n_old] for c in cluster_ids.tolist()]
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, rows in (("added_paths.txt", paths[len(base):] + new_paths),
+                       ("added_keys.txt", keys[len(base):] + new_keys)):
+        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+            for p in rows:
+                f.write(p + "\n")
+    np.save(added_file, np.concatenate((added, new_sigs)))
+    result.update(zip(new_paths, new_keys))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default=CLEAN_INDEX)
+    parser.add_argument("--out", type=str, default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--bands", type=int, default=BANDS)
+    parser.add_argument("--threshold", type=float, default=JACCARD_THRESHOLD)
+    args = parser.parse_args()
+    assert NUM_PERM % args.bands == 0
+
+    with open(args.index, "r", encoding="utf-8") as f:
+        paths = [line.strip() for line in f if line.strip()]
+    print(f"[INFO] Files in index: {len(paths):,}")
+
+    t0 = time.time()
+    sigs = np.empty((len(paths), NUM_PERM), dtype=np.uint32)
+    with mp.Pool(args.workers) as pool:
+        for i, sig in enumerate(tqdm(pool.imap(minhash, paths, chunksize=64),
+                                     total=len(paths), desc="MinHash")):
+            sigs[i] = sig
+    t1 = time.time()
+
+    cluster_ids = lsh_clusters(sigs, args.bands, args.threshold)
+    t2 = time.time()
+
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "paths.txt"), "w", encoding="utf-8") as f:
+        for p in paths:
+            f.write(p + "\n")
+    np.save(os.path.join(args.out, "cluster_ids.npy"), cluster_ids)
+    with open(os.path.join(args.out, "cluster_keys.txt"), "w", encoding="utf-8") as f:
+        for c in cluster_ids.tolist():
+            f.write(paths[c] + "\n")
+    np.save(os.path.join(args.out, "signatures.npy"), sigs)
+
+    n = len(paths)
+    n_clusters = len(np.unique(cluster_ids))
+    sizes = np.bincount(cluster_ids, minlength=n)
+    in_dup = int(sizes[sizes > 1].sum())
+
+    print("\n===== NEAR-DEDUP DONE =====")
+    print(f"MinHash throughput : {n / max(t1 - t0, 1e-9):,.0f} files/s ({t1 - t0:.1f}s)")
+    print(f"LSH clustering     : {t2 - t1:.1f}s")
+    print(f"Clusters           : {n_clusters:,} for {n:,} files")
+    print(f"Files in dup groups: {in_dup:,} ({in_dup / max(n, 1):.2%})")
+    print(f"Dedup ratio        : {1 - n_clusters / max(n, 1):.2%} of files are redundant")
+    print(f"Saved to           : {args.out}")
+
+
+if __name__ == "__main__":
+    main()
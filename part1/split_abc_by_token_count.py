@@ -1,118 +1,229 @@
+# split_abc_by_token_count.py
+# Streaming, hash-based train/val/test split.
+# Every document goes to the split picked by a stable hash of its key (the
+# near-duplicate cluster representative, or its own path), so:
+#   - the split does not depend on file order,
+#   - a near-duplicate cluster always lands in one split,
+#   - adding files never moves files that are already assigned.
+# One pass over the clean index with constant memory; per-split token
+# budgets are enforced on the fly. `--add new.txt` appends only new files,
+# clustered against the existing corpus first (near_dedup.cluster_new); files
+# already in a split or already clustered are skipped, so repeating it is a no-op.
+
 import os
+import json
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+
+from corpus_manifest import MANIFEST_DIR, PATHS_FILE, COLUMNS_FILE
+from near_dedup import OUT_DIR as NEAR_DUP_DIR, cluster_new, known_paths
 
-CLEAN_INDEX = "../data/abc_clean_index.txt" 
+CLEAN_INDEX = "../data/abc_clean_index.txt"
 OUT_DIR     = "../data/splits_unique"
+STATE_FILE  = "split_state.json"
+
+SPLITS = ("train", "val", "test")
 
 TRAIN_RATIO = 0.98
 VAL_RATIO   = 0.01
 TEST_RATIO  = 0.01
 
 MIN_TRAIN_TOKENS = 100_000_000
-TARGET_TOTAL_TOKENS = 1_000_000_000  
-
-os.makedirs(OUT_DIR, exist_ok=True)
+TARGET_TOTAL_TOKENS = 1_000_000_000
+
+
+class SortedLookup:
+    """
+    Merge-join lookup into a path-sorted stream of (path, value).
+    Queries must arrive in sorted order too (the clean index is written in the
+    manifest's sorted order); anything not found returns `default`. Either side
+    out of order raises, since the join would silently miss entries.
+    """
+
+    def __init__(self, stream, name="stream"):
+        self.stream = iter(stream)
+        self.name = name
+        self.cur = next(self.stream, None)
+        self.last_query = None
+
+    def advance(self):
+        prev = self.cur[0]
+        self.cur = next(self.stream, None)
+        if self.cur is not None and self.cur[0] < prev:
+            raise ValueError(f"{self.name} is not sorted by path ({prev} before {self.cur[0]})")
+
+    def get(self, path, default=None):
+        if self.last_query is not None and path < self.last_query:
+            raise ValueError(f"queries into {self.name} are not sorted by path "
+                             f"({self.last_query} before {path})")
+        self.last_query = path
+        while self.cur is not None and self.cur[0] < path:
+            self.advance()
+        if self.cur is not None and self.cur[0] == path:
+            return self.cur[1]
+        return default
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def manifest_sizes(manifest_dir):
+    """(path, byte size) stream from the corpus manifest, empty if there is none."""
+    paths_file = os.path.join(manifest_dir, PATHS_FILE)
+    if not os.path.exists(paths_file):
+        return iter(())
+    byte_size = np.load(os.path.join(manifest_dir, COLUMNS_FILE))["byte_size"]
+    return zip(read_lines(paths_file), byte_size.tolist())
+
+
+def cluster_keys(near_dup_dir):
+    """(path, cluster representative) stream from near_dedup.py, empty if there is none."""
+    keys_file = os.path.join(near_dup_dir, "cluster_keys.txt")
+    if not os.path.exists(keys_file):
+        print("[WARN] No near-duplicate clusters found, every file is its own cluster")
+        return iter(())
+    return zip(read_lines(os.path.join(near_dup_dir, "paths.txt")), read_lines(keys_file))
 
 
 def file_token_count(path: str) -> int:
-    """Character-level token approximation."""
+    """Character-level token approximation (byte size), for files not in the manifest."""
     try:
-        return os.path.getsize(path)
-    except:
+        return os.stat(path).st_size
+    except OSError:
         return 0
 
 
-print("[INFO] Loading clean index...")
-paths = []
-
-with open(CLEAN_INDEX, "r", encoding="utf-8") as f:
-    for line in f:
-        p = line.strip()
-        if p and os.path.exists(p):
-            paths.append(p)
-
-print(f"[INFO] Total clean valid files listed: {len(paths):,}")
-
-print("[INFO] Counting tokens and selecting files up to 1B...")
-
-paths_with_tok = []
-total_tokens = 0
+def assign_split(key: str) -> str:
+    """Stable split for a document key: hash -> uniform [0, 1) -> ratio bucket."""
+    h = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    u = int.from_bytes(h, "little") / 2**64
+    if u < TRAIN_RATIO:
+        return "train"
+    if u < TRAIN_RATIO + VAL_RATIO:
+        return "val"
+    return "test"
 
-for p in paths:
-    tok = file_token_count(p)
-    if tok <= 0:
-        continue
 
-    if total_tokens + tok > TARGET_TOTAL_TOKENS:
-        continue
+def token_targets(total: int) -> dict:
+    train_target = int(total * TRAIN_RATIO)
+    val_target   = int(total * VAL_RATIO)
+    return {"train": train_target, "val": val_target, "test": total - train_target - val_target}
 
-    paths_with_tok.append((p, tok))
-    total_tokens += tok
 
-    if total_tokens >= TARGET_TOTAL_TOKENS:
-        break
+def load_state(out_dir):
+    with open(os.path.join(out_dir, STATE_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
 
-print(f"[INFO] Total tokens used for splitting ≈ {total_tokens:,}")
 
-# Safety check
-if len(paths_with_tok) == 0:
-    raise RuntimeError("No files selected for splitting. Check index or token counts.")
+def save_state(out_dir, state):
+    tmp = os.path.join(out_dir, STATE_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, STATE_FILE))
 
-assert abs((TRAIN_RATIO + VAL_RATIO + TEST_RATIO) - 1.0) < 1e-9
 
-train_target = int(total_tokens * TRAIN_RATIO)
-val_target   = int(total_tokens * VAL_RATIO)
-test_target  = total_tokens - train_target - val_target
-
-if train_target < MIN_TRAIN_TOKENS:
-    raise RuntimeError(f"[FATAL] Train target < 100M tokens ({train_target:,}). Increase dataset.")
-
-print("[INFO] Token targets:")
-print(f"  Train target: {train_target:,}")
-print(f"  Val target  : {val_target:,}")
-print(f"  Test target : {test_target:,}")
-
-train_list, val_list, test_list = [], [], []
-train_tok = val_tok = test_tok = 0
-
-split = "train"
-
-for p, tok in paths_with_tok:
-
-    if split == "train":
-        train_list.append(p)
-        train_tok += tok
-        if train_tok >= train_target:
-            split = "val"
-
-    elif split == "val":
-        val_list.append(p)
-        val_tok += tok
-        if val_tok >= val_target:
-            split = "test"
+def stream_split(paths, state, out_dir, keys, append):
+    """
+    Assign each path (in sorted order) in one pass. The lists are written to
+    <split>.txt.tmp, starting from a copy of the existing list when `append`;
+    returns {split: tmp path} for the caller to move into place.
+    """
+    sizes = SortedLookup(manifest_sizes(MANIFEST_DIR), "corpus manifest")
+    targets = state["targets"]
+    tokens, files = state["tokens"], state["files"]
 
+    tmp = {s: os.path.join(out_dir, f"{s}.txt.tmp") for s in SPLITS}
+    for s in SPLITS:
+        if append:
+            shutil.copyfile(os.path.join(out_dir, f"{s}.txt"), tmp[s])
+    outs = {s: open(tmp[s], "a" if append else "w", encoding="utf-8") for s in SPLITS}
+    try:
+        for p in paths:
+            tok = sizes.get(p)
+            if tok is None:
+                tok = file_token_count(p)
+            if tok <= 0:
+                continue
+
+            split = assign_split(keys.get(p, p))
+            if tokens[split] + tok > targets[split]:
+                state["skipped"] += 1
+                continue
+
+            outs[split].write(p + "\n")
+            tokens[split] += tok
+            files[split] += 1
+    finally:
+        for f in outs.values():
+            f.close()
+    return tmp
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default=CLEAN_INDEX)
+    parser.add_argument("--out", type=str, default=OUT_DIR)
+    parser.add_argument("--add", type=str, default=None,
+                        help="list of NEW files to append to existing splits (incremental mode)")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="MinHash workers for the --add files")
+    args = parser.parse_args()
+
+    assert abs((TRAIN_RATIO + VAL_RATIO + TEST_RATIO) - 1.0) < 1e-9
+    os.makedirs(args.out, exist_ok=True)
+
+    if args.add:
+        state = load_state(args.out)
+        requested = sorted(set(read_lines(args.add)))
+        known = known_paths(NEAR_DUP_DIR)
+        for s in SPLITS:
+            known.update(read_lines(os.path.join(args.out, f"{s}.txt")))
+        new_files = [p for p in requested if p not in known]
+        print(f"[INFO] Incremental: {len(requested) - len(new_files):,} of {len(requested):,} files "
+              f"in {args.add} are already in the corpus, skipping them")
+        if not new_files:
+            print("[OK] Nothing new to add")
+            return
+        print(f"[INFO] Appending {len(new_files):,} new files")
+        keys = cluster_new(new_files, NEAR_DUP_DIR, workers=args.workers)
+        tmp = stream_split(new_files, state, args.out, keys, append=True)
     else:
-        test_list.append(p)
-        test_tok += tok
-
-train_set = set(train_list)
-val_set   = set(val_list)
-test_set  = set(test_list)
-
-if (train_set & val_set) or (train_set & test_set) or (val_set & test_set):
-    raise RuntimeError("[FATAL] Split overlap detected!")
-
-def write_list(path, items):
-    with open(path, "w", encoding="utf-8") as f:
-        for x in items:
-            f.write(x + "\n")
-
-write_list(os.path.join(OUT_DIR, "train.txt"), train_list)
-write_list(os.path.join(OUT_DIR, "val.txt"),   val_list)
-write_list(os.path.join(OUT_DIR, "test.txt"),  test_list)
-
-print("\n===== SPLIT DONE (DISJOINT) =====")
-print(f"Train: files={len(train_list):,}, tokens={train_tok:,}")
-print(f"Val  : files={len(val_list):,}, tokens={val_tok:,}")
-print(f"Test : files={len(test_list):,}, tokens={test_tok:,}")
-print("[OK] No overlap between splits.")
-print(f"[OK] Saved to: {OUT_DIR}")
+        state = {
+            "targets": token_targets(TARGET_TOTAL_TOKENS),
+            "tokens": {s: 0 for s in SPLITS},
+            "files": {s: 0 for s in SPLITS},
+            "skipped": 0,
+        }
+        print("[INFO] Token targets:")
+        for s in SPLITS:
+            print(f"  {s:5s} target: {state['targets'][s]:,}")
+        print(f"[INFO] Streaming clean index: {args.index}")
+        keys = SortedLookup(cluster_keys(NEAR_DUP_DIR), "near-dup cluster keys")
+        tmp = stream_split(read_lines(args.index), state, args.out, keys, append=False)
+
+    # the existing lists and state are only replaced once the result is accepted
+    if state["tokens"]["train"] < MIN_TRAIN_TOKENS:
+        for p in tmp.values():
+            os.remove(p)
+        raise RuntimeError(f"[FATAL] Train tokens < {MIN_TRAIN_TOKENS:,} ({state['tokens']['train']:,}). Increase dataset.")
+    for s in SPLITS:
+        os.replace(tmp[s], os.path.join(args.out, f"{s}.txt"))
+    save_state(args.out, state)
+
+    print("\n===== SPLIT DONE (DISJOINT BY HASH) =====")
+    for s in SPLITS:
+        print(f"{s.capitalize():5s}: files={state['files'][s]:,}, tokens={state['tokens'][s]:,}")
+    print(f"Skipped (split budget full): {state['skipped']:,}")
+    print(f"[OK] Saved to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+corpus_manifest.scan_file() must count chars exactly as a text-mode read does
+(build_vocab.py / clean_abc_raw_index_by_token.py before the manifest existed).
+Run from part1: python -m pytest tests
+"""
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from corpus_manifest import scan_file
+
+TUNES = {
+    "lf": b"X:1\nT:lf\nK:C\nabc|def|\n",
+    "crlf": b"X:1\r\nT:crlf\r\nK:C\r\nabc|def|\r\n",
+    "cr": b"X:1\rT:cr\rK:C\rabc|def|\r",
+    "mixed": b"X:1\r\nT:mixed\rK:G\n\xe2\x99\xaf ab\xff|\r\n\r",
+}
+
+@pytest.mark.parametrize("name", sorted(TUNES))
+def test_counts_match_text_mode_read(tmp_path, name):
+    path = tmp_path / f"{name}.abc"
+    path.write_bytes(TUNES[name])
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+
+    size, chars, _, codepoints, counts = scan_file(str(path))
+    assert size == len(TUNES[name])
+    assert chars == len(text)
+    assert dict(zip(map(chr, codepoints.tolist()), counts.tolist())) == Counter(text)
+    assert "\r" not in text
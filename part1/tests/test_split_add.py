@@ -0,0 +1,72 @@
+"""
+split_abc_by_token_count.py --add: files that are already split (or already
+clustered by an earlier --add) are skipped, so repeating an --add is a no-op.
+Run from part1: python -m pytest tests
+"""
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import split_abc_by_token_count as split
+
+def write_tunes(root, names):
+    paths = []
+    for i, name in enumerate(names):
+        path = os.path.join(root, name + ".abc")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"X:{i}\nT:{name}\nK:C\n" + "abcdefg"[i % 7] * (40 + 13 * i) + "|\n")
+        paths.append(path)
+    return paths
+
+def write_list(path, paths):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(p + "\n" for p in paths)
+    return str(path)
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["split_abc_by_token_count.py", *argv])
+    split.main()
+
+def snapshot(out_dir):
+    lists = {}
+    for s in split.SPLITS:
+        with open(os.path.join(out_dir, f"{s}.txt"), encoding="utf-8") as f:
+            lists[s] = f.read()
+    return lists, split.load_state(out_dir)
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(split, "MANIFEST_DIR", str(tmp_path / "no_manifest"))
+    monkeypatch.setattr(split, "NEAR_DUP_DIR", str(tmp_path / "near_dup"))
+    monkeypatch.setattr(split, "MIN_TRAIN_TOKENS", 0)
+    (tmp_path / "abc").mkdir()
+    old = write_tunes(str(tmp_path / "abc"), [f"a{i:02d}" for i in range(20)])
+    new = write_tunes(str(tmp_path / "abc"), [f"b{i:02d}" for i in range(8)])
+    out = str(tmp_path / "splits")
+    run(monkeypatch, "--index", write_list(tmp_path / "index.txt", old), "--out", out, "--workers", "1")
+    return tmp_path, out, old, new
+
+def test_repeated_add_is_a_no_op(corpus, monkeypatch):
+    tmp_path, out, old, new = corpus
+    add = write_list(tmp_path / "add.txt", new)
+    run(monkeypatch, "--out", out, "--add", add, "--workers", "1")
+    once = snapshot(out)
+    assert sum(once[1]["files"].values()) == len(old) + len(new)
+
+    run(monkeypatch, "--out", out, "--add", add, "--workers", "1")
+    assert snapshot(out) == once
+
+def test_add_skips_files_already_split(corpus, monkeypatch):
+    tmp_path, out, old, new = corpus
+    before = snapshot(out)
+    run(monkeypatch, "--out", out, "--add", write_list(tmp_path / "add.txt", old[:5]), "--workers", "1")
+    assert snapshot(out) == before
+
+    run(monkeypatch, "--out", out, "--add", write_list(tmp_path / "add2.txt", old[5:] + new[:3]), "--workers", "1")
+    lists, state = snapshot(out)
+    listed = [p for s in split.SPLITS for p in lists[s].split("\n") if p]
+    assert sorted(listed) == sorted(old + new[:3])
+    assert state["files"] == {s: len([p for p in lists[s].split("\n") if p]) for s in split.SPLITS}
@@ -0,0 +1,72 @@
+"""
+AbcTokenizer (compiled scanner and regex fallback) must give exactly the
+tokens of the reference tokenize_abc_text().
+Run from part1: python -m pytest tests
+"""
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import tokenize_abc
+from tokenize_abc import AbcTokenizer, tokenize_abc_text
+
+TRICKY = [
+    "X:1\nT:Title\nM:4/4\nL:1/8\nK:C\nC2 E2 G2 | [CEG] (3ABC z2 ||\n",
+    "[C E G] [CE\nG] [] [[C]] ]x[",           # chords with spaces, broken chords
+    "(3z2 (3/2 (12AB,c' ( (x (3 ABC",         # tuplets and what is not one
+    "c,,' C'' ,a '' z/2 z3/4 z// 12/ /",       # octave marks, rests, numbers
+    "||| |:: :| |] K: K:C w:foo bar hello zebra", # bars, headers, other words
+    "% comment\n %not one\nA%B\n%\n%[C E]\nB", # comment lines only at line start
+    "A\r\nB\rC\x0bD\x0cE\x1cF\x1dG\x1e%x\x85a %y b",
+    "a\tb\x1fc\xa0d e f g A B　C", # spaces that are not line breaks
+    "é [é ü] (3é ٣4 Ab٣ ß z٣ 𝄞 \ud800",   # non-ASCII
+    "", "\n", "   ", "no newline at end", "%only a comment",
+]
+
+
+def reference_check(tok, texts):
+    ids, offsets = tok.encode_batch(texts, chunk_size=7)
+    itos = tok.itos
+    for i, text in enumerate(texts):
+        assert [itos[int(x)] for x in ids[offsets[i]:offsets[i + 1]]] == tokenize_abc_text(text), repr(text)
+
+
+def random_texts(n, seed=0):
+    rng = random.Random(seed)
+    alphabet = list("ABCDEFGabcdefgzKXhT:|[]()%,'/0159 \t\n\r\x0b\x85\xa0 　é٣-=^_~!") + ["\r\n", "(3", "%c"]
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80))) for _ in range(n)]
+
+
+@pytest.fixture(params=["scanner", "regex"])
+def engine(request, monkeypatch):
+    if request.param == "scanner":
+        if tokenize_abc.load_scanner() is None:
+            pytest.skip("abc_scan.c could not be built")
+    else:
+        monkeypatch.setattr(tokenize_abc, "load_scanner", lambda: None)
+    return request.param
+
+
+def test_tricky_texts(engine):
+    reference_check(AbcTokenizer(), TRICKY)
+
+
+def test_random_texts(engine):
+    reference_check(AbcTokenizer(), random_texts(3000))
+
+
+def test_vocab_is_shared_across_chunks(engine):
+    tok = AbcTokenizer()
+    ids, offsets = tok.encode_batch(["A B", "B C", "C A"], chunk_size=1)
+    assert tok.decode(ids) == ["A", "B", "B", "C", "C", "A"]
+    assert ids.tolist() == [0, 1, 1, 2, 2, 0]
+    assert offsets.tolist() == [0, 2, 4, 6]
+
+
+def test_frozen_vocab_maps_unseen_to_unk(engine):
+    tok = AbcTokenizer({"A": 0, "B": 1}, frozen=True, unk_id=9)
+    ids, _ = tok.encode_batch(["A C B"])
+    assert ids.tolist() == [0, 9, 1]
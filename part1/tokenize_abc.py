@@ -1,5 +1,18 @@
+import os
 import re
+import shlex
+import ctypes
+import hashlib
+import sysconfig
+import subprocess
+import multiprocessing as mp
+from itertools import chain
 
+import numpy as np
+
+# Reference tokenizer. Kept as-is because other code (and the benchmark)
+# compare against its output; note that `[0-9/]*` can match the empty string,
+# so findall() yields '' at every position where no earlier alternative fits.
 TOKEN_PATTERN = re.compile(
     r"""
     \[[^\]]+\]              |  # chords like [CEG]
@@ -16,6 +29,31 @@ TOKEN_PATTERN = re.compile(
     re.VERBOSE,
 )
 
+# Regex form of the AbcTokenizer scanner (abc_scan.c), also used by abc_bpe.py:
+# same token stream as tokenize_abc_text(), but every alternative consumes at
+# least one char, so no empty matches, and it runs once over the whole text
+# instead of once per line. Chords may not cross a newline (the reference
+# works line by line). AbcTokenizer falls back to it without a C compiler.
+SCAN_PATTERN = re.compile(
+    r"""
+    \[[^\]\n]+\]            |  # chords like [CEG]
+    \([0-9]+[A-Za-z]+       |  # decorations like (3ABC
+    [A-Ga-g][,']*           |  # note letters with octave markers
+    [0-9/]+                 |  # durations / pure numbers
+    z[0-9/]*                |  # rests: z, z2, z/2
+    \|+                     |  # bar lines | ||
+    [A-Za-z]+:[^\s]+        |  # headers K:C, M:4/4, Q:1/4=120
+    [^A-Za-z0-9\s]          |  # any single leftover symbol
+    \S+                        # any other non-space token
+""",
+    re.VERBOSE,
+)
+
+COMMENT_LINE = re.compile(r"^%[^\n]*", re.MULTILINE)
+# line boundaries recognized by str.splitlines() other than "\n"
+OTHER_NEWLINES = re.compile("[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
 def tokenize_abc_line(line: str):
     if line.startswith("%"):
         return []
@@ -39,6 +77,143 @@ def tokenize_abc_text(text: str):
     return all_tokens
 
 
+def _normalize(text: str) -> str:
+    if OTHER_NEWLINES.search(text):
+        text = "\n".join(text.splitlines())
+    if "%" in text:
+        text = COMMENT_LINE.sub("", text)
+    return text
+
+
+def scan_abc_text(text: str):
+    """Regex equivalent of tokenize_abc_text(): one findall over the whole text."""
+    return SCAN_PATTERN.findall(_normalize(text))
+
+
+class _GrowingVocab(dict):
+    """token -> id, assigning the next id to unseen tokens on lookup."""
+
+    def __missing__(self, token):
+        idx = self[token] = len(self)
+        return idx
+
+
+SCANNER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "abc_scan.c")
+_scanner = None
+
+
+def load_scanner():
+    """
+    The compiled abc_scan.c, built with the interpreter's C compiler into
+    __pycache__ on first use (one .so per source version). None if it cannot
+    be built, in which case AbcTokenizer uses SCAN_PATTERN.
+    """
+    global _scanner
+    if _scanner is not None:
+        return _scanner or None
+    with open(SCANNER_SOURCE, "rb") as f:
+        tag = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    lib_path = os.path.join(os.path.dirname(SCANNER_SOURCE), "__pycache__", f"abc_scan.{tag}.so")
+    try:
+        if not os.path.exists(lib_path):
+            os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+            tmp = f"{lib_path}.{os.getpid()}.tmp"
+            cc = shlex.split(sysconfig.get_config_var("CC") or "cc")
+            subprocess.run(cc + ["-O2", "-shared", "-fPIC", "-o", tmp, SCANNER_SOURCE],
+                           check=True, capture_output=True)
+            os.replace(tmp, lib_path)
+        lib = ctypes.CDLL(lib_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[WARN] could not build {os.path.basename(SCANNER_SOURCE)} ({e}), "
+              f"AbcTokenizer falls back to the regex scanner")
+        _scanner = False
+        return None
+    array = np.ctypeslib.ndpointer
+    lib.abc_encode.restype = ctypes.c_int64
+    lib.abc_encode.argtypes = [array(np.uint32, flags="C"), ctypes.c_int64,
+                               array(np.int64, flags="C"), ctypes.c_int64, array(np.int64, flags="C"),
+                               array(np.int32, flags="C"), array(np.int64, flags="C"), array(np.int32, flags="C")]
+    _scanner = lib
+    return lib
+
+
+def _encode_chunk_regex(texts):
+    vocab = _GrowingVocab()
+    toks = [scan_abc_text(t) for t in texts]
+    counts = np.fromiter(map(len, toks), dtype=np.int64, count=len(toks))
+    local_ids = np.fromiter(map(vocab.__getitem__, chain.from_iterable(toks)),
+                            dtype=np.int32, count=int(counts.sum()))
+    return local_ids, counts, list(vocab)
+
+
+def _encode_chunk(texts):
+    """Worker: encode with a chunk-local vocab; the parent remaps local ids to global ones."""
+    lib = load_scanner()
+    if lib is None:
+        return _encode_chunk_regex(texts)
+    joined = "\n".join(texts) + "\n"
+    codes = np.frombuffer(joined.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    n = len(codes)
+    ends = np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) + 1)
+    counts = np.zeros(len(texts), dtype=np.int64)
+    ids = np.empty(n, dtype=np.int32)
+    vocab_start = np.empty(n, dtype=np.int64)
+    vocab_len = np.empty(n, dtype=np.int32)
+    n_vocab = lib.abc_encode(codes, n, ends, len(texts), counts, ids, vocab_start, vocab_len)
+    if n_vocab < 0:
+        raise MemoryError("abc_encode: out of memory")
+    vocab = [joined[i:i + k] for i, k in zip(vocab_start[:n_vocab].tolist(), vocab_len[:n_vocab].tolist())]
+    return ids[:int(counts.sum())], counts, vocab
+
+
+class AbcTokenizer:
+    """
+    Batch ABC tokenizer: many texts in, flat int32 token ids + int64 offsets out
+    (tokens of text i are ids[offsets[i]:offsets[i+1]]).
+    Unseen tokens get new ids unless `frozen`, in which case they map to `unk_id`.
+    """
+
+    def __init__(self, vocab=None, frozen: bool = False, unk_id: int = -1):
+        self.vocab = _GrowingVocab(vocab or {})
+        self.frozen = frozen
+        self.unk_id = unk_id
+
+    @property
+    def itos(self):
+        return {i: t for t, i in self.vocab.items()}
+
+    def _remap(self, local_tokens):
+        if self.frozen:
+            return np.array([self.vocab.get(t, self.unk_id) for t in local_tokens], dtype=np.int32)
+        lookup = self.vocab.__getitem__
+        return np.fromiter(map(lookup, local_tokens), dtype=np.int32, count=len(local_tokens))
+
+    def encode_batch(self, texts, workers: int = 1, chunk_size: int = 256):
+        texts = list(texts)
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        if workers > 1 and len(chunks) > 1:
+            load_scanner() # build it once here, not in every worker
+            with mp.Pool(workers) as pool:
+                parts = pool.map(_encode_chunk, chunks)
+        else:
+            parts = [_encode_chunk(c) for c in chunks]
+
+        all_ids, all_lengths = [], []
+        for local_ids, lengths, local_tokens in parts:
+            all_ids.append(self._remap(local_tokens)[local_ids] if len(local_ids) else local_ids)
+            all_lengths.append(lengths)
+
+        ids = np.concatenate(all_ids) if all_ids else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        if all_lengths:
+            np.cumsum(np.concatenate(all_lengths), out=offsets[1:])
+        return ids, offsets
+
+    def decode(self, ids):
+        itos = self.itos
+        return [itos[int(i)] for i in ids]
+
+
 if __name__ == "__main__":
     sample = """
 X:1
@@ -7,12 +7,14 @@ import numpy as np
 import time
 import torch
 from model import GPTConfig, GPT
+from data_loader import make_loader
 
 # -----------------------------------------------------------------------------
 batch_size = 12
 block_size = 1024
 bias = False
 real_data = True
+prefetch = 4 # batches assembled ahead on a background thread (0: on the main thread)
 seed = 1337
 device = 'cuda' # examples: 'cpu', 'cuda', 'cuda:0', 'cuda:1', etc.
 dtype = 'bfloat16' if torch.cuda.is_available() and torch.cuda.is_bf16_supported() else 'float16' # 'float32' or 'bfloat16' or 'float16'
@@ -33,14 +35,8 @@ ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=
 if real_data:
     dataset = 'openwebtext'
     data_dir = os.path.join('data', dataset)
-    train_data = np.memmap(os.path.join(data_dir, 'train.bin'), dtype=np.uint16, mode='r')
-    def get_batch(split):
-        data = train_data # note ignore split in benchmarking script
-        ix = torch.randint(len(data) - block_size, (batch_size,))
-        x = torch.stack([torch.from_numpy((data[i:i+block_size]).astype(np.int64)) for i in ix])
-        y = torch.stack([torch.from_numpy((data[i+1:i+1+block_size]).astype(np.int64)) for i in ix])
-        x, y = x.pin_memory().to(device, non_blocking=True), y.pin_memory().to(device, non_blocking=True)
-        return x, y
+    train_loader = make_loader(data_dir, 'train', block_size, batch_size, device, prefetch=prefetch, seed=seed)
+    get_batch = lambda split: train_loader() # note ignore split in benchmarking script
 else:
     # alternatively, if fixed data is desired to not care about data loading
     x = torch.randint(50304, (batch_size, block_size), device=device)
@@ -98,6 +94,8 @@ else:
     # simple benchmarking
     torch.cuda.synchronize()
     for stage, num_steps in enumerate([10, 20]): # burnin, then benchmark
+        if real_data:
+            train_loader.pop_data_wait()
         t0 = time.time()
         X, Y = get_batch('train')
         for k in range(num_steps):
@@ -115,3 +113,5 @@ else:
         mfu = model.estimate_mfu(batch_size * 1 * num_steps, dt)
         if stage == 1:
             print(f"time per iteration: {dt/num_steps*1000:.4f}ms, MFU: {mfu*100:.2f}%")
+            if real_data:
+                print(f"data wait per iteration: {train_loader.pop_data_wait()/num_steps*1000:.4f}ms")
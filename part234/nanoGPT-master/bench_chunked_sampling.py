@@ -0,0 +1,74 @@
+"""
+batches/s of uniformly random windows vs ChunkWindows ('chunked' sampling) with
+the split's pages evicted from the page cache (posix_fadvise DONTNEED) every few
+batches, i.e. as if train.bin were larger than RAM on cold storage. Also reports
+from how many resident chunks a chunked batch draws, as a check on mixing.
+Run from nanoGPT-master: python bench_chunked_sampling.py --data_dir data/abc_char
+"""
+import os
+import time
+import argparse
+import numpy as np
+
+from token_data import open_tokens, data_dtype
+from data_loader import TokenBatcher, ChunkWindows
+
+def evict(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def run(args, sampler):
+    """
+    (first batch s, steady batches/s); the split's pages are evicted every
+    `evict_every` batches to mimic a split larger than RAM.
+    """
+    path = os.path.join(args.data_dir, f"{args.split}.bin")
+    batcher = TokenBatcher(args.data_dir, args.split, args.block_size, args.batch_size, "cpu",
+                           seed=0, sampler=sampler)
+    evict(path)
+    t0 = time.time()
+    batcher.sample() # chunked: fills the resident buffer
+    first, spent = time.time() - t0, 0.0
+    for i in range(args.iters):
+        t0 = time.time()
+        batcher.sample()
+        spent += time.time() - t0 # eviction itself is not timed
+        if (i + 1) % args.evict_every == 0:
+            evict(path)
+    return first, args.iters / spent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/abc_char")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--iters", type=int, default=500)
+    parser.add_argument("--chunk_mb", type=int, default=64)
+    parser.add_argument("--chunk_depth", type=int, default=8)
+    parser.add_argument("--evict_every", type=int, default=1)
+    args = parser.parse_args()
+
+    dtype = data_dtype(args.data_dir)
+    n_tokens = len(open_tokens(args.data_dir, args.split, dtype=dtype))
+    print(f"[INFO] {args.split}: {n_tokens:,} tokens, B={args.batch_size} T={args.block_size}, "
+          f"chunks of {args.chunk_mb} MB x {args.chunk_depth}")
+
+    w_random, t_random = run(args, None)
+    chunks = ChunkWindows(n_tokens, args.block_size, args.chunk_mb * 2**20 // dtype.itemsize,
+                          depth=args.chunk_depth, seed=0)
+    w_chunked, t_chunked = run(args, chunks)
+    # batch mixing: distinct resident chunks a chunked batch draws from
+    counts = np.array([len(c) - args.block_size for c in chunks.resident], dtype=np.float64)
+    which = [np.unique(chunks.rng.choice(len(counts), size=args.batch_size, p=counts / counts.sum())).size
+             for _ in range(100)]
+
+    windows = (args.iters + 1) * args.batch_size
+    print(f"random windows (cold) : {t_random:9.1f} batches/s, first batch {w_random:.2f}s")
+    print(f"chunked (cold)        : {t_chunked:9.1f} batches/s ({t_chunked / t_random:.1f}x), "
+          f"first batch {w_chunked:.2f}s (buffer fill), {windows // chunks.quota} chunk swaps, "
+          f"~{np.mean(which):.1f} of {len(chunks.resident)} resident chunks per batch")
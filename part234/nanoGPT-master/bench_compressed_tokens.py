@@ -0,0 +1,65 @@
+"""
+Block-compressed split vs the raw memmap: compression ratio, compress MB/s, and
+get_batch-style random-window batches/s through each reader, with an identity check.
+The compressed reader is timed at several block cache sizes: once the cache holds
+the whole split it only measures cached slicing, not decompression.
+Needs the raw bins (prepare_abc_char.py --compress --keep_raw).
+Run from nanoGPT-master: python bench_compressed_tokens.py --data_dir data/abc_char
+"""
+import time
+import argparse
+import numpy as np
+
+from token_data import open_tokens, compress_split, default_codec, BlockCompressedTokens, BLOCK_TOKENS
+
+def batches_per_s(data, batch_size, block_size, iters, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(data) - block_size - 1
+    t0 = time.time()
+    for _ in range(iters):
+        for i in rng.integers(n, size=batch_size):
+            data[i:i+block_size+1].astype(np.int64)
+    return iters / (time.time() - t0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/abc_char")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--codec", type=str, default=default_codec())
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--block_tokens", type=int, default=BLOCK_TOKENS)
+    parser.add_argument("--cache_blocks", type=int, nargs="+", default=[0, 16, 256])
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--iters", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    raw = open_tokens(args.data_dir, args.split, shared=False)
+    if isinstance(raw, BlockCompressedTokens):
+        parser.error(f"{args.split} has no raw bins left to compare against, rebuild with --compress --keep_raw")
+    t0 = time.time()
+    raw_bytes, packed_bytes = compress_split(args.data_dir, args.split, args.block_tokens,
+                                             args.codec, args.level, args.workers)
+    dt = time.time() - t0
+    packed = BlockCompressedTokens(args.data_dir, args.split)
+    print(f"[INFO] {args.split}: {len(raw):,} tokens, codec={args.codec} level={args.level} "
+          f"block_tokens={args.block_tokens:,}")
+
+    rng = np.random.default_rng(1)
+    for i in rng.integers(len(raw) - 4096, size=200):
+        assert np.array_equal(raw[i:i+4096], packed[i:i+4096]), f"mismatch at {i}"
+    assert np.array_equal(raw[-7:], packed[-7:])
+    print("[OK] Compressed reader identical to the raw memmap")
+
+    t_raw = batches_per_s(raw, args.batch_size, args.block_size, args.iters)
+    print(f"compressed   : {raw_bytes / 1e6:.1f} MB -> {packed_bytes / 1e6:.1f} MB "
+          f"({raw_bytes / max(packed_bytes, 1):.2f}x) at {raw_bytes / dt / 1e6:.1f} MB/s")
+    print(f"raw memmap   : {t_raw:8.1f} batches/s")
+    n_blocks = len(packed.byte_offsets) - 1
+    for cache_blocks in args.cache_blocks:
+        packed = BlockCompressedTokens(args.data_dir, args.split, cache_blocks=cache_blocks)
+        t_packed = batches_per_s(packed, args.batch_size, args.block_size, args.iters)
+        hit_rate = packed.hits / max(packed.hits + packed.misses, 1)
+        print(f"compressed   : {t_packed:8.1f} batches/s ({t_packed / t_raw:.2f}x) with {cache_blocks} "
+              f"cached blocks ({min(cache_blocks / max(n_blocks, 1), 1):.0%} of the split, hit rate {hit_rate:.1%})")
@@ -0,0 +1,65 @@
+"""
+batches/s of the old per-row get_batch (memmap re-created per call, two stacks of
+per-window int64 copies) vs data_loader.TokenBatcher, with an identity check.
+Run from nanoGPT-master: python bench_get_batch.py --data_dir data/abc_char
+"""
+import time
+import argparse
+import numpy as np
+import torch
+
+from token_data import open_tokens, data_dtype
+from data_loader import TokenBatcher
+
+def get_batch_reference(data_dir, split, block_size, batch_size, device, dtype):
+    """The previous train.py get_batch."""
+    data = open_tokens(data_dir, split, dtype=dtype)
+    ix = torch.randint(len(data) - block_size, (batch_size,))
+    x = torch.stack([torch.from_numpy((data[i:i+block_size]).astype(np.int64)) for i in ix])
+    y = torch.stack([torch.from_numpy((data[i+1:i+1+block_size]).astype(np.int64)) for i in ix])
+    if 'cuda' in device:
+        x, y = x.pin_memory().to(device, non_blocking=True), y.pin_memory().to(device, non_blocking=True)
+    else:
+        x, y = x.to(device), y.to(device)
+    return x, y
+
+def batches_per_s(fn, iters, device):
+    fn()
+    if 'cuda' in device:
+        torch.cuda.synchronize()
+    t0 = time.time()
+    for _ in range(iters):
+        x, y = fn()
+    if 'cuda' in device:
+        torch.cuda.synchronize()
+    return iters / (time.time() - t0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/abc_char")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--iters", type=int, default=500)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    dtype = data_dtype(args.data_dir)
+    batcher = TokenBatcher(args.data_dir, args.split, args.block_size, args.batch_size, args.device, dtype=dtype)
+    reference = lambda: get_batch_reference(args.data_dir, args.split, args.block_size, args.batch_size,
+                                            args.device, dtype)
+
+    for _ in range(3):
+        torch.manual_seed(0)
+        x0, y0 = reference()
+        torch.manual_seed(0)
+        x1, y1 = batcher()
+        assert torch.equal(x0, x1) and torch.equal(y0, y1), "batches differ"
+    print("[OK] TokenBatcher batches identical to the per-row get_batch")
+    print(f"[INFO] {args.split}: {len(batcher.data):,} tokens ({dtype.name}), "
+          f"B={args.batch_size} T={args.block_size} on {args.device}")
+
+    t_ref = batches_per_s(reference, args.iters, args.device)
+    t_new = batches_per_s(batcher, args.iters, args.device)
+    print(f"per-row get_batch : {t_ref:9.1f} batches/s")
+    print(f"TokenBatcher      : {t_new:9.1f} batches/s ({t_new / t_ref:.1f}x)")
@@ -0,0 +1,84 @@
+"""
+Random windows vs document-packed batches (block-diagonal attention, per-tune
+positions): training throughput and the loss each model reaches, on both kinds
+of val batches. Same model init, same number of steps.
+Run from nanoGPT-master: python bench_packing.py --data_dir data/abc_char
+"""
+import time
+import argparse
+import numpy as np
+import torch
+
+from model import GPTConfig, GPT
+from token_data import open_tokens, data_dtype, doc_starts
+from data_loader import make_loader, DocPacker
+
+def loader(args, split, packed, seed):
+    packer = None
+    if packed:
+        n_tokens = len(open_tokens(args.data_dir, split))
+        packer = DocPacker(doc_starts(args.data_dir, split), n_tokens, seed=seed)
+    return make_loader(args.data_dir, split, args.block_size, args.batch_size, args.device,
+                       dtype=data_dtype(args.data_dir), prefetch=4, seed=seed, packer=packer)
+
+def batch(load):
+    b = load()
+    return b if len(b) == 3 else (*b, None)
+
+@torch.no_grad()
+def val_loss(model, args, packed):
+    model.eval()
+    load = loader(args, "val", packed, seed=1)
+    losses = [model(*batch(load))[1].item() for _ in range(args.eval_iters)]
+    load.close()
+    model.train()
+    return float(np.mean(losses))
+
+def train(args, packed):
+    torch.manual_seed(0)
+    model = GPT(GPTConfig(block_size=args.block_size, vocab_size=args.vocab_size, n_layer=args.n_layer,
+                          n_head=args.n_head, n_embd=args.n_embd, dropout=0.0, bias=False)).to(args.device)
+    optimizer = model.configure_optimizers(0.1, args.learning_rate, (0.9, 0.99), args.device)
+    load = loader(args, "train", packed, seed=0)
+    useful = 0
+    t0 = time.time()
+    for _ in range(args.iters):
+        X, Y, S = batch(load)
+        _, loss = model(X, Y, S)
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+        useful += int((Y >= 0).sum())
+    loss.item()
+    if "cuda" in args.device:
+        torch.cuda.synchronize()
+    dt = time.time() - t0
+    load.close()
+    tokens = args.iters * args.batch_size * args.block_size
+    return {
+        "tokens/s": tokens / dt,
+        "useful": useful / tokens,
+        "val (random)": val_loss(model, args, False),
+        "val (packed)": val_loss(model, args, True),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/abc_char")
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--n_layer", type=int, default=4)
+    parser.add_argument("--n_head", type=int, default=4)
+    parser.add_argument("--n_embd", type=int, default=128)
+    parser.add_argument("--vocab_size", type=int, default=128)
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--iters", type=int, default=300)
+    parser.add_argument("--eval_iters", type=int, default=20)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    results = {"random windows": train(args, False), "packed tunes": train(args, True)}
+    print(f"[INFO] {args.iters} steps of B={args.batch_size} T={args.block_size} on {args.device}")
+    print(f"{'':16s} {'tokens/s':>10s} {'useful':>7s} {'val (random)':>13s} {'val (packed)':>13s}")
+    for name, r in results.items():
+        print(f"{name:16s} {r['tokens/s']:10.0f} {r['useful']:7.1%} {r['val (random)']:13.4f} {r['val (packed)']:13.4f}")
@@ -15,6 +15,8 @@ dataset = 'abc_char'
 gradient_accumulation_steps = 4
 batch_size = 32
 block_size = 512          
+prefetch = 4               # batches built ahead on a background thread
+sampling = 'epoch'         # every block once per epoch, resumable
 
 n_layer = 6
 n_head = 6
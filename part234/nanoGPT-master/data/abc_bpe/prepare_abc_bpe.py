@@ -0,0 +1,50 @@
+"""
+Build the abc_bpe dataset: the abc_char splits, encoded with the ABC-aware BPE
+of part1/abc_bpe.py instead of the char vocab. Uses the abc_char builder, so the
+output is the same (<split>.bin, .idx.npy, .files.txt, .manifest.json, meta.pkl)
+and resume, --append, --shard_tokens and --compress work the same way.
+Run from data/abc_bpe: python prepare_abc_bpe.py [same flags as prepare_abc_char.py]
+"""
+import os
+import sys
+import numpy as np
+
+BASE_DIR = os.path.dirname(__file__)
+BPE_PATH = "../../../data/abc_bpe.json"   # written by part1/abc_bpe.py
+
+# the encoder lives with the other tokenizer code in part1, the builder in abc_char
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "..", "part1"))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "abc_char"))
+from abc_bpe import AbcBPE
+from prepare_abc_char import build_dataset
+
+class BPEEncoder:
+    """Builder encoder (see prepare_abc_char.CharEncoder) for a trained AbcBPE."""
+    spill_counts = True # a BPE length is a full encode, so phase 1 keeps the ids for phase 2
+
+    def __init__(self, bpe):
+        self.bpe = bpe
+
+    def encode(self, text, dtype):
+        return np.array(self.bpe.encode(text), dtype=dtype)
+
+    def count(self, text):
+        return len(self.bpe.encode(text))
+
+    def fingerprint(self):
+        return repr((self.bpe.alphabet, self.bpe.merges)).encode("utf-8")
+
+    def known_counts(self, file_list):
+        return np.full(len(file_list), -1, dtype=np.int64) # BPE lengths need the encoding
+
+
+if __name__ == "__main__":
+    bpe = AbcBPE.load(BPE_PATH)
+    assert bpe.vocab_size <= 65536, "token ids are stored as uint16"
+    print(f"[INFO] Loaded ABC BPE, vocab size = {bpe.vocab_size}")
+
+    # itos maps ids to strings, so sample.py's ''.join decode works unchanged;
+    # sample.py rebuilds the encoder from the merges to encode prompts
+    build_dataset(BPEEncoder(bpe), bpe.stoi, bpe.itos, BASE_DIR,
+                  desc="ABC-aware BPE music dataset (parallel, nanoGPT compatible)",
+                  extra_meta={"merges": bpe.merges})
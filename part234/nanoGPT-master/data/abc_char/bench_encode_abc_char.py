@@ -0,0 +1,69 @@
+"""
+MB/s per worker of the char -> id encoder: the old per-char dict loop vs the
+lookup-table path in prepare_abc_char.py, with a bit-identity check.
+Run from data/abc_char: python bench_encode_abc_char.py [--index files.txt]
+"""
+import os
+import glob
+import time
+import argparse
+import numpy as np
+
+from prepare_abc_char import VOCAB_PATH, load_vocab, build_lookup, encode_text
+
+SAMPLE_GLOB = "../../part4_results/*_abc/*.abc"
+
+def encode_reference(path, stoi):
+    """The previous encode_worker inner loop."""
+    buf = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as fin:
+        for line in fin:
+            for ch in line:
+                if ch in stoi:
+                    buf.append(stoi[ch])
+    return np.array(buf, dtype=np.uint16)
+
+def encode_new(path, lut):
+    with open(path, "r", encoding="utf-8", errors="ignore") as fin:
+        return encode_text(fin.read(), lut)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default=None)
+    parser.add_argument("--limit", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.index:
+        with open(args.index, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip()][:args.limit]
+    else:
+        paths = sorted(glob.glob(SAMPLE_GLOB))
+    paths = paths * args.repeat
+    n_bytes = sum(os.path.getsize(p) for p in paths)
+
+    if os.path.exists(VOCAB_PATH):
+        chars = load_vocab(VOCAB_PATH)
+    else:
+        # no vocab built yet: use the sample's chars, minus a few to exercise the drop path
+        chars = set()
+        for p in set(paths):
+            with open(p, "r", encoding="utf-8", errors="ignore") as f:
+                chars.update(f.read())
+        chars = sorted(chars - set("%~"))
+    stoi = {ch: i for i, ch in enumerate(chars)}
+    lut = build_lookup(stoi)
+    print(f"[INFO] {len(paths):,} files, {n_bytes / 1e6:.1f} MB, vocab {len(chars)}")
+
+    t0 = time.time()
+    ref = [encode_reference(p, stoi) for p in paths]
+    t_ref = time.time() - t0
+
+    t0 = time.time()
+    new = [encode_new(p, lut) for p in paths]
+    t_new = time.time() - t0
+
+    assert all(a.tobytes() == b.tobytes() for a, b in zip(ref, new)), "output differs"
+    print("[OK] Output bit-identical")
+    print(f"per-char loop : {n_bytes / t_ref / 1e6:8.1f} MB/s per worker")
+    print(f"lookup table  : {n_bytes / t_new / 1e6:8.1f} MB/s per worker ({t_ref / t_new:.1f}x)")
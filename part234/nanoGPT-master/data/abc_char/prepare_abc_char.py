@@ -1,121 +1,686 @@
+"""
+Build the abc_char dataset: <split>.bin (uint8/uint16 token ids), <split>.idx.npy
+(document starts) and <split>.manifest.json for train, val and test (plus any
+--extra name=list), and a shared meta.pkl.
+Resumable: finished chunks are logged in <split>.chunks.jsonl, so rerunning
+after a crash only encodes the missing chunks; finished splits are skipped.
+--append encodes only files that are not in a split yet and appends them.
+The builder is shared with data/abc_bpe/prepare_abc_bpe.py: everything that
+depends on the tokenizer goes through an encoder (CharEncoder here).
+"""
 import os
+import sys
+import json
 import pickle
+import shutil
+import hashlib
+import argparse
 import numpy as np
 from multiprocessing import Pool, cpu_count
 
 BASE_DIR = os.path.dirname(__file__)
-TRAIN_LIST = "../../../data/splits_unique/train.txt"
-VAL_LIST   = "../../../data/splits_unique/val.txt"
+SPLIT_LISTS = {
+    "train": "../../../data/splits_unique/train.txt",
+    "val":   "../../../data/splits_unique/val.txt",
+    "test":  "../../../data/splits_unique/test.txt",
+}
 VOCAB_PATH = "../../../data/vocab_charlevel.txt"
 
-OUT_TRAIN_BIN = os.path.join(BASE_DIR, "train.bin")
-OUT_VAL_BIN   = os.path.join(BASE_DIR, "val.bin")
-OUT_META      = os.path.join(BASE_DIR, "meta.pkl")
+OUT_META = os.path.join(BASE_DIR, "meta.pkl")
 
-TMP_DIR = os.path.join(BASE_DIR, "tmp_parts")
-os.makedirs(TMP_DIR, exist_ok=True)
+# optional: exact per-file token counts without reading the files (part1/corpus_manifest.py)
+MANIFEST_DIR = "../../../data/corpus_manifest"
+PART1_DIR = os.path.join(BASE_DIR, "..", "..", "..", "..", "part1")
+
+# shard layout / reader shared with train.py (nanoGPT-master/token_data.py)
+sys.path.insert(0, os.path.join(BASE_DIR, "..", ".."))
+from token_data import (shard_path, shard_layout, shard_index_path, write_shard_index, compress_split, drop_raw,
+                        raw_paths, block_paths, BlockCompressedTokens, BLOCK_TOKENS)
+
+# 0: one flat <split>.bin; otherwise <split>.NNNNNN.bin shards of this many tokens
+SHARD_TOKENS = 0
+
+# default of --eot: append an end-of-tune token (id = vocab size) after every document
+ADD_EOT = False
+EOT_TOKEN = "<|endoftune|>"
 
 NUM_WORKERS = min(16, cpu_count())
 
 CHUNK_SIZE = 200        
-FLUSH_TOKENS = 500_000  
 
-chars = []
-with open(VOCAB_PATH, "r", encoding="utf-8") as f:
-    for line in f:
-        tok = line.rstrip("\n")
-        if tok == r"\n":
-            tok = "\n"
-        chars.append(tok)
+def load_vocab(path):
+    chars = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            tok = line.rstrip("\n")
+            if tok == r"\n":
+                tok = "\n"
+            chars.append(tok)
+    return sorted(set(chars))
+
+def build_lookup(stoi):
+    """Code point -> token id table, -1 for chars outside the vocab (they are dropped)."""
+    lut = np.full(max(256, max(map(ord, stoi)) + 1), -1, dtype=np.int32)
+    for ch, i in stoi.items():
+        lut[ord(ch)] = i
+    return lut
+
+def encode_text(text, lut, dtype=np.uint16):
+    """Token ids of a decoded file: one table lookup per char, unknown chars dropped."""
+    if text.isascii():
+        cps = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        ids = lut[cps]
+    else:
+        cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        ids = lut[np.minimum(cps, len(lut) - 1)]
+        ids[cps >= len(lut)] = -1
+    return ids[ids >= 0].astype(dtype)
+
+def count_text(text, valid):
+    """Token count of a decoded file: its in-vocab chars (valid = lut >= 0), no ids kept."""
+    if text.isascii():
+        return int(np.count_nonzero(valid[np.frombuffer(text.encode("ascii"), dtype=np.uint8)]))
+    cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    return int(np.count_nonzero(valid[np.minimum(cps, len(valid) - 1)] & (cps < len(valid))))
+
+def token_dtype(vocab_size):
+    """Smallest storage dtype for the vocab: uint8 for the char vocab, uint16 otherwise."""
+    return np.dtype(np.uint8 if vocab_size <= 256 else np.uint16)
+
+class CharEncoder:
+    """
+    Encoder interface of the builder, for the char vocab:
+      encode(text, dtype)      token ids of a decoded file
+      count(text)              len(encode(text, ...)), as cheaply as the encoding allows
+      fingerprint()            bytes that change whenever the encoding does (plan key)
+      known_counts(file_list)  per-file token counts known without reading, -1 elsewhere
+      spill_counts             True if counting costs a full encode: phase 1 then keeps
+                               the encoded chunks on disk for phase 2 (<split>.spill/)
+    """
+    spill_counts = False # a count is one table lookup per char, phase 2 encodes again
 
-chars = sorted(set(chars))
-vocab_size = len(chars)
-print(f"[INFO] Loaded char vocab, size = {vocab_size}")
+    def __init__(self, stoi):
+        self.lut = build_lookup(stoi)
+        self.valid = self.lut >= 0
 
-stoi = {ch: i for i, ch in enumerate(chars)}
-itos = {i: ch for i, ch in enumerate(chars)}
+    def encode(self, text, dtype):
+        return encode_text(text, self.lut, dtype)
+
+    def count(self, text):
+        return count_text(text, self.valid)
+
+    def fingerprint(self):
+        return self.lut.tobytes()
+
+    def known_counts(self, file_list):
+        return manifest_token_counts(file_list, self.lut)
+
+ENCODER = None          # set in every worker by init_worker()
+DTYPE = np.dtype(np.uint16)
+
+def init_worker(encoder, dtype):
+    global ENCODER, DTYPE
+    ENCODER, DTYPE = encoder, np.dtype(dtype)
 
 def load_file_list(path):
     with open(path, "r", encoding="utf-8") as f:
         return [line.strip() for line in f if line.strip() and os.path.exists(line.strip())]
 
-def encode_worker(args):
-    """
-    Encode a chunk of files to a temporary binary file.
-    """
-    chunk_id, paths = args
-    out_path = os.path.join(TMP_DIR, f"part_{chunk_id:06d}.bin")
-
-    buf = []
-    token_count = 0
-
-    with open(out_path, "wb") as fout:
-        for path in paths:
-            try:
-                with open(path, "r", encoding="utf-8", errors="ignore") as fin:
-                    for line in fin:
-                        for ch in line:
-                            if ch in stoi:
-                                buf.append(stoi[ch])
-                                if len(buf) >= FLUSH_TOKENS:
-                                    np.array(buf, dtype=np.uint16).tofile(fout)
-                                    token_count += len(buf)
-                                    buf.clear()
-            except Exception:
-                continue
+def load_file_list_raw(path):
+    """File list without the existence filter (encoded files may be gone since)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+def read_text(path):
+    """Decoded text of one file; unreadable files read as empty."""
+    try:
+        # text mode: same newline translation as the old line-by-line loop
+        with open(path, "r", encoding="utf-8", errors="ignore") as fin:
+            return fin.read()
+    except Exception:
+        return ""
+
+def read_ids(path):
+    """Token ids of one file; unreadable files encode to nothing."""
+    return ENCODER.encode(read_text(path), DTYPE)
+
+def spill_path(spill_dir, chunk_id):
+    return os.path.join(spill_dir, f"{chunk_id:06d}.bin")
+
+def count_worker(args):
+    """
+    Phase 1: exact token count of every file in a chunk. With a `spill` path
+    (encoders with spill_counts) the encoded chunk is kept there so phase 2
+    copies it instead of encoding the files again; otherwise only counts.
+    """
+    paths, spill = args
+    if spill is None:
+        return np.array([ENCODER.count(read_text(p)) for p in paths], dtype=np.int64)
+    pieces = [read_ids(p) for p in paths]
+    buf = np.concatenate(pieces) if pieces else np.zeros(0, dtype=DTYPE)
+    buf.tofile(spill + ".tmp")
+    os.replace(spill + ".tmp", spill)
+    return np.array([len(ids) for ids in pieces], dtype=np.int64)
+
+def write_worker(args):
+    """
+    Phase 2: write a chunk into its slice of the preallocated output, from its
+    phase-1 spill file if there is one, else encoding the files (counts from the
+    manifest or a counting pass). `files` are the output files the chunk overlaps, as
+    (path, first token, n tokens); a chunk can straddle a shard boundary.
+    Returns (chunk_id, blake2b of the bytes written) for the checkpoint log.
+    """
+    files, chunk_id, start, paths, expected, eot, spill = args
+    spilled = None
+    if spill is not None and os.path.exists(spill) and os.path.getsize(spill) == sum(expected) * DTYPE.itemsize:
+        spilled = np.fromfile(spill, dtype=DTYPE)
+    pieces, pos = [], 0
+    for path, n in zip(paths, expected):
+        if spilled is not None:
+            ids = spilled[pos:pos + n]
+            pos += n
+        else:
+            ids = read_ids(path)
+            if len(ids) != n:
+                raise RuntimeError(f"{path} changed between passes ({n} -> {len(ids)} tokens)")
+        pieces.append(ids)
+        if eot is not None:
+            pieces.append(np.array([eot], dtype=DTYPE))
+    buf = np.concatenate(pieces) if pieces else np.zeros(0, dtype=DTYPE)
+    stop = start + len(buf)
+    for out_path, lo, n in files:
+        a, b = max(start, lo), min(stop, lo + n)
+        if a >= b:
+            continue
+        out = np.memmap(out_path, dtype=DTYPE, mode="r+")
+        out[a - lo:b - lo] = buf[a - start:b - start]
+        out.flush()
+        del out
+    if spilled is not None:
+        os.remove(spill)
+    return chunk_id, hashlib.blake2b(buf.tobytes(), digest_size=16).hexdigest()
+
+def manifest_token_counts(file_list, lut):
+    """
+    Per-file token counts from the part1 corpus manifest (-1 where unknown).
+    The manifest counts chars after newline translation, as read_ids() reads
+    them; a manifest written before it did may still count "\r", so files with
+    one are left to the counting pass.
+    """
+    counts = np.full(len(file_list), -1, dtype=np.int64)
+    if not os.path.exists(MANIFEST_DIR):
+        return counts
+    sys.path.insert(0, PART1_DIR)
+    from corpus_manifest import CorpusManifest
+
+    m = CorpusManifest(MANIFEST_DIR)
+    rows = np.repeat(np.arange(len(m)), np.diff(m.freq_offsets))
+    cps = m.freq_chars.astype(np.int64)
+    known = lut[np.minimum(cps, len(lut) - 1)] >= 0
+    known &= cps < len(lut)
+    in_vocab = np.bincount(rows[known], weights=m.freq_counts[known], minlength=len(m))
+    has_cr = np.zeros(len(m), dtype=bool)
+    has_cr[rows[cps == ord("\r")]] = True
+
+    ids = m.path_ids(file_list)
+    ok = ids >= 0
+    ok[ok] = (~has_cr[ids[ok]]) & (m.byte_size[ids[ok]] >= 0)
+    counts[ok] = in_vocab[ids[ok]].astype(np.int64)
+    return counts
+
+def split_paths(split_name, out_dir=BASE_DIR):
+    stem = os.path.join(out_dir, split_name)
+    return {
+        "bin": stem + ".bin",
+        "idx": stem + ".idx.npy",      # uint64 document starts
+        "files": stem + ".files.txt",  # encoded file of every document, same order
+        "plan": stem + ".build.json",  # written once the token counts are known
+        "spill": stem + ".spill",      # phase-1 encoded chunks (spill_counts encoders), consumed by phase 2
+        "log": stem + ".chunks.jsonl", # one line per finished chunk
+        "manifest": stem + ".manifest.json",
+        "shuffle": stem + ".shuffle.npy",  # shuffle_abc_char.py: list-order index of every document
+    }
+
+def output_files(split_name, total_tokens, shard_tokens, out_dir=BASE_DIR):
+    """[(path, first token, n tokens)] of the files holding a split."""
+    if not shard_tokens:
+        return [(split_paths(split_name, out_dir)["bin"], 0, total_tokens)]
+    return [(shard_path(out_dir, split_name, s), lo, n)
+            for s, lo, n in shard_layout(total_tokens, shard_tokens)]
+
+def overlapping(files, start, stop):
+    return [f for f in files if f[1] < stop and start < f[1] + f[2]]
+
+def allocate(files):
+    """Create or grow every output file to its final size (existing bytes are kept)."""
+    for path, _, n in files:
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.truncate(n * DTYPE.itemsize)
+
+def files_allocated(files):
+    return all(os.path.exists(p) and os.path.getsize(p) == n * DTYPE.itemsize
+               for p, _, n in files)
+
+def remove_outputs(split_name, out_dir=BASE_DIR):
+    paths = split_paths(split_name, out_dir)
+    stale = [paths["bin"], shard_index_path(out_dir, split_name)]
+    s = 0
+    while os.path.exists(shard_path(out_dir, split_name, s)):
+        stale.append(shard_path(out_dir, split_name, s))
+        s += 1
+    for k in ("plan", "log", "manifest", "shuffle"):
+        stale.append(paths[k])
+    # temp files of an interrupted shuffle
+    stale += [paths["bin"] + ".shuffle.tmp"] + [paths[k] + ".tmp" for k in ("idx", "files", "shuffle")]
+    for p in stale:
+        if os.path.exists(p):
+            os.remove(p)
+    shutil.rmtree(paths["spill"], ignore_errors=True)
+    remove_blocks(split_name, out_dir)
+
+def remove_blocks(split_name, out_dir=BASE_DIR):
+    """Delete the block-compressed copy (--compress) of a split that is about to change."""
+    for p in block_paths(out_dir, split_name):
+        if os.path.exists(p):
+            os.remove(p)
+
+def restore_raw(split_name, manifest, out_dir=BASE_DIR):
+    """
+    --compress deletes the raw output once the compressed copy checks out; write
+    it back from <split>.blocks.* before the split is modified. Each file goes
+    through a temp name and a shard index is written last, so an interrupted
+    restore is simply redone.
+    """
+    if raw_paths(out_dir, split_name) or not os.path.exists(block_paths(out_dir, split_name)[0]):
+        return
+    packed = BlockCompressedTokens(out_dir, split_name, cache_blocks=1)
+    if len(packed) != manifest["tokens"]:
+        raise RuntimeError(f"{split_name}: compressed copy does not match the manifest, rebuild with --fresh")
+    shard_tokens = manifest.get("shard_tokens", 0)
+    for path, lo, n in output_files(split_name, manifest["tokens"], shard_tokens, out_dir):
+        with open(path + ".tmp", "wb") as f:
+            for a in range(lo, lo + n, packed.seg_tokens):
+                f.write(packed[a:min(a + packed.seg_tokens, lo + n)].astype(DTYPE).tobytes())
+        os.replace(path + ".tmp", path)
+    if shard_tokens:
+        write_shard_index(out_dir, split_name, manifest["tokens"], shard_tokens, DTYPE.name)
+    print(f"[INFO] {split_name}: restored the raw tokens from the compressed copy")
+
+def plan_key(file_list, encoder, eot, shard_tokens):
+    """Fingerprint of everything that determines the output bytes."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update("\n".join(file_list).encode("utf-8"))
+    h.update(encoder.fingerprint())
+    h.update(f"|{eot}|{CHUNK_SIZE}|{shard_tokens}|{DTYPE.name}".encode())
+    return h.hexdigest()
 
-        if buf:
-            np.array(buf, dtype=np.uint16).tofile(fout)
-            token_count += len(buf)
+def files_checksum(files, block=1 << 24):
+    """blake2b of the token stream, across shards in order."""
+    h = hashlib.blake2b(digest_size=16)
+    for path, _, _ in files:
+        with open(path, "rb") as f:
+            for b in iter(lambda: f.read(block), b""):
+                h.update(b)
+    return h.hexdigest()
 
-    return out_path, token_count
+def load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-def build_split(file_list, out_bin_path, split_name):
-    print(f"[INFO] Building {split_name} with {NUM_WORKERS} workers...")
+def save_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
 
-    chunks = [
-        (i, file_list[i:i + CHUNK_SIZE])
-        for i in range(0, len(file_list), CHUNK_SIZE)
-    ]
+def load_done_chunks(log_path):
+    done = {}
+    if os.path.exists(log_path):
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line after a crash
+                done[rec["chunk"]] = rec["blake2b"]
+    return done
 
-    results = []
-    total_tokens = 0
+def spill_dir_of(encoder, paths):
+    """Where phase 1 keeps encoded chunks for phase 2, None if the encoder counts without encoding."""
+    return paths["spill"] if encoder.spill_counts else None
 
-    with Pool(NUM_WORKERS) as pool:
-        for out_path, tok in pool.imap_unordered(encode_worker, enumerate([c[1] for c in chunks])):
-            results.append((out_path, tok))
-            total_tokens += tok
+def token_counts(pool, file_list, encoder, spill_dir, first_chunk=0):
+    """
+    Phase 1: exact per-file token counts, from the manifest where possible,
+    else counted by the workers. With a `spill_dir`, chunks with a file to count
+    are encoded whole and spilled there (one file per phase-2 chunk), so every
+    file is encoded once.
+    """
+    counts = encoder.known_counts(file_list)
+    todo = np.flatnonzero(counts < 0)
+    print(f"[INFO] Token counts: {len(file_list) - len(todo):,} from manifest, {len(todo):,} to count")
+    starts = np.unique(todo // CHUNK_SIZE * CHUNK_SIZE).tolist()
+    if spill_dir is not None:
+        os.makedirs(spill_dir, exist_ok=True)
+    jobs = [(file_list[i:i + CHUNK_SIZE],
+             spill_path(spill_dir, first_chunk + i // CHUNK_SIZE) if spill_dir is not None else None)
+            for i in starts]
+    for i, c in zip(starts, pool.imap(count_worker, jobs)):
+        counts[i:i + CHUNK_SIZE] = c
+    return counts
 
-    results.sort(key=lambda x: x[0])
+def write_chunks(pool, jobs, done, log_path):
+    """Run write_worker jobs, logging every finished chunk; fills `done` {chunk: digest}."""
+    with open(log_path, "a", encoding="utf-8") as log:
+        for chunk_id, digest in pool.imap_unordered(write_worker, jobs):
+            done[chunk_id] = digest
+            log.write(json.dumps({"chunk": chunk_id, "blake2b": digest}) + "\n")
+            log.flush()
 
-    print(f"[INFO] Concatenating {len(results)} parts → {out_bin_path}")
+def save_file_list(path, file_list, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for p in file_list:
+            f.write(p + "\n")
 
-    with open(out_bin_path, "wb") as fout:
-        for part_path, _ in results:
-            with open(part_path, "rb") as fin:
-                fout.write(fin.read())
+def replace_file_list(path, file_list):
+    save_file_list(path + ".tmp", file_list)
+    os.replace(path + ".tmp", path)
 
-    for part_path, _ in results:
-        os.remove(part_path)
+def replace_index(path, starts):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, starts)
+    os.replace(path + ".tmp", path)
+
+def resize_outputs(split_name, total_tokens, shard_tokens, out_dir=BASE_DIR):
+    """Allocate the output files for total_tokens and drop shards past the end."""
+    files = output_files(split_name, total_tokens, shard_tokens, out_dir)
+    allocate(files)
+    if shard_tokens:
+        s = len(files)
+        while os.path.exists(shard_path(out_dir, split_name, s)):
+            os.remove(shard_path(out_dir, split_name, s))
+            s += 1
+        write_shard_index(out_dir, split_name, total_tokens, shard_tokens, DTYPE.name)
+    return files
+
+def chunk_jobs(files, file_list, counts, offsets, eot, spill_dir, first_chunk=0, skip=()):
+    jobs = []
+    for c, i in enumerate(range(0, len(file_list), CHUNK_SIZE)):
+        if first_chunk + c in skip:
+            continue
+        j = min(i + CHUNK_SIZE, len(file_list))
+        start, stop = int(offsets[i]), int(offsets[j])
+        spill = spill_path(spill_dir, first_chunk + c) if spill_dir is not None else None
+        jobs.append((overlapping(files, start, stop), first_chunk + c, start,
+                     file_list[i:j], counts[i:j].tolist(), eot, spill))
+    return jobs
+
+def build_split(pool, file_list, split_name, list_path, encoder, eot=None, fresh=False, shard_tokens=0,
+                out_dir=BASE_DIR):
+    """
+    Two-phase, resumable build of one split.
+    Phase 1: exact per-file token counts (manifest, else a counting pass; for
+    encoders with spill_counts an encoding pass that spills its output to
+    <split>.spill/ for phase 2). Their
+    prefix sums are the document index: <split>.idx.npy holds the uint64 start of
+    every document (one per entry of file_list, in order; empty files keep their
+    entry). With `eot`, that token id closes every document.
+    Phase 2: the output (one .bin, or fixed-size shards when shard_tokens > 0) is
+    preallocated and workers write their chunks directly at their offsets, each
+    shard file independently; every finished chunk is appended to
+    <split>.chunks.jsonl. A rerun with the same plan skips phase 1 and every
+    logged chunk.
+    Returns (split manifest, whether anything was written).
+    """
+    paths = split_paths(split_name, out_dir)
+    key = plan_key(file_list, encoder, eot, shard_tokens)
+
+    manifest = load_json(paths["manifest"])
+    if manifest is not None and manifest.get("shuffling"):
+        print(f"[WARN] {split_name}: shuffle_abc_char.py was interrupted while replacing its files, "
+              f"rebuilding in list order (rerun the shuffle after)")
+        fresh = True
+    # shuffled_from: the plan of the list order, for a split shuffle_abc_char.py reordered
+    if not fresh and manifest is not None and key in (manifest["plan"], manifest.get("shuffled_from")):
+        print(f"[OK] {split_name} already built ({manifest['tokens']:,} tokens), skipping")
+        return manifest, False
+
+    plan = None if fresh else load_json(paths["plan"])
+    doc_eot = eot is not None
+    if plan is not None and plan["plan"] == key \
+            and files_allocated(output_files(split_name, plan["tokens"], shard_tokens, out_dir)):
+        starts = np.load(paths["idx"]).astype(np.int64)
+        offsets = np.append(starts, plan["tokens"])
+        counts = np.diff(offsets) - doc_eot
+        files = output_files(split_name, plan["tokens"], shard_tokens, out_dir)
+        done = load_done_chunks(paths["log"])
+        print(f"[INFO] Resuming {split_name}: {len(done):,} chunks already written")
+    else:
+        print(f"[INFO] Building {split_name} with {NUM_WORKERS} workers...")
+        remove_outputs(split_name, out_dir)
+
+        counts = token_counts(pool, file_list, encoder, spill_dir_of(encoder, paths))
+        offsets = np.concatenate(([0], np.cumsum(counts + doc_eot)))
+        total_tokens = int(offsets[-1])
+        files = resize_outputs(split_name, total_tokens, shard_tokens, out_dir)
+        print(f"[INFO] Preallocated {total_tokens:,} tokens in {len(files):,} file(s)")
+        np.save(paths["idx"], offsets[:-1].astype(np.uint64))
+        save_json(paths["plan"], {"plan": key, "tokens": total_tokens})
+        done = {}
+
+    jobs = chunk_jobs(files, file_list, counts, offsets, eot, spill_dir_of(encoder, paths), skip=done)
+    write_chunks(pool, jobs, done, paths["log"])
+    save_file_list(paths["files"], file_list)
+    shutil.rmtree(paths["spill"], ignore_errors=True)
+
+    total_tokens = int(offsets[-1])
+    manifest = {
+        "split": split_name,
+        "version": 1,
+        "file_list": list_path,
+        "plan": key,
+        "documents": len(file_list),
+        "tokens": total_tokens,
+        "dtype": DTYPE.name,
+        "eot_token": eot,
+        "chunk_size": CHUNK_SIZE,
+        "shard_tokens": shard_tokens,
+        "blake2b": files_checksum(files),
+        "chunk_blake2b": [done[c] for c in range(len(done))],
+    }
+    save_json(paths["manifest"], manifest)
+    os.remove(paths["plan"])
+    os.remove(paths["log"])
 
     print(f"[OK] {split_name} tokens: {total_tokens:,}")
-    return total_tokens
+    return manifest, True
 
+def append_split(pool, file_list, split_name, list_path, encoder, eot=None, shard_tokens=0, out_dir=BASE_DIR):
+    """
+    Incremental mode: encode only the files of `file_list` that are not in
+    <split>.files.txt yet and append them to the output, .idx.npy and files list.
+    Tokens already written are never rewritten (a sharded split grows its last
+    shard, then adds new ones). The manifest is the commit point: it is saved
+    last, and every run first cuts the output, .idx.npy and files list back to
+    the manifest, so whatever an interrupted append left behind is dropped and
+    the append is redone.
+    Returns (split manifest, whether anything was appended).
+    """
+    paths = split_paths(split_name, out_dir)
+    manifest = load_json(paths["manifest"])
+    if manifest is None:
+        print(f"[INFO] {split_name} has no finished build yet, building it in full")
+        return build_split(pool, file_list, split_name, list_path, encoder, eot, shard_tokens=shard_tokens,
+                           out_dir=out_dir)
+    if manifest.get("shuffling"):
+        return build_split(pool, file_list, split_name, list_path, encoder, eot, shard_tokens=shard_tokens,
+                           out_dir=out_dir) # warns and rebuilds
+    if manifest["eot_token"] != eot or manifest["dtype"] != DTYPE.name:
+        raise RuntimeError(f"{split_name}: EOT/dtype differ from the existing build, rebuild with --fresh")
+    shard_tokens = manifest.get("shard_tokens", 0)  # keep the existing layout
 
-if __name__ == "__main__":
-    train_files = load_file_list(TRAIN_LIST)
-    val_files   = load_file_list(VAL_LIST)
+    n_docs, base = manifest["documents"], manifest["tokens"]
+    old_files = load_file_list_raw(paths["files"])
+    starts = np.load(paths["idx"])
+    known = set(old_files[:n_docs])
+    new_files = [p for p in dict.fromkeys(file_list) if p not in known]
+    interrupted = len(old_files) != n_docs or len(starts) != n_docs
+    if new_files or interrupted:
+        restore_raw(split_name, manifest, out_dir)
+    if interrupted or (raw_paths(out_dir, split_name) and not files_allocated(
+            output_files(split_name, base, shard_tokens, out_dir))):
+        print(f"[WARN] {split_name}: dropping the rest of an interrupted append")
+        old_files, starts = old_files[:n_docs], starts[:n_docs]
+        resize_outputs(split_name, base, shard_tokens, out_dir)
+        replace_index(paths["idx"], starts)
+        replace_file_list(paths["files"], old_files)
+    if os.path.exists(paths["log"]):
+        os.remove(paths["log"])
+    shutil.rmtree(paths["spill"], ignore_errors=True)
+
+    if not new_files:
+        print(f"[OK] {split_name}: nothing new to append")
+        return manifest, False
+    print(f"[INFO] Appending {len(new_files):,} new files to {split_name}")
+    remove_blocks(split_name, out_dir)
 
-    n_train = build_split(train_files, OUT_TRAIN_BIN, "train")
-    n_val   = build_split(val_files, OUT_VAL_BIN, "val")
+    first_chunk = len(manifest["chunk_blake2b"])
+    counts = token_counts(pool, new_files, encoder, spill_dir_of(encoder, paths), first_chunk)
+    offsets = base + np.concatenate(([0], np.cumsum(counts + (eot is not None))))
+    total_tokens = int(offsets[-1])
+    files = resize_outputs(split_name, total_tokens, shard_tokens, out_dir)
+
+    done = {}
+    jobs = chunk_jobs(files, new_files, counts, offsets, eot, spill_dir_of(encoder, paths), first_chunk=first_chunk)
+    write_chunks(pool, jobs, done, paths["log"])
+    shutil.rmtree(paths["spill"], ignore_errors=True)
+
+    replace_index(paths["idx"], np.concatenate((starts, offsets[:-1].astype(np.uint64))))
+    all_files = old_files + new_files
+    replace_file_list(paths["files"], all_files)
+
+    if "shuffled_from" in manifest:
+        manifest["shuffled_from"] = plan_key(file_list, encoder, eot, shard_tokens)
+    manifest.update(
+        version=manifest.get("version", 1) + 1,
+        plan=plan_key(all_files, encoder, eot, shard_tokens),
+        documents=len(all_files),
+        tokens=total_tokens,
+        blake2b=files_checksum(files),
+        chunk_blake2b=manifest["chunk_blake2b"] + [done[first_chunk + c] for c in range(len(jobs))],
+    )
+    save_json(paths["manifest"], manifest)
+    os.remove(paths["log"])
+
+    print(f"[OK] {split_name} tokens: {base:,} -> {total_tokens:,}")
+    return manifest, True
+
+
+def build_dataset(encoder, stoi, itos, out_dir=BASE_DIR, desc="", extra_meta=None):
+    """
+    Command line entry shared by the prepare scripts: build every requested
+    split of `out_dir` with `encoder`, then write its meta.pkl (plus `extra_meta`).
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--splits", nargs="+", default=list(SPLIT_LISTS),
+                        help="which of the configured splits to build")
+    parser.add_argument("--extra", action="append", default=[], metavar="NAME=LIST",
+                        help="additional split from a file list, e.g. holdout=../../../data/holdout.txt")
+    parser.add_argument("--fresh", action="store_true", help="ignore checkpoints and rebuild")
+    parser.add_argument("--shard_tokens", type=int, default=SHARD_TOKENS,
+                        help="write <split>.NNNNNN.bin shards of this many tokens (0: one flat .bin)")
+    parser.add_argument("--eot", action=argparse.BooleanOptionalAction, default=ADD_EOT,
+                        help="end every tune with an end-of-tune token (part of the plan: toggling it rebuilds)")
+    parser.add_argument("--append", action="store_true",
+                        help="encode only files not in <split>.files.txt and append them to the bins")
+    parser.add_argument("--compress", nargs="?", const="default", default=None, metavar="CODEC",
+                        help="write a block-compressed copy of each split (zstd if installed, else zlib), "
+                             "check it and delete the raw bins so training reads it")
+    parser.add_argument("--keep_raw", action="store_true",
+                        help="with --compress, keep the raw bins (open_tokens() keeps reading them)")
+    parser.add_argument("--block_tokens", type=int, default=BLOCK_TOKENS,
+                        help="tokens per compressed block")
+    args = parser.parse_args()
+
+    split_lists = {name: SPLIT_LISTS[name] for name in args.splits}
+    for spec in args.extra:
+        name, list_path = spec.split("=", 1)
+        split_lists[name] = list_path
+
+    stoi, itos = dict(stoi), dict(itos)
+    vocab_size = len(itos)
+    eot = None
+    if args.eot:
+        eot = vocab_size
+        itos[eot] = EOT_TOKEN
+        stoi[EOT_TOKEN] = eot
+        vocab_size += 1
+
+    # dataset_version goes up whenever any split changes, so a resumed training
+    # run can tell that its data grew
+    out_meta = os.path.join(out_dir, "meta.pkl")
+    version = 0
+    if os.path.exists(out_meta):
+        with open(out_meta, "rb") as f:
+            old_meta = pickle.load(f)
+        if args.append and old_meta["stoi"] != stoi:
+            raise RuntimeError("vocab changed since the last build, appending would mix encodings; use --fresh")
+        version = old_meta.get("dataset_version", 0)
+
+    changed = False
+    init_worker(encoder, token_dtype(vocab_size))
+    print(f"[INFO] Token dtype: {DTYPE.name}")
+    with Pool(NUM_WORKERS, initializer=init_worker, initargs=(encoder, DTYPE.name)) as pool:
+        for name, list_path in split_lists.items():
+            if not os.path.exists(list_path):
+                print(f"[WARN] {name}: file list not found ({list_path}), skipping")
+                continue
+            if args.append:
+                _, c = append_split(pool, load_file_list(list_path), name, list_path, encoder, eot,
+                                   args.shard_tokens, out_dir)
+            else:
+                _, c = build_split(pool, load_file_list(list_path), name, list_path, encoder, eot, args.fresh,
+                                  args.shard_tokens, out_dir)
+            changed |= c
+
+    if args.compress:
+        codec = None if args.compress == "default" else args.compress
+        for name in split_lists:
+            if not os.path.exists(os.path.join(out_dir, f"{name}.manifest.json")):
+                continue
+            if not raw_paths(out_dir, name):
+                print(f"[OK] {name} already stored compressed only, skipping")
+                continue
+            raw, packed = compress_split(out_dir, name, args.block_tokens, codec, workers=NUM_WORKERS, dtype=DTYPE)
+            print(f"[INFO] {name}: compressed {raw:,} -> {packed:,} bytes ({raw / max(packed, 1):.2f}x)")
+            if not args.keep_raw:
+                drop_raw(out_dir, name, DTYPE)
+                print(f"[INFO] {name}: compressed copy verified, raw bins deleted (training reads {name}.blocks.bin)")
 
     meta = {
         "vocab_size": vocab_size,
         "itos": itos,
         "stoi": stoi,
-        "desc": "Character-level ABC music dataset (parallel, nanoGPT compatible)",
+        "eot_token": eot,
+        "dtype": DTYPE.name,  # storage dtype of the .bin files, read by token_data.open_tokens()
+        "dataset_version": version + 1 if changed or version == 0 else version,
+        "desc": desc,
+        **(extra_meta or {}),
     }
-    with open(OUT_META, "wb") as f:
+    with open(out_meta, "wb") as f:
         pickle.dump(meta, f)
+    print(f"[INFO] dataset_version = {meta['dataset_version']}")
+
+    print(f"[DONE] Saved {', '.join(split_lists)} (.bin, .idx.npy, .manifest.json) and meta.pkl")
+
+
+if __name__ == "__main__":
+    chars = load_vocab(VOCAB_PATH)
+    print(f"[INFO] Loaded char vocab, size = {len(chars)}")
+    stoi = {ch: i for i, ch in enumerate(chars)}
+    itos = {i: ch for i, ch in enumerate(chars)}
 
-    print("[DONE] Saved train.bin, val.bin, meta.pkl")
+    build_dataset(CharEncoder(stoi), stoi, itos, BASE_DIR,
+                  desc="Character-level ABC music dataset (parallel, nanoGPT compatible)")
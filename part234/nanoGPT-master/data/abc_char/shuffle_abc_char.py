@@ -0,0 +1,172 @@
+"""
+Out-of-core document shuffle of a built split (default: train), so sequential
+and chunked readers see well-mixed tunes instead of split-list order.
+Two streaming passes with bounded RAM:
+  scatter: read the split front to back in slabs of whole tunes and append each
+           tune to one of K bucket files, the bucket picked uniformly at random
+  gather:  load one bucket at a time, permute its tunes, append them to the output
+A random bucket per tune plus a random order inside each bucket is a uniform
+permutation of the tunes. K is picked so one bucket (and its permuted copy)
+fits in --mem_mb. The new .bin, .idx.npy, .files.txt and <split>.shuffle.npy
+(every tune's index in the order prepare wrote) are each written to a temp file
+and moved into place with os.replace. Before the first os.replace the manifest
+is saved with a `shuffling` marker, so a crash among the replaces leaves a split
+that prepare_abc_char.py rebuilds instead of trusting. The manifest is then
+rewritten for the new order (checksums, and the plan of the shuffled file list,
+so --append keeps working; `shuffled_from` keeps the list-order plan, so a plain
+prepare run does not undo the shuffle) and the meta.pkl dataset_version is bumped.
+Run from data/abc_char: python shuffle_abc_char.py [--split train] [--seed 0]
+"""
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import argparse
+import numpy as np
+
+from prepare_abc_char import (BASE_DIR, OUT_META, CHUNK_SIZE, CharEncoder, init_worker, plan_key, split_paths,
+                              load_json, save_json, load_file_list_raw, replace_file_list, replace_index, remove_blocks)
+from token_data import open_tokens, doc_starts, data_dtype
+
+MEM_MB = 1024
+SLAB_MB = 64
+
+def scatter(data, starts, bucket_of, n_buckets, tmp_dir, slab_tokens):
+    """Pass 1: stream the split once, appending every tune to its bucket file."""
+    bounds = np.append(starts, len(data))
+    outs = [open(os.path.join(tmp_dir, f"bucket.{b:05d}.bin"), "wb") for b in range(n_buckets)]
+    try:
+        i, n_docs = 0, len(starts)
+        while i < n_docs:
+            # whole tunes, about slab_tokens of them (at least one)
+            j = int(np.searchsorted(bounds, bounds[i] + slab_tokens, side="right")) - 1
+            j = min(max(j, i + 1), n_docs)
+            tokens = np.asarray(data[bounds[i]:bounds[j]])
+            lo = (bounds[i:j] - bounds[i]).tolist()
+            hi = (bounds[i + 1:j + 1] - bounds[i]).tolist()
+            for d, b in enumerate(bucket_of[i:j].tolist()):
+                outs[b].write(tokens[lo[d]:hi[d]])
+            i = j
+    finally:
+        for f in outs:
+            f.close()
+
+def gather(starts, n_tokens, bucket_of, n_buckets, tmp_dir, out_path, dtype, rng):
+    """Pass 2: permute each bucket in RAM and append it to the output. Returns (order, new starts, blake2b)."""
+    lens = np.diff(np.append(starts, n_tokens)).astype(np.int64)
+    order, new_starts = [], []
+    h = hashlib.blake2b(digest_size=16)
+    pos = 0
+    with open(out_path, "wb") as out:
+        for b in range(n_buckets):
+            path = os.path.join(tmp_dir, f"bucket.{b:05d}.bin")
+            tokens = np.fromfile(path, dtype=dtype)
+            os.remove(path)
+            docs = np.flatnonzero(bucket_of == b) # in the order they were appended
+            doc_lens = lens[docs]
+            offsets = np.concatenate(([0], np.cumsum(doc_lens)))
+            perm = rng.permutation(len(docs))
+            shuffled = np.empty_like(tokens)
+            at = 0
+            lo, hi = offsets[:-1].tolist(), offsets[1:].tolist()
+            for k in perm.tolist():
+                shuffled[at:at + hi[k] - lo[k]] = tokens[lo[k]:hi[k]]
+                at += hi[k] - lo[k]
+            out.write(shuffled)
+            h.update(shuffled)
+            order.append(docs[perm])
+            new_starts.append(pos + np.cumsum(doc_lens[perm]) - doc_lens[perm]) # empty buckets add none
+            pos += len(tokens)
+    return np.concatenate(order), np.concatenate(new_starts).astype(np.uint64), h.hexdigest()
+
+def chunk_digests(path, starts, n_tokens, dtype):
+    """blake2b of every CHUNK_SIZE-tune chunk of the output, as prepare_abc_char.py logs them."""
+    data = np.memmap(path, dtype=dtype, mode="r") if n_tokens else np.zeros(0, dtype=dtype)
+    bounds = np.append(starts, n_tokens).astype(np.int64)
+    return [hashlib.blake2b(np.asarray(data[bounds[i]:bounds[min(i + CHUNK_SIZE, len(starts))]]).tobytes(),
+                            digest_size=16).hexdigest()
+            for i in range(0, len(starts), CHUNK_SIZE)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mem_mb", type=float, default=MEM_MB, help="RAM budget for one bucket and its permuted copy")
+    parser.add_argument("--slab_mb", type=int, default=SLAB_MB, help="sequential read size of the scatter pass")
+    parser.add_argument("--tmp_dir", type=str, default=os.path.join(BASE_DIR, "shuffle_tmp"))
+    args = parser.parse_args()
+
+    paths = split_paths(args.split)
+    manifest = load_json(paths["manifest"])
+    if manifest is None or manifest.get("shard_tokens", 0) or not os.path.exists(paths["files"]):
+        raise FileNotFoundError(f"{args.split}: no finished flat build with a .files.txt "
+                                f"(the shuffle rewrites <split>.bin), run prepare_abc_char.py")
+    if manifest.get("shuffling"):
+        raise RuntimeError(f"{args.split}: an earlier shuffle was interrupted while replacing its files, "
+                           f"run prepare_abc_char.py to rebuild the split first")
+    dtype = data_dtype(BASE_DIR)
+    data = open_tokens(BASE_DIR, args.split, dtype=dtype)
+    starts = np.asarray(doc_starts(BASE_DIR, args.split), dtype=np.int64)
+    n_docs, n_tokens = len(starts), len(data)
+
+    # expected bucket ~ mem/4, so a bucket plus its permuted copy stays under budget with room to spare
+    n_buckets = max(1, -(-n_tokens * dtype.itemsize * 4 // int(args.mem_mb * 2**20)))
+    print(f"[INFO] {args.split}: {n_docs:,} tunes, {n_tokens:,} tokens -> {n_buckets} buckets")
+
+    rng = np.random.default_rng(args.seed)
+    bucket_of = rng.integers(0, n_buckets, size=n_docs)
+    os.makedirs(args.tmp_dir, exist_ok=True)
+
+    t0 = time.time()
+    scatter(data, starts, bucket_of, n_buckets, args.tmp_dir, (args.slab_mb << 20) // dtype.itemsize)
+    t1 = time.time()
+    out_tmp = paths["bin"] + ".shuffle.tmp"
+    order, new_starts, digest = gather(starts, n_tokens, bucket_of, n_buckets, args.tmp_dir, out_tmp, dtype, rng)
+    t2 = time.time()
+    shutil.rmtree(args.tmp_dir, ignore_errors=True)
+    del data
+
+    # the new order of every per-tune file and the manifest entries that depend on it
+    files = load_file_list_raw(paths["files"])
+    files = [files[k] for k in order.tolist()]
+    if os.path.exists(paths["shuffle"]): # shuffled before: keep mapping to the order prepare wrote
+        prior = np.load(paths["shuffle"]).astype(np.int64)
+        prior = np.append(prior, np.arange(len(prior), n_docs)) # tunes --append added since
+        order = prior[order]
+    with open(OUT_META, "rb") as f:
+        meta = pickle.load(f)
+    replacing = dict(manifest, shuffling=True) # the split is neither order until the new manifest is saved
+    eot = manifest["eot_token"]
+    encoder = CharEncoder({ch: i for ch, i in meta["stoi"].items() if i != eot})
+    init_worker(encoder, dtype)
+    manifest.update(
+        version=manifest.get("version", 1) + 1,
+        plan=plan_key(files, encoder, eot, 0), # the build of the shuffled list: --append extends it
+        shuffled_from=manifest.get("shuffled_from", manifest["plan"]), # a rerun with the list order keeps this
+        blake2b=digest,
+        chunk_blake2b=chunk_digests(out_tmp, new_starts, n_tokens, dtype),
+        shuffle_seed=args.seed,
+    )
+    meta["dataset_version"] = meta.get("dataset_version", 0) + 1
+
+    # each file through a temp name and os.replace, between the marked manifest and
+    # the new one (then meta.pkl)
+    with open(paths["shuffle"] + ".tmp", "wb") as f:
+        np.save(f, order.astype(np.uint64))
+    save_json(paths["manifest"], replacing)
+    replace_index(paths["idx"], new_starts)
+    replace_file_list(paths["files"], files)
+    os.replace(out_tmp, paths["bin"])
+    os.replace(paths["shuffle"] + ".tmp", paths["shuffle"])
+    save_json(paths["manifest"], manifest)
+    with open(OUT_META + ".tmp", "wb") as f:
+        pickle.dump(meta, f)
+    os.replace(OUT_META + ".tmp", OUT_META)
+    if os.path.exists(os.path.join(BASE_DIR, args.split + ".blocks.json")):
+        remove_blocks(args.split)
+        print(f"[WARN] removed {args.split}.blocks.* (old order), rerun prepare_abc_char.py --compress")
+
+    mb = n_tokens * dtype.itemsize / 1e6
+    print(f"[INFO] scatter {mb / (t1 - t0):.0f} MB/s, gather {mb / (t2 - t1):.0f} MB/s")
+    print(f"[DONE] {args.split}.bin shuffled ({n_docs:,} tunes, seed {args.seed})")
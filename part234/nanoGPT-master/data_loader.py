@@ -0,0 +1,623 @@
+"""
+Batch assembly for train.py (and friends) on top of token_data.open_tokens().
+TokenBatcher builds batches on the calling thread; PrefetchLoader wraps one and
+builds them in a background thread. Both are called as loader() -> (x, y) and
+count the time the caller spent waiting for data (pop_data_wait()).
+Window starts are i.i.d. random, come from an EpochSampler (exact epochs),
+from ChunkWindows (sequential chunk reads for splits larger than RAM), or
+from a LaneSampler (contiguous lanes for stateful RNN training);
+with a DocPacker, rows are packed with whole tunes instead and the loader also
+returns per-token tune ids for GPT's block-diagonal attention mask. A
+Transposer shifts every window into a random key on the way.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+from token_data import open_tokens
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+class EpochSampler:
+    """
+    Exact epochs over the non-overlapping blocks [b*T, b*T + T] of a split:
+    each epoch visits every block once, in a pseudo-random order that is a
+    Feistel permutation keyed by (seed, epoch), so no index array is ever
+    materialized (O(1) memory for billions of tokens). Position p of the epoch
+    order belongs to DDP rank p % world_size; every rank gets n_blocks // world_size
+    blocks per epoch, the remainder is dropped. state_dict() (seed, epoch, cursor)
+    goes into ckpt.pt, so a resumed run continues the same epoch where it stopped.
+    """
+
+    def __init__(self, n_tokens, block_size, seed=1337, rank=0, world_size=1, rounds=4):
+        self.block_size = block_size
+        self.n_blocks = (n_tokens - 1) // block_size
+        self.rank, self.world_size = rank, world_size
+        self.per_rank = self.n_blocks // world_size
+        assert self.per_rank > 0, "split too small for one block per rank"
+        bits = max(2, (self.n_blocks - 1).bit_length())
+        self.half = (bits + 1) // 2 # permute on [0, 4**half) and cycle-walk down to [0, n_blocks)
+        self.mask = np.uint64((1 << self.half) - 1)
+        self.rounds = rounds
+        self.seed, self.epoch, self.cursor = seed, 0, 0
+        self._set_keys()
+
+    def _set_keys(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.keys = rng.integers(0, 2**63, size=self.rounds, dtype=np.uint64)
+
+    def _feistel(self, x):
+        h = np.uint64(self.half)
+        left, right = x >> h, x & self.mask
+        for key in self.keys:
+            f = (right ^ key) * _MIX
+            f ^= f >> np.uint64(31)
+            left, right = right, left ^ (f & self.mask)
+        return (left << h) | right
+
+    def permute(self, pos):
+        """Block ids at epoch positions `pos` (a bijection of [0, n_blocks))."""
+        x = self._feistel(pos.astype(np.uint64))
+        out = x >= self.n_blocks
+        while out.any(): # cycle walking: at most ~4 rounds expected
+            x[out] = self._feistel(x[out])
+            out = x >= self.n_blocks
+        return x.astype(np.int64)
+
+    def next(self, count):
+        """Start offsets of the next `count` blocks of this rank, rolling over epochs."""
+        parts = []
+        while count:
+            take = min(count, self.per_rank - self.cursor)
+            pos = (self.cursor + np.arange(take, dtype=np.int64)) * self.world_size + self.rank
+            parts.append(self.permute(pos) * self.block_size)
+            self.cursor += take
+            count -= take
+            if self.cursor == self.per_rank:
+                self.epoch, self.cursor = self.epoch + 1, 0
+                self._set_keys()
+        return np.concatenate(parts)
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "cursor": self.cursor,
+                "n_blocks": self.n_blocks, "world_size": self.world_size}
+
+    def load_state_dict(self, state):
+        self.seed, self.epoch, self.cursor = state["seed"], state["epoch"], state["cursor"]
+        if state["n_blocks"] != self.n_blocks or state["world_size"] != self.world_size:
+            # a different split size / world size is a different permutation: start the next epoch
+            print(f"sampler: {state['n_blocks']} blocks x {state['world_size']} ranks -> "
+                  f"{self.n_blocks} x {self.world_size}, starting epoch {self.epoch + 1}")
+            self.epoch, self.cursor = self.epoch + 1, 0
+        self._set_keys()
+
+class ChunkWindows:
+    """
+    Window sampling for splits that do not fit in the page cache: the split is
+    read as large contiguous chunks, in an EpochSampler order over chunks
+    (shuffled, sharded across ranks), and windows are drawn uniformly from a
+    rolling buffer of `depth` resident chunks. Each chunk is read once, with one
+    sequential read (plus T tokens of overlap so every start in it has a full
+    window), and the next one is read ahead on a helper thread. After the
+    buffer has served chunk_tokens // T windows the oldest chunk is swapped
+    for the read-ahead one, so on average every token is seen about once per
+    epoch while batches mix windows from `depth` far-apart places.
+    state_dict() is the chunk order position of the oldest resident chunk;
+    a resumed run rebuilds the buffer from there.
+    """
+
+    def __init__(self, n_tokens, block_size, chunk_tokens, depth=8, seed=1337, rank=0, world_size=1):
+        self.block_size = block_size
+        self.n_starts = n_tokens - block_size - 1 # valid window starts: [0, n_starts]
+        self.chunk_tokens = chunk_tokens
+        n_chunks = -(-(self.n_starts + 1) // chunk_tokens)
+        self.order = EpochSampler(n_chunks + 1, 1, seed=seed, rank=rank, world_size=world_size)
+        self.depth = min(depth, self.order.per_rank)
+        self.quota = max(1, chunk_tokens // block_size)
+        self.rng = np.random.default_rng([seed, rank])
+        self.resident, self.served = [], 0
+        self.states = [] # order state before each resident chunk was drawn
+        self._reader = ThreadPoolExecutor(1)
+        self._next = None
+
+    def _read(self, data, chunk):
+        lo = chunk * self.chunk_tokens
+        hi = min(lo + self.chunk_tokens, self.n_starts + 1) + self.block_size + 1
+        return np.array(data[lo:hi]) # one sequential read, resident from here on
+
+    def _draw(self, data):
+        state = self.order.state_dict()
+        chunk = int(self.order.next(1)[0])
+        return state, self._reader.submit(self._read, data, chunk)
+
+    def fill(self, data, tokens):
+        if not self.resident:
+            for _ in range(self.depth):
+                state, future = self._draw(data)
+                self.states.append(state)
+                self.resident.append(future.result())
+            self._next = self._draw(data)
+        elif self.served >= self.quota:
+            # retire the oldest chunk for the read-ahead one, start reading the next
+            self.served = 0
+            state, future = self._next
+            self.states = self.states[1:] + [state]
+            self.resident = self.resident[1:] + [future.result()]
+            self._next = self._draw(data)
+        counts = np.array([len(c) - self.block_size for c in self.resident], dtype=np.int64)
+        which = self.rng.choice(len(counts), size=len(tokens), p=counts / counts.sum())
+        starts = (self.rng.random(len(tokens)) * counts[which]).astype(np.int64)
+        window = np.arange(tokens.shape[1]) # T+1, or more with a Transposer's lookahead (clipped at the end)
+        for j, chunk in enumerate(self.resident):
+            rows = np.flatnonzero(which == j)
+            if len(rows):
+                tokens[rows] = np.take(chunk, starts[rows, None] + window, mode="clip")
+        self.served += len(tokens)
+
+    def state_dict(self):
+        return {"chunks": self.states[0] if self.states else self.order.state_dict()}
+
+    def load_state_dict(self, state):
+        self.order.load_state_dict(state["chunks"])
+
+class LaneSampler:
+    """
+    Window starts for stateful (truncated-BPTT) training: the split is cut into
+    batch_size * world_size contiguous lanes, row b of every batch of this rank
+    is lane rank * batch_size + b, and each batch continues every lane T tokens
+    after the last one, so the model can carry its hidden state from batch to
+    batch. An epoch is `steps` batches (every token once); the carried state
+    should be reset whenever a new epoch starts. Each lane is read
+    sequentially, which also keeps the reads local.
+    """
+
+    def __init__(self, n_tokens, block_size, batch_size, rank=0, world_size=1):
+        self.block_size, self.batch_size, self.world_size = block_size, batch_size, world_size
+        self.lane_tokens = n_tokens // (batch_size * world_size)
+        self.steps = (self.lane_tokens - 1) // block_size
+        assert self.steps > 0, "split too small for one segment per lane"
+        self.lanes = (rank * batch_size + np.arange(batch_size, dtype=np.int64)) * self.lane_tokens
+        self.epoch, self.step = 0, 0
+
+    def next(self, count):
+        """Start offsets of the next segment of every lane (count must be batch_size)."""
+        assert count == self.batch_size, "one batch is one segment of every lane"
+        ix = self.lanes + self.step * self.block_size
+        self.step += 1
+        if self.step == self.steps:
+            self.epoch, self.step = self.epoch + 1, 0
+        return ix
+
+    def state_dict(self):
+        return {"epoch": self.epoch, "step": self.step, "lane_tokens": self.lane_tokens,
+                "world_size": self.world_size}
+
+    def load_state_dict(self, state):
+        self.epoch, self.step = state["epoch"], state["step"]
+        if state["lane_tokens"] != self.lane_tokens or state["world_size"] != self.world_size:
+            print(f"lanes: {state['lane_tokens']} tokens x {state['world_size']} ranks -> "
+                  f"{self.lane_tokens} x {self.world_size}, starting epoch {self.epoch + 1}")
+            self.epoch, self.step = self.epoch + 1, 0
+
+class DocPacker:
+    """
+    Packs (B, T+1) rows with tunes taken in EpochSampler order over the split's
+    tunes (<split>.idx.npy). A tune longer than the space left in a row is cut;
+    its rest starts the next row as a new chunk. fill() also marks where every
+    tune / chunk starts, from which the loader derives tune ids and masks the
+    targets that would cross into the next tune. Chunks of a cut tune overlap
+    by one token, so no target inside a tune is lost.
+    """
+
+    def __init__(self, starts, n_tokens, seed=1337, rank=0, world_size=1):
+        self.bounds = np.append(np.asarray(starts, dtype=np.int64), n_tokens)
+        self.docs = EpochSampler(len(self.bounds), 1, seed=seed, rank=rank, world_size=world_size)
+        self.doc, self.pos = -1, 0 # current tune and how much of it is used up
+
+    def fill(self, data, tokens, flags):
+        flags[:] = 0
+        rows, width = tokens.shape
+        for row in range(rows):
+            col = 0
+            while col < width:
+                if self.doc < 0:
+                    self.doc, self.pos = int(self.docs.next(1)[0]), 0
+                lo = self.bounds[self.doc] + self.pos
+                hi = self.bounds[self.doc + 1]
+                take = min(hi - lo, width - col)
+                if take > 0:
+                    tokens[row, col:col + take] = data[lo:lo + take]
+                    flags[row, col] = 1
+                    col += take
+                    self.pos += take
+                if lo + take >= hi:
+                    self.doc = -1
+                elif take > 0:
+                    # cut: the row's last token is only a target there, so the next chunk starts on it
+                    self.pos -= 1
+
+    def state_dict(self):
+        return {"docs": self.docs.state_dict(), "doc": int(self.doc), "pos": int(self.pos)}
+
+    def load_state_dict(self, state):
+        self.docs.load_state_dict(state["docs"])
+        self.doc, self.pos = state["doc"], state["pos"]
+
+class Transposer:
+    """
+    Random key transposition of abc_char windows, done on the token ids of the
+    whole batch at once, so the corpus is stored in one key only.
+    Every row gets its own k in [-max_semitones, max_semitones] semitones:
+    note letters move by d = round(7k/12) letter steps (case and ' / , octave
+    marks re-spelled), explicit accidentals (^ _ =, doubled too) get the
+    letter's correction k - (natural interval of the step), and the root of a
+    K: field is re-spelled the same way. Unmarked notes keep following the
+    transposed key signature and bar accidentals keep carrying, so the result
+    is exact without knowing the key of the window.
+    All rules are lookup tables indexed by token id: every token gets a code
+    (itself, dropped, or a re-spelled note / accidental / root) and the codes
+    expand to the output in one pass. A note can gain or lose a token (octave
+    marks, double accidentals), so rows come in `lookahead` tokens longer and
+    are cropped back. Only lines with a bar line that are not header fields or
+    comments are touched, and not quoted text, !decorations! or inline
+    [X:...] fields. A row that cannot be spelled in the vocab stays as it is.
+    """
+
+    LETTERS = "CDEFGAB"
+    NATURAL = np.array([0, 2, 4, 5, 7, 9, 11])
+    MAX_MARKS = 4
+    PAD = MAX_MARKS + 1 # -1 tokens between rows, so looking around never crosses into the next row
+
+    def __init__(self, stoi, max_semitones, seed=1337, rank=0, lookahead=64):
+        self.max_semitones, self.lookahead = max_semitones, lookahead
+        self.rng = np.random.default_rng([seed, rank])
+        self.ids = {c: i for c, i in stoi.items() if len(c) == 1}
+        vocab = max(stoi.values()) + 1
+        tok = lambda c: self.ids.get(c, -2)
+
+        def table(values, default=0, dtype=np.int32):
+            # one entry per token id, plus a last one for -1 (row padding): no class
+            t = np.full(vocab + 1, default, dtype=dtype)
+            for c, v in values.items():
+                if c in self.ids:
+                    t[self.ids[c]] = v
+            return t
+        lower = {c.lower(): i for i, c in enumerate(self.LETTERS)}
+        self.letter = table({**{c: i for i, c in enumerate(self.LETTERS)}, **lower}, -1)
+        self.upper = table({c: True for c in self.LETTERS}, False, bool)
+        self.octave = table({**{c: 4 for c in self.LETTERS}, **{c: 5 for c in lower}})
+        self.is_acc = table({"^": True, "_": True, "=": True}, False, bool)
+        self.acc = table({"^": 1, "_": -1, "=": 0})
+        self.is_mark = table({"'": True, ",": True}, False, bool)
+        self.mark = table({"'": 1, ",": -1})
+        self.alpha = table({c: True for c in self.ids if c.isascii() and c.isalpha()}, False, bool)
+        self.nl, self.bar, self.colon, self.key = tok("\n"), tok("|"), tok(":"), tok("K")
+        self.pct, self.lbr, self.rbr, self.space = tok("%"), tok("["), tok("]"), tok(" ")
+        self.sharp, self.flat = tok("#"), tok("b")
+        self.paired = [tok(c) for c in '"!' if c in self.ids] # quoted text and !decorations!
+
+        # output codes: 0..vocab-1 emit themselves, then drop, notes (letter, octave 0..9),
+        # accidentals (-2..2) and key roots (letter, -1..1); each expands to a short token string
+        spellings = [[i] for i in range(vocab)] + [[]]
+        self.drop = vocab
+        self.note_code = len(spellings)
+        spellings += [c + "," * (4 - o) if o < 5 else c.lower() + "'" * (o - 5) for c in self.LETTERS for o in range(10)]
+        self.acc_code = len(spellings)
+        spellings += ["__", "_", "=", "^", "^^"]
+        self.root_code = len(spellings)
+        spellings += [c + s for c in self.LETTERS for s in ("b", "", "#")]
+        spellings = [[self.ids.get(c, -1) for c in s] if isinstance(s, str) else s for s in spellings]
+        self.spellable = np.array([min(s, default=0) >= 0 for s in spellings] + [True]) # last: code -1
+        self.code_len = np.array([len(s) for s in spellings] + [0])
+        self.code_start = np.concatenate(([0], np.cumsum(self.code_len[:-1])))
+        self.code_tokens = np.array([i for s in spellings for i in s], dtype=np.int64)
+        # per k: letter step d, and for each letter the new letter, octave carry and accidental correction
+        ks = np.arange(-max_semitones, max_semitones + 1)
+        d = np.floor(ks * 7 / 12 + 0.5).astype(np.int64)
+        moved = np.arange(7)[None, :] + d[:, None]
+        self.new_letter, self.carry = moved % 7, moved // 7
+        self.delta = ks[:, None] - (self.NATURAL[moved % 7] + 12 * (moved // 7) - self.NATURAL[None, :])
+
+    def _eligible(self, x):
+        """Tokens that belong to the music: lines with a bar line, minus fields, comments, quotes, inline fields."""
+        pos = np.arange(len(x))
+        brk = (x == self.nl) | (x == -1)
+        line = np.cumsum(brk) # a line break belongs to the line it ends
+        line_ok = np.bincount(line[x == self.bar], minlength=line[-1] + 2) > 0
+        # lines whose start is in the row: X:... fields and %comments are skipped
+        starts = np.flatnonzero(x[:-2] == self.nl) + 1
+        first, second = x[starts], x[starts + 1]
+        line_ok[line[starts[(self.alpha[first] & (second == self.colon)) | (first == self.pct)]]] = False
+        ok = line_ok[line]
+        if (x == self.pct).any() or any((x == c).any() for c in self.paired):
+            line_start = np.maximum.accumulate(np.where(brk, pos + 1, 0)).clip(max=len(x) - 1)
+            ok &= np.maximum.accumulate(np.where(x == self.pct, pos, -1)) < line_start
+            for c in self.paired:
+                count = np.cumsum(x == c)
+                ok &= (count - count[line_start - 1]) % 2 == 0
+        opens = np.flatnonzero(x[:-2] == self.lbr)
+        opens = opens[self.alpha[x[opens + 1]] & (x[opens + 2] == self.colon)]
+        if len(opens):
+            last_open = np.maximum.accumulate(np.where(np.isin(pos, opens), pos, -1))
+            ok &= last_open <= np.maximum.accumulate(np.where(x == self.rbr, pos, -1))
+        return ok
+
+    def __call__(self, tokens, out):
+        """Transpose the (B, T+1+lookahead) `tokens` rows into the (B, T+1) `out`."""
+        B, L = tokens.shape
+        width, P = out.shape[1], self.PAD
+        k = self.rng.integers(-self.max_semitones, self.max_semitones + 1, size=B)
+        # one flat array with P padding tokens before every row and after the last one,
+        # so looking a few tokens around never leaves the array or crosses rows
+        x = np.full((B + 1, P + L), -1, dtype=np.int32)
+        x[:B, P:] = tokens
+        x = x.reshape(-1)[:B * (P + L) + P]
+        ok = self._eligible(x)
+        code = x.copy() # padding has code -1: nothing
+        bad = np.zeros(B, dtype=bool)
+
+        # notes: [accidental [accidental]] letter [marks]
+        ni = np.flatnonzero((self.letter[x] >= 0) & ok)
+        row = ni // (P + L)
+        kn = k[row] + self.max_semitones
+        letter = self.letter[x[ni]]
+        acc1 = self.is_acc[x[ni - 1]] & ok[ni - 1]
+        acc2 = acc1 & self.is_acc[x[ni - 2]] & ok[ni - 2]
+        octave = self.octave[x[ni]] + self.carry[kn, letter]
+        run = np.ones(len(ni), dtype=bool)
+        for m in range(1, self.MAX_MARKS + 2):
+            ahead = x[ni + m]
+            run &= self.is_mark[ahead] & ok[ni + m]
+            if m > self.MAX_MARKS:
+                bad[row[run]] = True
+                break
+            octave += run * self.mark[ahead]
+            code[ni[run] + m] = self.drop # the marks are re-spelled with their letter
+        bad[row[(octave < 0) | (octave > 9)]] = True
+        code[ni] = self.note_code + self.new_letter[kn, letter] * 10 + octave.clip(0, 9)
+        acc = self.acc[x[ni - 1]] * acc1 + self.acc[x[ni - 2]] * acc2 + self.delta[kn, letter]
+        bad[row[acc1 & (np.abs(acc) > 2)]] = True
+        # the accidental is re-spelled on its first token, a second one (^^, __) is dropped
+        code[np.where(acc2, ni - 2, ni - 1)[acc1]] = self.acc_code + acc[acc1].clip(-2, 2) + 2
+        code[ni[acc2] - 1] = self.drop
+
+        # K: roots (field line or inline [K:...]), with an optional space and a # / b after them
+        ki = np.flatnonzero(x[:-3] == self.key)
+        ki = ki[np.isin(x[ki - 1], (self.nl, self.lbr, -1)) & (x[ki + 1] == self.colon)]
+        ri = np.where(x[ki + 2] == self.space, ki + 3, ki + 2)
+        ri = ri[self.upper[x[ri]]]
+        if len(ri):
+            row = ri // (P + L)
+            kn = k[row] + self.max_semitones
+            letter = self.letter[x[ri]]
+            root_acc = (x[ri + 1] == self.sharp).astype(np.int64) - (x[ri + 1] == self.flat)
+            racc = root_acc + self.delta[kn, letter]
+            bad[row[np.abs(racc) > 1]] = True # no K:Bbb / K:E##
+            code[ri] = self.root_code + self.new_letter[kn, letter] * 3 + racc.clip(-1, 1) + 1
+            code[ri[root_acc != 0] + 1] = self.drop
+
+        # expand the codes, crop every row to `width`
+        lens = self.code_len[code]
+        row_lens = lens[:B * (P + L)].reshape(B, -1).sum(axis=1)
+        unspellable = np.flatnonzero(~self.spellable[code]) // (P + L)
+        bad[unspellable[unspellable < B]] = True
+        bad |= (row_lens < width) | (k == 0)
+        good = np.flatnonzero(~bad)
+        out[bad] = tokens[bad, :width]
+        if len(good):
+            ends = np.cumsum(lens)
+            first = np.repeat(self.code_start[code] - (ends - lens), lens) # emitted token j: code_tokens[first + j]
+            flat = self.code_tokens[first + np.arange(ends[-1])]
+            row_starts = np.cumsum(row_lens) - row_lens
+            out[good] = flat[row_starts[good, None] + np.arange(width)]
+
+class TokenBatcher:
+    """
+    Random (x, y) windows from one split.
+    - the split is opened once and re-opened every `reopen_every` batches: that
+      drops the pages the old memmap kept resident (the memory growth that made
+      nanoGPT re-create the memmap per batch) and picks up bins grown by --append
+    - all windows are gathered at once as one (B, T+1) index take; x and y are
+      the [:, :-1] / [:, 1:] views of the same tensor
+    - tokens cross to the device in the narrowest safe dtype (uint8, else int32)
+      and are widened to int64 there
+    sample() fills one of `n_buffers` (pinned on CUDA) host buffers in turn and
+    to_device() ships it; pass `seed` for a private RNG (needed when sample()
+    runs on another thread), else the global torch RNG is used. With a
+    `sampler` (EpochSampler, LaneSampler) the window starts come from it instead, and
+    state_dict() is its state as of the last batch handed to the caller; a
+    ChunkWindows sampler fills the rows itself from its resident chunks. With a
+    `packer` (DocPacker) rows are packed tunes and batches are (x, y, segments):
+    y is -1 (ignored by the loss) where the next token starts another tune.
+    With a `transposer` (Transposer) windows are read `lookahead` tokens longer
+    and transposed into the (B, T+1) rows.
+    """
+
+    def __init__(self, data_dir, split, block_size, batch_size, device, dtype=None, reopen_every=1000,
+                 n_buffers=2, seed=None, sampler=None, packer=None, transposer=None):
+        assert packer is None or transposer is None, "packed rows cannot be transposed"
+        self.data_dir, self.split, self.dtype = data_dir, split, dtype
+        self.block_size, self.batch_size = block_size, batch_size
+        self.device = torch.device(device)
+        self.reopen_every = reopen_every
+        self.transposer = transposer
+        width = block_size + 1 + (transposer.lookahead if transposer is not None else 0)
+        self.window = np.arange(width, dtype=np.int64)
+        self._open()
+        shape = (batch_size, block_size + 1)
+        self.stage = np.empty(shape, dtype=self.data.dtype)
+        self.raw = self.stage if transposer is None else np.empty((batch_size, width), dtype=self.data.dtype)
+        send = np.uint8 if self.data.dtype == np.uint8 else np.int32
+        pin = self.device.type == "cuda"
+        # several host buffers, so the next batch can be gathered while the last one is still copying
+        self.host = [torch.from_numpy(np.empty(shape, dtype=send)) for _ in range(n_buffers)]
+        if pin:
+            self.host = [h.pin_memory() for h in self.host]
+        self.copied = [None] * n_buffers # cuda event of the last copy out of each host buffer
+        self.step = 0
+        self.generator = None if seed is None else torch.Generator().manual_seed(seed)
+        self.sampler, self.packer = sampler, packer
+        self.sampler_state = (sampler or packer).state_dict() if (sampler or packer) else None
+        self.flags = None
+        if packer is not None:
+            self.flags = [torch.from_numpy(np.zeros(shape, dtype=np.uint8)) for _ in range(n_buffers)]
+            if pin:
+                self.flags = [f.pin_memory() for f in self.flags]
+        self.data_wait = 0.0
+
+    def _open(self):
+        self.data = open_tokens(self.data_dir, self.split, dtype=self.dtype)
+        self.flat = isinstance(self.data, np.ndarray)
+        self.served = 0
+
+    def gather(self, ix):
+        """(B, T+1) tokens (plus the transposer's lookahead) starting at each ix, in the storage dtype."""
+        if self.flat:
+            # only the lookahead can run past the end of the split; it repeats the last token there
+            np.take(self.data, ix[:, None] + self.window, out=self.raw, mode="clip")
+        else:
+            # sharded / compressed readers only slice; one slice per row
+            for row, i in enumerate(ix.tolist()):
+                part = self.data[i:i + len(self.window)]
+                self.raw[row, :len(part)] = part
+                self.raw[row, len(part):] = part[-1]
+        return self.raw
+
+    def sample(self):
+        """Next batch as a (B, T+1) host tensor; returns (buffer slot, tensor, tune start flags, sampler state)."""
+        if self.served >= self.reopen_every:
+            self._open()
+        self.served += 1
+        k = self.step % len(self.host)
+        self.step += 1
+        if self.copied[k] is not None:
+            self.copied[k].synchronize()
+        host = self.host[k]
+        if self.packer is not None:
+            flags = self.flags[k]
+            self.packer.fill(self.data, self.stage, flags.numpy())
+            np.copyto(host.numpy(), self.stage, casting="safe")
+            return k, host, flags, self.packer.state_dict()
+        state = None
+        if isinstance(self.sampler, ChunkWindows):
+            self.sampler.fill(self.data, self.raw)
+            state = self.sampler.state_dict()
+        else:
+            if self.sampler is not None:
+                ix = self.sampler.next(self.batch_size)
+                state = self.sampler.state_dict()
+            else:
+                ix = torch.randint(len(self.data) - self.block_size, (self.batch_size,),
+                                   generator=self.generator).numpy()
+            self.gather(ix)
+        if self.transposer is not None:
+            self.transposer(self.raw, self.stage)
+        np.copyto(host.numpy(), self.stage, casting="safe")
+        return k, host, None, state
+
+    def to_device(self, batch):
+        k, host, flags, state = batch
+        if state is not None:
+            self.sampler_state = state
+        if self.device.type == "cuda":
+            xy = host.to(self.device, non_blocking=True)
+            if flags is not None:
+                flags = flags.to(self.device, non_blocking=True)
+            self.copied[k] = torch.cuda.Event()
+            self.copied[k].record()
+            xy = xy.long()
+        else:
+            xy = host.to(self.device, dtype=torch.int64, copy=True)
+            if flags is not None:
+                flags = flags.clone()
+        if flags is None:
+            return xy[:, :-1], xy[:, 1:]
+        starts = flags.bool()
+        segments = torch.cumsum(flags, dim=1, dtype=torch.int32)[:, :-1]
+        y = xy[:, 1:].masked_fill(starts[:, 1:], -1)
+        return xy[:, :-1], y, segments
+
+    def pop_data_wait(self):
+        """Seconds spent waiting for data since the last call."""
+        wait, self.data_wait = self.data_wait, 0.0
+        return wait
+
+    def __call__(self):
+        t0 = time.perf_counter()
+        batch = self.sample()
+        self.data_wait += time.perf_counter() - t0
+        return self.to_device(batch)
+
+    def state_dict(self):
+        """Sampler position after the last batch returned (None for random windows)."""
+        return self.sampler_state
+
+    def close(self):
+        pass
+
+class PrefetchLoader:
+    """
+    Runs batcher.sample() on a daemon thread and keeps up to `depth` ready
+    host batches in a bounded queue, so the training loop only blocks when the
+    queue runs dry (slow disk, cold page cache). The batcher needs depth + 2
+    host buffers: `depth` queued, one being filled and one being copied out.
+    """
+
+    def __init__(self, batcher, depth=4):
+        assert len(batcher.host) >= depth + 2, "batcher needs n_buffers >= depth + 2"
+        self.batcher = batcher
+        self.queue = queue.Queue(maxsize=depth)
+        self.data_wait = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self.batcher.sample()
+            except Exception as e: # hand the error to the consumer
+                item = e
+            while not self._stop.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(item, Exception):
+                return
+
+    def __call__(self):
+        t0 = time.perf_counter()
+        item = self.queue.get()
+        self.data_wait += time.perf_counter() - t0
+        if isinstance(item, Exception):
+            raise item
+        return self.batcher.to_device(item)
+
+    def pop_data_wait(self):
+        """Seconds spent waiting for data since the last call."""
+        wait, self.data_wait = self.data_wait, 0.0
+        return wait
+
+    def state_dict(self):
+        # queued batches are not consumed yet, so this is the batcher's view of the caller
+        return self.batcher.state_dict()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+def make_loader(data_dir, split, block_size, batch_size, device, dtype=None, prefetch=0, seed=None,
+                sampler=None, packer=None, transposer=None):
+    """A PrefetchLoader `prefetch` batches deep, or a plain TokenBatcher if prefetch is 0."""
+    if not prefetch:
+        return TokenBatcher(data_dir, split, block_size, batch_size, device, dtype=dtype, seed=seed,
+                            sampler=sampler, packer=packer, transposer=transposer)
+    batcher = TokenBatcher(data_dir, split, block_size, batch_size, device, dtype=dtype,
+                           n_buffers=prefetch + 2, seed=seed, sampler=sampler, packer=packer,
+                           transposer=transposer)
+    return PrefetchLoader(batcher, depth=prefetch)
@@ -0,0 +1,79 @@
+"""
+Serve dataset splits from shared memory to every training job on this host.
+Each split is read once (flat, sharded or block-compressed) into a POSIX
+shared-memory segment; token_data.open_tokens() in train.py, train_rnn.py,
+bench.py, ... then maps that segment read-only instead of the files, so N
+concurrent sweep jobs hold one copy of the data and start without reading it.
+Every job still builds its own batches (own sampler, seed and prefetch) from
+the zero-copy view. Jobs started while the server is down, or after the data
+changed (dataset_version), read the files as before.
+Run from nanoGPT-master: python data_server.py --data_dir data/abc_char [--splits train val]
+Stop with Ctrl-C (or SIGTERM); segments are removed on exit. Jobs already
+attached keep their mapping until they finish.
+"""
+import os
+import sys
+import mmap
+import time
+import signal
+import argparse
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+from token_data import open_tokens, data_dtype, shared_name, write_shared_header, SHM_HEADER
+
+COPY_TOKENS = 1 << 26
+
+def serve(data_dir, split, hugepages=False):
+    """Copy a split into a new shared-memory segment and return the segment."""
+    dtype = data_dtype(data_dir)
+    src = open_tokens(data_dir, split, dtype=dtype, shared=False)
+    n_tokens = len(src)
+    size = SHM_HEADER + n_tokens * dtype.itemsize
+    if os.path.isdir("/dev/shm"):
+        st = os.statvfs("/dev/shm")
+        if st.f_bavail * st.f_frsize < size: # tmpfs would SIGBUS on the copy instead
+            raise RuntimeError(f"/dev/shm has {st.f_bavail * st.f_frsize / 1e9:.2f} GB free, "
+                               f"{split} needs {size / 1e9:.2f} GB (docker: --shm-size)")
+    name = shared_name(data_dir, split)
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        raise RuntimeError(f"{split} is already served as /dev/shm/{name} (another data_server.py?)")
+    if hugepages and hasattr(mmap, "MADV_HUGEPAGE"):
+        # needs /sys/kernel/mm/transparent_hugepage/shmem_enabled = advise (or always)
+        shm._mmap.madvise(mmap.MADV_HUGEPAGE)
+    dst = np.ndarray((n_tokens,), dtype=dtype, buffer=shm.buf, offset=SHM_HEADER)
+    for i in range(0, n_tokens, COPY_TOKENS):
+        dst[i:i + COPY_TOKENS] = src[i:i + COPY_TOKENS]
+    del dst
+    write_shared_header(shm.buf, n_tokens, dtype) # last: clients now see a complete segment
+    return shm
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/abc_char")
+    parser.add_argument("--splits", nargs="+", default=["train", "val"])
+    parser.add_argument("--hugepages", action="store_true", help="back the segments with transparent huge pages")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # unlink on kill as on Ctrl-C
+    segments = []
+    try:
+        for split in args.splits:
+            t0 = time.time()
+            shm = serve(args.data_dir, split, args.hugepages)
+            segments.append(shm)
+            print(f"[OK] {split}: {(shm.size - SHM_HEADER) / 1e6:.1f} MB in /dev/shm/{shm.name} "
+                  f"({time.time() - t0:.1f}s)")
+        print(f"[INFO] Serving {args.data_dir}, Ctrl-C to stop")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # a second Ctrl-C must not leave segments behind
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+        print("[DONE] segments removed")
@@ -37,23 +37,25 @@ class LSTMLanguageModel(nn.Module):
             if hasattr(module, "bias") and module.bias is not None:
                 nn.init.zeros_(module.bias)
 
-    def forward(self, idx, targets=None):
+    def forward(self, idx, targets=None, hidden=None):
         """
         idx: (B, T)
         targets: (B, T)
+        hidden: (h, c) left by the previous segment of the same rows, None for zeros
+        returns logits, loss and the (h, c) after the last position
         """
-        x = self.embed(idx)          # (B, T, H)
-        x, _ = self.lstm(x)          # (B, T, H)
-        logits = self.lm_head(x)     # (B, T, V)
+        x = self.embed(idx)              # (B, T, H)
+        x, hidden = self.lstm(x, hidden) # (B, T, H)
+        logits = self.lm_head(x)         # (B, T, V)
 
         loss = None
         if targets is not None:
             loss = F.cross_entropy(
                 logits.view(-1, logits.size(-1)),
-                targets.view(-1),
+                targets.reshape(-1),
             )
 
-        return logits, loss
+        return logits, loss, hidden
 
     def num_parameters(self):
         return sum(p.numel() for p in self.parameters())
@@ -2,6 +2,7 @@
 Sample from a trained model
 """
 import os
+import sys
 import pickle
 from contextlib import nullcontext
 import torch
@@ -66,6 +67,12 @@ if load_meta:
     stoi, itos = meta['stoi'], meta['itos']
     encode = lambda s: [stoi[c] for c in s]
     decode = lambda l: ''.join([itos[i] for i in l])
+    if 'merges' in meta:
+        # BPE dataset (data/abc_bpe): prompts get the same segmentation as the training data
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'part1'))
+        from abc_bpe import AbcBPE
+        n_chars = meta['vocab_size'] - len(meta['merges']) - (meta.get('eot_token') is not None)
+        encode = AbcBPE([itos[i] for i in range(n_chars)], meta['merges']).encode
 else:
     # ok let's assume gpt-2 encodings by default
     print("No meta.pkl found, assuming GPT-2 encodings...")
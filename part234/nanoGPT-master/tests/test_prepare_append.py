@@ -0,0 +1,138 @@
+"""
+prepare_abc_char.py --append killed before its manifest is saved: the rerun
+must drop the partial append and end up identical to an uninterrupted one.
+An append to a split that --compress left compressed only restores it first.
+A split whose manifest still has shuffle_abc_char.py's `shuffling` marker is rebuilt.
+Run from nanoGPT-master: python -m pytest tests
+"""
+import os
+import sys
+import json
+import random
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "data", "abc_char"))
+import prepare_abc_char as prep
+
+CHARS = sorted(set("XTKLM:|[]/,'=^_ \nabcdefgABCDEFGz0123456789"))
+
+class SerialPool:
+    imap = imap_unordered = staticmethod(map)
+
+class Killed(Exception):
+    pass
+
+def write_tunes(root, names, seed):
+    rng = random.Random(seed)
+    paths = []
+    for name in names:
+        body = " ".join(rng.choice("abcdefgABCDEFGz") + rng.choice(["", "2", "/2"]) for _ in range(rng.randint(20, 80)))
+        path = os.path.join(root, name + ".abc")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"X:1\nT:{name}\nK:C\n{body} |\n")
+        paths.append(path)
+    return paths
+
+def outputs(out_dir, split="train", keys=("plan", "documents", "tokens", "blake2b", "chunk_blake2b")):
+    paths = prep.split_paths(split, str(out_dir))
+    manifest = prep.load_json(paths["manifest"])
+    with open(paths["bin"], "rb") as f:
+        data = f.read()
+    return (data, np.load(paths["idx"]).tolist(), prep.load_file_list_raw(paths["files"]),
+            {k: manifest[k] for k in keys})
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(prep, "MANIFEST_DIR", str(tmp_path / "no_manifest"))
+    monkeypatch.setattr(prep, "CHUNK_SIZE", 4)
+    stoi = {ch: i for i, ch in enumerate(CHARS)}
+    encoder = prep.CharEncoder(stoi)
+    prep.init_worker(encoder, prep.token_dtype(len(stoi)))
+    (tmp_path / "abc").mkdir()
+    old = write_tunes(str(tmp_path / "abc"), [f"a{i:02d}" for i in range(10)], seed=0)
+    new = write_tunes(str(tmp_path / "abc"), [f"b{i:02d}" for i in range(7)], seed=1)
+    return tmp_path, encoder, old, new
+
+def build(out_dir, files, encoder, append=False):
+    out_dir.mkdir(exist_ok=True)
+    fn = prep.append_split if append else prep.build_split
+    return fn(SerialPool(), files, "train", "list.txt", encoder, out_dir=str(out_dir))
+
+@pytest.mark.parametrize("kill_at", ["write_chunks", "replace_index", "replace_file_list", "files_checksum", "save_json"])
+def test_interrupted_append_is_redone(corpus, monkeypatch, kill_at):
+    tmp_path, encoder, old, new = corpus
+    build(tmp_path / "ref", old, encoder)
+    build(tmp_path / "ref", old + new, encoder, append=True)
+
+    build(tmp_path / "out", old, encoder)
+    version = prep.load_json(prep.split_paths("train", str(tmp_path / "out"))["manifest"])["version"]
+    with monkeypatch.context() as m:
+        def kill(*args, **kwargs):
+            raise Killed()
+        m.setattr(prep, kill_at, kill)
+        with pytest.raises(Killed):
+            build(tmp_path / "out", old + new, encoder, append=True)
+
+    manifest, appended = build(tmp_path / "out", old + new, encoder, append=True)
+    assert appended and manifest["version"] == version + 1
+    assert outputs(tmp_path / "out") == outputs(tmp_path / "ref")
+    assert not os.path.exists(prep.split_paths("train", str(tmp_path / "out"))["spill"])
+
+def test_append_matches_fresh_build(corpus):
+    tmp_path, encoder, old, new = corpus
+    build(tmp_path / "inc", old, encoder)
+    build(tmp_path / "inc", old + new, encoder, append=True)
+    _, appended = build(tmp_path / "inc", old + new, encoder, append=True)
+    assert not appended
+    build(tmp_path / "full", old + new, encoder)
+    keys = ("plan", "documents", "tokens", "blake2b") # chunk boundaries differ
+    assert outputs(tmp_path / "inc", keys=keys) == outputs(tmp_path / "full", keys=keys)
+
+class SpillingEncoder(prep.CharEncoder):
+    spill_counts = True # as BPEEncoder: phase 1 encodes and keeps the ids for phase 2
+
+def test_spilled_counts_match_lut_counts(corpus):
+    tmp_path, encoder, old, new = corpus
+    build(tmp_path / "lut", old, encoder)
+    build(tmp_path / "lut", old + new, encoder, append=True)
+    spilling = SpillingEncoder({ch: i for i, ch in enumerate(CHARS)})
+    build(tmp_path / "spill", old, spilling)
+    build(tmp_path / "spill", old + new, spilling, append=True)
+    assert outputs(tmp_path / "spill") == outputs(tmp_path / "lut")
+    assert not os.path.exists(prep.split_paths("train", str(tmp_path / "spill"))["spill"])
+
+def test_append_to_compressed_split(corpus):
+    tmp_path, encoder, old, new = corpus
+    build(tmp_path / "ref", old, encoder)
+    build(tmp_path / "ref", old + new, encoder, append=True)
+
+    out = str(tmp_path / "out")
+    build(tmp_path / "out", old, encoder)
+    prep.compress_split(out, "train", block_tokens=64, dtype=prep.DTYPE)
+    prep.drop_raw(out, "train", prep.DTYPE)
+    assert not prep.raw_paths(out, "train")
+    build(tmp_path / "out", old + new, encoder, append=True)
+    assert outputs(tmp_path / "out") == outputs(tmp_path / "ref")
+    assert not any(os.path.exists(p) for p in prep.block_paths(out, "train")) # stale after the append
+
+@pytest.mark.parametrize("append", [False, True])
+def test_interrupted_shuffle_is_rebuilt(corpus, append):
+    tmp_path, encoder, old, _ = corpus
+    build(tmp_path / "ref", old, encoder)
+
+    build(tmp_path / "out", old, encoder)
+    paths = prep.split_paths("train", str(tmp_path / "out"))
+    # as shuffle_abc_char.py leaves it when killed after replacing some of its files
+    prep.save_json(paths["manifest"], dict(prep.load_json(paths["manifest"]), shuffling=True))
+    with open(paths["bin"], "r+b") as f:
+        data = f.read()
+        f.seek(0)
+        f.write(data[::-1])
+    np.save(paths["shuffle"], np.arange(len(old), dtype=np.uint64)[::-1])
+
+    _, changed = build(tmp_path / "out", old, encoder, append=append)
+    assert changed
+    assert outputs(tmp_path / "out") == outputs(tmp_path / "ref")
+    assert "shuffling" not in prep.load_json(paths["manifest"])
+    assert not os.path.exists(paths["shuffle"])
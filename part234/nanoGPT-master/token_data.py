@@ -0,0 +1,356 @@
+"""
+Token storage shared by the data prepare scripts and the training / eval readers.
+A split is stored either as one flat <split>.bin, or sharded:
+  <split>.shards.json         dtype, shard size and cumulative token offsets
+  <split>.000000.bin, ...     fixed-size shards (the last one may be shorter)
+or block-compressed (see compress_split() below). prepare_abc_char.py --compress
+deletes the raw files once the compressed copy checks out (drop_raw()).
+A split can also be served from shared memory by data_server.py, so that
+concurrent jobs on one host share a single copy of it.
+open_tokens() returns something that indexes like the flat memmap in every case.
+The storage dtype is meta.pkl's "dtype" (uint8 for small vocabs), uint16 if absent.
+"""
+import os
+import json
+import zlib
+import pickle
+import struct
+import hashlib
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from collections import OrderedDict
+import numpy as np
+
+def shard_index_path(data_dir, split):
+    return os.path.join(data_dir, f"{split}.shards.json")
+
+def shard_path(data_dir, split, shard):
+    return os.path.join(data_dir, f"{split}.{shard:06d}.bin")
+
+def shard_layout(total_tokens, shard_tokens):
+    """[(shard, first token, n tokens)] covering total_tokens."""
+    return [(s, lo, min(shard_tokens, total_tokens - lo))
+            for s, lo in enumerate(range(0, total_tokens, shard_tokens))]
+
+def write_shard_index(data_dir, split, total_tokens, shard_tokens, dtype="uint16"):
+    layout = shard_layout(total_tokens, shard_tokens)
+    index = {
+        "dtype": dtype,
+        "shard_tokens": shard_tokens,
+        "shards": [os.path.basename(shard_path(data_dir, split, s)) for s, _, _ in layout],
+        "offsets": [lo for _, lo, _ in layout] + [total_tokens],
+    }
+    path = shard_index_path(data_dir, split)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+class _SegmentedTokens:
+    """
+    1-D token array stored as consecutive segments (shards or compressed blocks)
+    of a fixed size, except maybe the last. Subclasses provide _segment(s).
+    Supports len(), integer indexing and contiguous slices; a slice inside one
+    segment is a view, one that straddles segments is a concatenated copy.
+    """
+
+    def _init_segments(self, offsets, seg_tokens, dtype):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.seg_tokens = seg_tokens
+        self.dtype = np.dtype(dtype)
+        # fixed-size segments -> segment of token k is k // seg_tokens (O(1))
+        sizes = np.diff(self.offsets)
+        self._fixed = bool(np.all(sizes[:-1] == seg_tokens))
+        self._n_segments = len(sizes)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _locate(self, k):
+        if self._fixed:
+            return min(k // self.seg_tokens, self._n_segments - 1)
+        return int(np.searchsorted(self.offsets, k, side="right")) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise IndexError(f"{type(self).__name__} only supports contiguous slices")
+            if stop <= start:
+                return np.zeros(0, dtype=self.dtype)
+            s0, s1 = self._locate(start), self._locate(stop - 1)
+            if s0 == s1:
+                lo = self.offsets[s0]
+                return self._segment(s0)[start - lo:stop - lo]
+            parts = []
+            for s in range(s0, s1 + 1):
+                lo = self.offsets[s]
+                parts.append(self._segment(s)[max(start, lo) - lo:min(stop, self.offsets[s + 1]) - lo])
+            return np.concatenate(parts)
+        k = int(key)
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        s = self._locate(k)
+        return self._segment(s)[k - self.offsets[s]]
+
+class ShardedTokens(_SegmentedTokens):
+    """Read-only view of a sharded split as one array; shards are memory-mapped lazily."""
+
+    def __init__(self, data_dir, split):
+        with open(shard_index_path(data_dir, split), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._init_segments(index["offsets"], index["shard_tokens"], index["dtype"])
+        self.shard_tokens = index["shard_tokens"]
+        self.paths = [os.path.join(data_dir, name) for name in index["shards"]]
+        self._maps = [None] * len(self.paths)
+
+    def _segment(self, s):
+        m = self._maps[s]
+        if m is None:
+            m = self._maps[s] = np.memmap(self.paths[s], dtype=self.dtype, mode="r")
+        return m
+
+# -----------------------------------------------------------------------------
+# Block-compressed splits: the token stream cut into fixed-size blocks, each
+# compressed on its own, so a random window only decodes the blocks it touches.
+#   <split>.blocks.json   codec, level, dtype, block_tokens, total_tokens
+#   <split>.blocks.npy    uint64 byte offset of every block (+ end) in .blocks.bin
+#   <split>.blocks.bin    concatenated compressed blocks
+
+BLOCK_TOKENS = 1 << 15
+
+def block_paths(data_dir, split):
+    stem = os.path.join(data_dir, split)
+    return stem + ".blocks.json", stem + ".blocks.npy", stem + ".blocks.bin"
+
+def default_codec():
+    """zstd if the zstandard package is installed, else zlib from the stdlib."""
+    try:
+        import zstandard  # noqa: F401
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+def _compressor(codec, level):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress
+    if codec == "zlib":
+        return lambda b: zlib.compress(b, level)
+    raise ValueError(f"unknown codec {codec!r}")
+
+def _decompressor(codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "zlib":
+        return zlib.decompress
+    raise ValueError(f"unknown codec {codec!r}")
+
+def _compress_block(args):
+    codec, level, raw = args
+    return _compressor(codec, level)(raw)
+
+def compress_split(data_dir, split, block_tokens=BLOCK_TOKENS, codec=None, level=3, workers=1, dtype=None):
+    """
+    Write the block-compressed copy of a split (flat or sharded), compressing
+    blocks in parallel. Returns (raw bytes, compressed bytes).
+    """
+    codec = codec or default_codec()
+    src = open_tokens(data_dir, split, dtype=dtype, shared=False)
+    n = len(src)
+    index_path, offsets_path, blob_path = block_paths(data_dir, split)
+    jobs = ((codec, level, np.ascontiguousarray(src[lo:lo + block_tokens]).tobytes())
+            for lo in range(0, n, block_tokens))
+    offsets = [0]
+    with open(blob_path + ".tmp", "wb") as f:
+        if workers > 1:
+            with mp.Pool(workers) as pool:
+                for blob in pool.imap(_compress_block, jobs, chunksize=16):
+                    f.write(blob)
+                    offsets.append(offsets[-1] + len(blob))
+        else:
+            for job in jobs:
+                blob = _compress_block(job)
+                f.write(blob)
+                offsets.append(offsets[-1] + len(blob))
+    os.replace(blob_path + ".tmp", blob_path)
+    np.save(offsets_path, np.array(offsets, dtype=np.uint64))
+    index = {"codec": codec, "level": level, "dtype": src.dtype.name,
+             "block_tokens": block_tokens, "total_tokens": n}
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_path + ".tmp", index_path)
+    return n * src.dtype.itemsize, offsets[-1]
+
+class BlockCompressedTokens(_SegmentedTokens):
+    """
+    Read-only view of a block-compressed split as one array. Touched blocks are
+    decoded on demand and kept in an LRU cache of `cache_blocks` decoded blocks.
+    """
+
+    def __init__(self, data_dir, split, cache_blocks=256):
+        index_path, offsets_path, blob_path = block_paths(data_dir, split)
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        n, bt = index["total_tokens"], index["block_tokens"]
+        self._init_segments(list(range(0, n, bt)) + [n], bt, index["dtype"])
+        self.codec = index["codec"]
+        self.byte_offsets = np.load(offsets_path).astype(np.int64)
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if self.byte_offsets[-1] else None
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+        self._decompress = _decompressor(self.codec)
+        self.hits = self.misses = 0
+
+    def _segment(self, b):
+        block = self._cache.get(b)
+        if block is not None:
+            self._cache.move_to_end(b)
+            self.hits += 1
+            return block
+        self.misses += 1
+        raw = self._decompress(self.blob[self.byte_offsets[b]:self.byte_offsets[b + 1]].tobytes())
+        block = np.frombuffer(raw, dtype=self.dtype)
+        self._cache[b] = block
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+_BLOCK_READERS = {}
+
+def raw_paths(data_dir, split):
+    """Uncompressed files of a split: the flat .bin, or the shard index and its shards."""
+    flat = os.path.join(data_dir, f"{split}.bin")
+    if os.path.exists(flat):
+        return [flat]
+    index_path = shard_index_path(data_dir, split)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "r", encoding="utf-8") as f:
+        shards = json.load(f)["shards"]
+    return [index_path] + [os.path.join(data_dir, name) for name in shards]
+
+def drop_raw(data_dir, split, dtype=None):
+    """
+    Check the block-compressed copy of a split against the raw tokens, block by
+    block, then delete the raw files so open_tokens() reads the compressed copy.
+    Returns the number of bytes freed.
+    """
+    raw = open_tokens(data_dir, split, dtype=dtype, shared=False)
+    packed = BlockCompressedTokens(data_dir, split, cache_blocks=1)
+    if len(packed) != len(raw) or packed.dtype != raw.dtype:
+        raise RuntimeError(f"{split}: compressed copy has {len(packed):,} {packed.dtype} tokens, "
+                           f"raw has {len(raw):,} {raw.dtype}")
+    bt = packed.seg_tokens
+    for lo in range(0, len(raw), bt):
+        if not np.array_equal(raw[lo:lo + bt], packed[lo:lo + bt]):
+            raise RuntimeError(f"{split}: compressed block {lo // bt} differs from the raw tokens")
+    del raw
+    paths = raw_paths(data_dir, split)
+    freed = sum(os.path.getsize(p) for p in paths)
+    for p in paths:  # the flat .bin / shard index first: without it the split reads as compressed
+        os.remove(p)
+    return freed
+
+def meta_dtype(meta):
+    """Storage dtype recorded in a meta dict; GPT-2 style datasets without one are uint16."""
+    return np.dtype((meta or {}).get("dtype", "uint16"))
+
+def data_dtype(data_dir):
+    """meta_dtype() of <data_dir>/meta.pkl (uint16 if there is none)."""
+    meta_path = os.path.join(data_dir, "meta.pkl")
+    if not os.path.exists(meta_path):
+        return np.dtype(np.uint16)
+    with open(meta_path, "rb") as f:
+        return meta_dtype(pickle.load(f))
+
+# shared-memory segment: header, then the tokens. The magic is written last, so a
+# segment that is still being filled is ignored
+SHM_HEADER = 64
+SHM_MAGIC = b"ABCTOKS1"
+_SHARED = {}
+
+def shared_name(data_dir, split):
+    """
+    Segment name data_server.py serves a split under. It includes meta.pkl's
+    dataset_version, so a rebuilt / appended / shuffled split never matches an
+    old segment.
+    """
+    version = 0
+    meta_path = os.path.join(data_dir, "meta.pkl")
+    if os.path.exists(meta_path):
+        with open(meta_path, "rb") as f:
+            version = pickle.load(f).get("dataset_version", 0)
+    key = f"{os.path.realpath(data_dir)}|{split}|{version}"
+    return "abc_" + hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+def write_shared_header(buf, n_tokens, dtype):
+    struct.pack_into("8sQ16s", buf, 0, SHM_MAGIC, n_tokens, np.dtype(dtype).name.encode())
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # attaching registers the segment with this process's resource tracker,
+        # which would unlink it when we exit; it belongs to the server
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def open_shared(data_dir, split, dtype):
+    """Read-only view of a split served by data_server.py, None if it is not served."""
+    name = shared_name(data_dir, split)
+    if name not in _SHARED:
+        try:
+            shm = _attach(name)
+        except FileNotFoundError:
+            return None
+        magic, n_tokens, stored = struct.unpack_from("8sQ16s", shm.buf)
+        if magic != SHM_MAGIC:
+            shm.close()
+            return None
+        view = np.ndarray((n_tokens,), dtype=stored.rstrip(b"\0").decode(), buffer=shm.buf, offset=SHM_HEADER)
+        view.flags.writeable = False
+        _SHARED[name] = (shm, view) # the mapping lives as long as the process
+    view = _SHARED[name][1]
+    return view if view.dtype == dtype else None
+
+def doc_starts(data_dir, split):
+    """Token offset of every tune in a split (<split>.idx.npy, written by prepare_abc_char.py)."""
+    path = os.path.join(data_dir, f"{split}.idx.npy")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, rebuild the split with prepare_abc_char.py")
+    return np.load(path, mmap_mode="r")
+
+def open_tokens(data_dir, split, dtype=None, shared=True):
+    """
+    The shared-memory copy if data_server.py serves the split (and `shared`),
+    else a memmap of <split>.bin, else a ShardedTokens view if the split is
+    sharded, else a BlockCompressedTokens view if it is block-compressed. The
+    raw layouts win when both exist: a compressed split is only read once
+    drop_raw() (prepare_abc_char.py --compress without --keep_raw) removed them. The
+    compressed reader is kept across calls (keyed on its index file) so its
+    block cache survives the per-batch open_tokens() in train.py.
+    dtype defaults to the one recorded in meta.pkl; pass it to skip reading meta.pkl.
+    """
+    if dtype is None:
+        dtype = data_dtype(data_dir)
+    if shared:
+        view = open_shared(data_dir, split, np.dtype(dtype))
+        if view is not None:
+            return view
+    flat = os.path.join(data_dir, f"{split}.bin")
+    if os.path.exists(flat):
+        return np.memmap(flat, dtype=dtype, mode="r")
+    if os.path.exists(shard_index_path(data_dir, split)):
+        return ShardedTokens(data_dir, split)
+    index_path = block_paths(data_dir, split)[0]
+    if os.path.exists(index_path):
+        key = (os.path.abspath(index_path), os.path.getmtime(index_path))
+        reader = _BLOCK_READERS.get(key)
+        if reader is None:
+            reader = _BLOCK_READERS[key] = BlockCompressedTokens(data_dir, split)
+        return reader
+    raise FileNotFoundError(f"{split}.bin / .shards.json / .blocks.json not found in {data_dir}")
@@ -28,6 +28,8 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.distributed import init_process_group, destroy_process_group
 
 from model import GPTConfig, GPT
+from token_data import open_tokens, meta_dtype, doc_starts
+from data_loader import make_loader, EpochSampler, ChunkWindows, DocPacker, Transposer
 
 # -----------------------------------------------------------------------------
 # default config values designed to train a gpt2 (124M) on OpenWebText
@@ -48,6 +50,13 @@ dataset = 'openwebtext'
 gradient_accumulation_steps = 5 * 8 # used to simulate larger batch sizes
 batch_size = 12 # if gradient_accumulation_steps > 1, this is the micro-batch size
 block_size = 1024
+prefetch = 0 # batches assembled ahead on a background thread (0: on the main thread)
+sampling = 'random' # 'random': i.i.d. window starts; 'epoch': every non-overlapping block once per epoch, resumable;
+                   # 'chunked': random windows from a rolling buffer of sequentially read chunks (data larger than RAM)
+chunk_mb = 64 # 'chunked' sampling: size of one contiguous read
+chunk_depth = 8 # 'chunked' sampling: resident chunks that windows are drawn from
+packing = False # fill rows with whole tunes (needs <split>.idx.npy), attention and positions restart per tune
+transpose = 0 # abc_char: move every training window to a random key up to this many semitones away (0: off)
 # model
 n_layer = 12
 n_head = 12
@@ -113,35 +122,63 @@ ctx = nullcontext() if device_type == 'cpu' else torch.amp.autocast(device_type=
 
 # poor man's data loader
 data_dir = os.path.join('data', dataset)
-def get_batch(split):
-    # We recreate np.memmap every batch to avoid a memory leak, as per
-    # https://stackoverflow.com/questions/45132940/numpy-memmap-memory-usage-want-to-iterate-once/61472122#61472122
-    if split == 'train':
-        data = np.memmap(os.path.join(data_dir, 'train.bin'), dtype=np.uint16, mode='r')
-    else:
-        data = np.memmap(os.path.join(data_dir, 'val.bin'), dtype=np.uint16, mode='r')
-    ix = torch.randint(len(data) - block_size, (batch_size,))
-    x = torch.stack([torch.from_numpy((data[i:i+block_size]).astype(np.int64)) for i in ix])
-    y = torch.stack([torch.from_numpy((data[i+1:i+1+block_size]).astype(np.int64)) for i in ix])
-    if device_type == 'cuda':
-        # pin arrays x,y, which allows us to move them to GPU asynchronously (non_blocking=True)
-        x, y = x.pin_memory().to(device, non_blocking=True), y.pin_memory().to(device, non_blocking=True)
-    else:
-        x, y = x.to(device), y.to(device)
-    return x, y
+loaders = {}
+def get_batch(split, eval=False):
+    # one loader per split: a long-lived mapping (re-opened every 1000 batches to bound
+    # its memory), one vectorized (B, T+1) gather, int64 widening on device, and with
+    # prefetch > 0 all of that on a background thread, `prefetch` batches ahead.
+    # eval batches come from their own loaders, so estimate_loss() does not eat into
+    # the training epoch. returns (X, Y, S): S holds per-token tune ids when packing, else None
+    split = 'train' if split == 'train' else 'val'
+    key = split + ('_eval' if eval else '')
+    if key not in loaders:
+        # private RNG per (rank, loader), so batches do not depend on the prefetch depth
+        seed = 4 * (1337 + seed_offset) + 2 * eval + (split == 'val')
+        sampler, packer = None, None
+        n_tokens = len(open_tokens(data_dir, split, dtype=data_dtype))
+        if packing:
+            # tunes in epoch order; the training loader's order is shared by all ranks (same seed)
+            packer = DocPacker(doc_starts(data_dir, split), n_tokens, seed=1337 if key == 'train' else seed,
+                               rank=seed_offset, world_size=ddp_world_size)
+        elif key == 'train' and sampling == 'epoch':
+            # one permutation shared by all ranks (same seed), each rank takes its own positions
+            sampler = EpochSampler(n_tokens, block_size, seed=1337, rank=seed_offset, world_size=ddp_world_size)
+        elif key == 'train' and sampling == 'chunked':
+            sampler = ChunkWindows(n_tokens, block_size, chunk_mb * 2**20 // data_dtype.itemsize, depth=chunk_depth,
+                                   seed=1337, rank=seed_offset, world_size=ddp_world_size)
+        transposer = None
+        if key == 'train' and transpose:
+            assert not packing, "transpose works on windows, not packed tunes"
+            transposer = Transposer(meta['stoi'], transpose, seed=1337, rank=seed_offset)
+        position = packer or sampler
+        if key == 'train' and position is not None and sampler_state is not None:
+            if set(sampler_state) == set(position.state_dict()):
+                position.load_state_dict(sampler_state)
+            else:
+                print("checkpoint sampler state is for another sampling mode, starting a new epoch")
+        loaders[key] = make_loader(data_dir, split, block_size, batch_size, device, dtype=data_dtype,
+                                   prefetch=prefetch, seed=seed, sampler=sampler, packer=packer,
+                                   transposer=transposer)
+    batch = loaders[key]()
+    return batch if packing else (*batch, None)
 
 # init these up here, can override if init_from='resume' (i.e. from a checkpoint)
 iter_num = 0
 best_val_loss = 1e9
+sampler_state = None
 
 # attempt to derive vocab_size from the dataset
 meta_path = os.path.join(data_dir, 'meta.pkl')
 meta_vocab_size = None
+meta_dataset_version = None
+data_dtype = meta_dtype(None) # uint16 unless meta.pkl says otherwise
 if os.path.exists(meta_path):
     with open(meta_path, 'rb') as f:
         meta = pickle.load(f)
     meta_vocab_size = meta['vocab_size']
-    print(f"found vocab_size = {meta_vocab_size} (inside {meta_path})")
+    meta_dataset_version = meta.get('dataset_version')
+    data_dtype = meta_dtype(meta)
+    print(f"found vocab_size = {meta_vocab_size}, token dtype = {data_dtype.name} (inside {meta_path})")
 
 # model init
 model_args = dict(n_layer=n_layer, n_head=n_head, n_embd=n_embd, block_size=block_size,
@@ -178,6 +215,10 @@ elif init_from == 'resume':
     model.load_state_dict(state_dict)
     iter_num = checkpoint['iter_num']
     best_val_loss = checkpoint['best_val_loss']
+    sampler_state = checkpoint.get('sampler') # None for random sampling or older checkpoints
+    # bins grown by prepare_abc_char.py --append are picked up as-is (the loaders re-open the split every 1000 batches)
+    if checkpoint.get('dataset_version') != meta_dataset_version:
+        print(f"dataset changed since checkpoint: version {checkpoint.get('dataset_version')} -> {meta_dataset_version}")
 elif init_from.startswith('gpt2'):
     print(f"Initializing from OpenAI GPT-2 weights: {init_from}")
     # initialize from OpenAI GPT-2 weights
@@ -219,9 +260,9 @@ def estimate_loss():
     for split in ['train', 'val']:
         losses = torch.zeros(eval_iters)
         for k in range(eval_iters):
-            X, Y = get_batch(split)
+            X, Y, S = get_batch(split, eval=True)
             with ctx:
-                logits, loss = model(X, Y)
+                logits, loss = model(X, Y, S)
             losses[k] = loss.item()
         out[split] = losses.mean()
     model.train()
@@ -247,7 +288,7 @@ if wandb_log and master_process:
     wandb.init(project=wandb_project, name=wandb_run_name, config=config)
 
 # training loop
-X, Y = get_batch('train') # fetch the very first batch
+X, Y, S = get_batch('train') # fetch the very first batch
 t0 = time.time()
 local_iter_num = 0 # number of iterations in the lifetime of this process
 raw_model = model.module if ddp else model # unwrap DDP container if needed
@@ -281,6 +322,8 @@ while True:
                     'iter_num': iter_num,
                     'best_val_loss': best_val_loss,
                     'config': config,
+                    'dataset_version': meta_dataset_version,
+                    'sampler': sampler_state,
                 }
                 print(f"saving checkpoint to {out_dir}")
                 torch.save(checkpoint, os.path.join(out_dir, 'ckpt.pt'))
@@ -297,10 +340,12 @@ while True:
             # looking at the source of that context manager, it just toggles this variable
             model.require_backward_grad_sync = (micro_step == gradient_accumulation_steps - 1)
         with ctx:
-            logits, loss = model(X, Y)
+            logits, loss = model(X, Y, S)
             loss = loss / gradient_accumulation_steps # scale the loss to account for gradient accumulation
-        # immediately async prefetch next batch while model is doing the forward pass on the GPU
-        X, Y = get_batch('train')
+        # immediately fetch the next batch (assembled ahead by the loader thread) while the GPU runs the forward pass;
+        # a resumed run restarts from the sampler position before it, since it is not trained on yet
+        sampler_state = loaders['train'].state_dict()
+        X, Y, S = get_batch('train')
         # backward pass, with gradient scaling if training in fp16
         scaler.scale(loss).backward()
     # clip the gradient
@@ -317,6 +362,7 @@ while True:
     t1 = time.time()
     dt = t1 - t0
     t0 = t1
+    data_wait = loaders['train'].pop_data_wait() # time this iteration spent blocked on batches
     if iter_num % log_interval == 0 and master_process:
         # get loss as float. note: this is a CPU-GPU sync point
         # scale up to undo the division above, approximating the true total loss (exact would have been a sum)
@@ -324,7 +370,7 @@ while True:
         if local_iter_num >= 5: # let the training loop settle a bit
             mfu = raw_model.estimate_mfu(batch_size * gradient_accumulation_steps, dt)
             running_mfu = mfu if running_mfu == -1.0 else 0.9*running_mfu + 0.1*mfu
-        print(f"iter {iter_num}: loss {lossf:.4f}, time {dt*1000:.2f}ms, mfu {running_mfu*100:.2f}%")
+        print(f"iter {iter_num}: loss {lossf:.4f}, time {dt*1000:.2f}ms, data wait {data_wait*1000:.2f}ms, mfu {running_mfu*100:.2f}%")
     iter_num += 1
     local_iter_num += 1
 
@@ -332,5 +378,7 @@ while True:
     if iter_num > max_iters:
         break
 
+for loader in loaders.values():
+    loader.close()
 if ddp:
     destroy_process_group()
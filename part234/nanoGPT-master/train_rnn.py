@@ -8,6 +8,8 @@ import torch
 from torch.optim import AdamW
 
 from rnn_model import LSTMLanguageModel
+from token_data import open_tokens, meta_dtype
+from data_loader import make_loader, EpochSampler, LaneSampler, Transposer
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--data_dir", type=str, default="data/abc_char")
@@ -19,39 +21,62 @@ parser.add_argument("--batch_size", type=int, default=256)
 parser.add_argument("--block_size", type=int, default=256)
 parser.add_argument("--learning_rate", type=float, default=3e-4)
 parser.add_argument("--device", type=str, default="cuda")
+parser.add_argument("--prefetch", type=int, default=4,
+                    help="batches assembled ahead on a background thread (0: on the main thread)")
+parser.add_argument("--transpose", type=int, default=0,
+                    help="move every training window to a random key up to this many semitones away (0: off)")
+parser.add_argument("--stateful", action="store_true",
+                    help="truncated BPTT: batch_size contiguous lanes, (h, c) carried from one block to the next")
+parser.add_argument("--init_from", choices=("scratch", "resume"), default="scratch",
+                    help="resume: load <out_dir>/ckpt.pt (model, optimizer, sampler) and train one more epoch")
 args = parser.parse_args()
+if args.stateful and args.transpose:
+    parser.error("--transpose picks a new key per window, lanes must stay in one key (drop one of the two)")
 
 os.makedirs(args.out_dir, exist_ok=True)
 
+ckpt = None
+if args.init_from == "resume":
+    ckpt = torch.load(os.path.join(args.out_dir, "ckpt.pt"), map_location=args.device)
+    print(f"[INFO] Resuming from {args.out_dir}/ckpt.pt (val loss {ckpt['val_loss']:.4f})")
+
 with open(os.path.join(args.data_dir, "meta.pkl"), "rb") as f:
     meta = pickle.load(f)
 
 vocab_size = meta["vocab_size"]
 print(f"[INFO] vocab_size = {vocab_size}")
 
-train_data = np.memmap(
-    os.path.join(args.data_dir, "train.bin"),
-    dtype=np.uint16,
-    mode="r",
-)
-val_data = np.memmap(
-    os.path.join(args.data_dir, "val.bin"),
-    dtype=np.uint16,
-    mode="r",
-)
+train_data = open_tokens(args.data_dir, "train", dtype=meta_dtype(meta))
+val_data = open_tokens(args.data_dir, "val", dtype=meta_dtype(meta))
+
+# training windows: every non-overlapping block exactly once per epoch, in
+# shuffled order, or (stateful) in stream order along batch_size lanes
+if args.stateful:
+    sampler = LaneSampler(len(train_data), args.block_size, args.batch_size)
+else:
+    sampler = EpochSampler(len(train_data), args.block_size, seed=1337)
+if ckpt is not None and ckpt.get("sampler") is not None:
+    # the next epoch (or lane position) after the checkpoint, not the first one again
+    if set(ckpt["sampler"]) == set(sampler.state_dict()):
+        sampler.load_state_dict(ckpt["sampler"])
+    else:
+        print("[WARN] checkpoint sampler state is for the other --stateful mode, starting a new epoch")
+transposer = Transposer(meta["stoi"], args.transpose, seed=1337) if args.transpose else None
+loaders = {
+    split: make_loader(args.data_dir, split, args.block_size, args.batch_size, args.device,
+                       dtype=meta_dtype(meta), prefetch=args.prefetch, seed=1337 + i,
+                       sampler=sampler if split == "train" else None,
+                       transposer=transposer if split == "train" else None)
+    for i, split in enumerate(("train", "val"))
+}
+if args.stateful:
+    # val read the way the model is trained, state carried over the 100 eval blocks
+    val_lanes = LaneSampler(len(val_data), args.block_size, args.batch_size)
+    loaders["val_lanes"] = make_loader(args.data_dir, "val", args.block_size, args.batch_size, args.device,
+                                       dtype=meta_dtype(meta), sampler=val_lanes)
 
 def get_batch(split):
-    data = train_data if split == "train" else val_data
-    ix = torch.randint(len(data) - args.block_size - 1, (args.batch_size,))
-    x = torch.stack([
-        torch.from_numpy((data[i:i+args.block_size]).astype(np.int64))
-        for i in ix
-    ])
-    y = torch.stack([
-        torch.from_numpy((data[i+1:i+args.block_size+1]).astype(np.int64))
-        for i in ix
-    ])
-    return x.to(args.device), y.to(args.device)
+    return loaders[split]()
 
 model = LSTMLanguageModel(
     vocab_size=vocab_size,
@@ -63,19 +88,30 @@ model = LSTMLanguageModel(
 print(f"[INFO] Parameters: {model.num_parameters()/1e6:.2f}M")
 
 optimizer = AdamW(model.parameters(), lr=args.learning_rate)
+if ckpt is not None:
+    model.load_state_dict(ckpt["model_state"])
+    if "optimizer" in ckpt:
+        optimizer.load_state_dict(ckpt["optimizer"])
 
 tokens_per_iter = args.batch_size * args.block_size
-num_iters = len(train_data) // tokens_per_iter
+num_iters = sampler.steps if args.stateful else sampler.per_rank // args.batch_size
 
 print(f"[INFO] tokens / iter = {tokens_per_iter}")
-print(f"[INFO] total iters (≈1 epoch) = {num_iters}")
+print(f"[INFO] total iters (1 epoch) = {num_iters}")
 
 start_time = time.time()
 model.train()
 
+hidden = None
 for it in range(num_iters):
+    if args.stateful and it % sampler.steps == 0:
+        hidden = None # new epoch: lanes start over from the beginning of the split
     xb, yb = get_batch("train")
-    logits, loss = model(xb, yb)
+    if args.stateful:
+        logits, loss, hidden = model(xb, yb, hidden)
+        hidden = tuple(h.detach() for h in hidden) # truncate BPTT at the block boundary
+    else:
+        logits, loss, _ = model(xb, yb)
 
     optimizer.zero_grad(set_to_none=True)
     loss.backward()
@@ -83,27 +119,41 @@ for it in range(num_iters):
 
     if it % 100 == 0:
         elapsed = time.time() - start_time
-        print(f"iter {it}: loss {loss.item():.4f}, time {elapsed:.1f}s")
+        data_wait = loaders["train"].pop_data_wait()
+        print(f"iter {it}: loss {loss.item():.4f}, time {elapsed:.1f}s, data wait {data_wait:.2f}s")
 
 model.eval()
 with torch.no_grad():
     losses = []
     for _ in range(100):
         xb, yb = get_batch("val")
-        _, loss = model(xb, yb)
+        _, loss, _ = model(xb, yb)
         losses.append(loss.item())
     val_loss = sum(losses) / len(losses)
+    if args.stateful:
+        losses, hidden = [], None
+        for _ in range(min(100, val_lanes.steps)):
+            xb, yb = get_batch("val_lanes")
+            _, loss, hidden = model(xb, yb, hidden)
+            losses.append(loss.item())
+        val_loss_lanes = sum(losses) / len(losses)
+for loader in loaders.values():
+    loader.close()
 
 total_time = time.time() - start_time
 
 print("\n===== DONE =====")
 print(f"Train loss (last): {loss.item():.4f}")
 print(f"Val loss: {val_loss:.4f}")
+if args.stateful:
+    print(f"Val loss (lanes, state carried): {val_loss_lanes:.4f}")
 print(f"Time / epoch (min): {total_time/60:.2f}")
 
 ckpt = {
     "model_state": model.state_dict(),
+    "optimizer": optimizer.state_dict(),
     "config": vars(args),
     "val_loss": val_loss,
+    "sampler": loaders["train"].state_dict(),
 }
 torch.save(ckpt, os.path.join(args.out_dir, "ckpt.pt"))